@@ -4,9 +4,13 @@ import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
-from config import BOT_TOKEN, log, ADMINS            
-from db import ensure_schema
+from config import BOT_TOKEN, log, ADMINS, BOT_API_SERVER, BOT_API_LOCAL
+from db import ensure_schema, run_db
+from services import user_map, chat_settings, mutes, ytdlp_pool
+from downloader import close_http
 from handlers.basic import router as basic_router
 from handlers.fun import router as fun_router
 from handlers.moderation import router as moderation_router
@@ -24,8 +28,16 @@ async def notify_admins_startup(bot: Bot, text: str):
             pass
 
 async def main():
-    ensure_schema()
-    bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    await run_db(ensure_schema)
+    await chat_settings.warm()
+    await mutes.load()
+    ytdlp_pool.start()
+    session = None
+    if BOT_API_SERVER:
+        # власний Bot API сервер: великі файли і відправка за локальним шляхом
+        session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_SERVER, is_local=BOT_API_LOCAL))
+        log.info(f"Using Bot API server {BOT_API_SERVER} (local={BOT_API_LOCAL})")
+    bot = Bot(BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp = Dispatcher()
 
     dp.include_router(basic_router)
@@ -53,7 +65,12 @@ async def main():
     start_background_tasks(bot)
 
 #4) polling
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await user_map.flush()
+        await close_http()
+        ytdlp_pool.shutdown()
 
 if __name__ == "__main__":
     try:
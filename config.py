@@ -15,6 +15,16 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
+# DB connection pool
+DB_POOL_SIZE     = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_IDLE_SEC = int(os.getenv("DB_POOL_IDLE_SEC", "300"))
+DB_POOL_TIMEOUT  = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# user_map write-behind
+USER_MAP_FLUSH_SEC   = float(os.getenv("USER_MAP_FLUSH_SEC", "10"))
+USER_MAP_REFRESH_SEC = float(os.getenv("USER_MAP_REFRESH_SEC", "300"))
+USERNAME_CACHE_SIZE  = int(os.getenv("USERNAME_CACHE_SIZE", "20000"))
+
 ADMINS = [1272917367, 276417908]
 
 # alerts.in.ua
@@ -30,8 +40,75 @@ COBALT_API_URL    = os.getenv("COBALT_API_URL", "https://api.cobalt.tools/")
 COBALT_TIMEOUT    = int(os.getenv("COBALT_TIMEOUT", "25"))
 COBALT_MAX_FILE_MB = int(os.getenv("COBALT_MAX_FILE_MB", "49"))
 COBALT_AUTH       = os.getenv("COBALT_AUTH")
+# skip cobalt for a host after host-level errors (service disabled, login, auth) / rate limits
+COBALT_HOST_ERROR_TTL_SEC = int(os.getenv("COBALT_HOST_ERROR_TTL_SEC", "600"))
+COBALT_RATE_LIMIT_TTL_SEC = int(os.getenv("COBALT_RATE_LIMIT_TTL_SEC", "60"))
+# a lowered per-host start quality falls back to the top rung after this long
+COBALT_QUALITY_HINT_TTL_SEC = int(os.getenv("COBALT_QUALITY_HINT_TTL_SEC", "900"))
+
+# Shared HTTP client (cobalt API, CDN downloads)
+HTTP_POOL_LIMIT     = int(os.getenv("HTTP_POOL_LIMIT", "32"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "8"))
+
+# cobalt picker (TikTok slideshows)
+PICKER_CONCURRENCY = int(os.getenv("PICKER_CONCURRENCY", "5"))
+PICKER_TOTAL_MB    = int(os.getenv("PICKER_TOTAL_MB", "49"))
+
+# Download scheduler
+DL_MAX_CONCURRENT = int(os.getenv("DL_MAX_CONCURRENT", "4"))
+DL_PER_CHAT       = int(os.getenv("DL_PER_CHAT", "2"))
+DL_SHORT_SLOTS    = int(os.getenv("DL_SHORT_SLOTS", "3"))
+DL_LONG_SLOTS     = int(os.getenv("DL_LONG_SLOTS", "2"))
+# sequential | race (hedged: after a per-host delay the next backend starts in parallel)
+DL_STRATEGY       = os.getenv("DL_STRATEGY", "sequential")
+DL_HEDGE_DELAYS   = os.getenv("DL_HEDGE_DELAYS", "tiktok.com=4,instagram.com=5,*=10")
+# per-(host, backend) stats window and circuit breaker
+BACKEND_STATS_WINDOW = int(os.getenv("BACKEND_STATS_WINDOW", "50"))
+BREAKER_FAILS        = int(os.getenv("BREAKER_FAILS", "5"))
+BREAKER_COOLDOWN_SEC = int(os.getenv("BREAKER_COOLDOWN_SEC", "300"))
+# yt-dlp engine: pool (warm worker processes via the Python API) | subprocess
+YTDLP_ENGINE          = os.getenv("YTDLP_ENGINE", "pool")
+YTDLP_WORKERS         = int(os.getenv("YTDLP_WORKERS", "2"))
+YTDLP_WORKER_MAX_JOBS = int(os.getenv("YTDLP_WORKER_MAX_JOBS", "25"))
+# live yt-dlp progress in the "Секунду, тягну відео…" message
+DL_PROGRESS_EDIT      = os.getenv("DL_PROGRESS_EDIT", "1") == "1"
+DL_PROGRESS_EVERY_SEC = float(os.getenv("DL_PROGRESS_EVERY_SEC", "5"))
+# pipe direct/cobalt media with a known size straight into the Telegram upload
+DL_STREAM_UPLOAD      = os.getenv("DL_STREAM_UPLOAD", "1") == "1"
+# several links in one message: send as each finishes ("finish") or in message order ("ordered")
+DL_BATCH_ORDER        = os.getenv("DL_BATCH_ORDER", "finish")
+# per-job workspaces in TMP_DIR: disk quota and orphan janitor
+DL_DISK_QUOTA_MB         = int(os.getenv("DL_DISK_QUOTA_MB", "2048"))
+DL_JOB_RESERVE_MB        = int(os.getenv("DL_JOB_RESERVE_MB", "100"))
+DL_QUOTA_WAIT_SEC        = float(os.getenv("DL_QUOTA_WAIT_SEC", "30"))
+DL_WORKSPACE_MAX_AGE_SEC = int(os.getenv("DL_WORKSPACE_MAX_AGE_SEC", "3600"))
+DL_JANITOR_EVERY_SEC     = int(os.getenv("DL_JANITOR_EVERY_SEC", "600"))
+# yt-dlp pre-flight: pick a format that fits the upload limit before downloading
+DL_PREFLIGHT     = os.getenv("DL_PREFLIGHT", "1") == "1"
+DL_MAX_UPLOAD_MB = int(os.getenv("DL_MAX_UPLOAD_MB", "49"))
+# per-link cache: classified failures (seconds per kind) and cobalt/yt-dlp resolutions
+DL_FAIL_TTLS       = os.getenv("DL_FAIL_TTLS", "private=600,not_found=1800,geo=1800,unsupported=3600,too_large=1800")
+DL_RESOLVE_TTL_SEC = int(os.getenv("DL_RESOLVE_TTL_SEC", "300"))
+# self-hosted Bot API server (telegram-bot-api --local): uploads up to 2 GB,
+# files are sent by local path; empty = public api.telegram.org
+BOT_API_SERVER        = os.getenv("BOT_API_SERVER", "")
+BOT_API_LOCAL         = os.getenv("BOT_API_LOCAL", "1") == "1"
+BOT_API_MAX_UPLOAD_MB = int(os.getenv("BOT_API_MAX_UPLOAD_MB", "2000"))
+# ffmpeg post-processing: shrink oversized videos/photos, video size/duration/thumbnail
+TRANSCODE_ENABLED       = os.getenv("TRANSCODE_ENABLED", "1") == "1"
+TRANSCODE_WORKERS       = int(os.getenv("TRANSCODE_WORKERS", "1"))
+TRANSCODE_TIMEOUT_SEC   = int(os.getenv("TRANSCODE_TIMEOUT_SEC", "600"))
+TRANSCODE_MAX_SOURCE_MB = int(os.getenv("TRANSCODE_MAX_SOURCE_MB", "500"))  # biggest source fetched to shrink
+FFMPEG_BIN              = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN             = os.getenv("FFPROBE_BIN", "ffprobe")
+
+# Telegram file_id cache for downloaded media
+MEDIA_CACHE_SIZE    = int(os.getenv("MEDIA_CACHE_SIZE", "512"))
+MEDIA_CACHE_TTL_SEC = int(os.getenv("MEDIA_CACHE_TTL_SEC", str(7 * 24 * 3600)))
 
 # Instagram (instagrapi)
-IG_USERNAME     = os.getenv("IG_USERNAME", "")
-IG_PASSWORD     = os.getenv("IG_PASSWORD", "")
-IG_SESSION_FILE = os.getenv("IG_SESSION_FILE", "ig_session.json")
+IG_USERNAME         = os.getenv("IG_USERNAME", "")
+IG_PASSWORD         = os.getenv("IG_PASSWORD", "")
+IG_SESSION_FILE     = os.getenv("IG_SESSION_FILE", "ig_session.json")
+IG_SESSION_FILES    = os.getenv("IG_SESSION_FILES", "")  # comma-separated pool; empty -> IG_SESSION_FILE
+IG_MIN_INTERVAL_SEC = float(os.getenv("IG_MIN_INTERVAL_SEC", "3"))
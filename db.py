@@ -1,13 +1,241 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import pymysql
-from config import DB_HOST, DB_NAME, DB_USER, DB_PASS
+from config import DB_HOST, DB_NAME, DB_USER, DB_PASS, DB_POOL_SIZE, DB_POOL_IDLE_SEC, DB_POOL_TIMEOUT
 
-def db():
+
+class DBPoolTimeout(RuntimeError):
+    """Жодне з'єднання не звільнилось за DB_POOL_TIMEOUT секунд."""
+
+
+def _connect():
     return pymysql.connect(
         host=DB_HOST, user=DB_USER, password=DB_PASS,
         database=DB_NAME, autocommit=True, charset="utf8mb4",
         cursorclass=pymysql.cursors.DictCursor
     )
 
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class _ConnectionPool:
+    """
+    Обмежений пул з'єднань pymysql (thread-safe).
+
+    - не більше max_size відкритих з'єднань одночасно;
+    - з'єднання, що простояли довше idle_timeout, закриваються;
+    - перед видачею з'єднання пінгується, мертве замінюється новим;
+    - якщо пул вичерпано — чекаємо до wait_timeout, далі DBPoolTimeout.
+    """
+
+    def __init__(self, max_size: int, idle_timeout: float, wait_timeout: float):
+        self.max_size = max(1, int(max_size))
+        self.idle_timeout = float(idle_timeout)
+        self.wait_timeout = float(wait_timeout)
+        self._idle: list[tuple[pymysql.connections.Connection, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        # статистика
+        self.borrowed = 0
+        self.borrows_total = 0
+        self.created = 0
+        self.discarded = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _reap_idle_locked(self, now: float) -> list:
+        if not self._idle:
+            return []
+        fresh, stale = [], []
+        for conn, last_used in self._idle:
+            (stale if now - last_used > self.idle_timeout else fresh).append((conn, last_used))
+        self._idle = fresh
+        self._size -= len(stale)
+        self.discarded += len(stale)
+        return [conn for conn, _ in stale]
+
+    def _checkout(self, started: float):
+        """Повертає idle-з'єднання або None (тоді слот під нове вже зарезервовано)."""
+        deadline = started + self.wait_timeout
+        waited = False
+        stale: list = []
+        try:
+            with self._cond:
+                while True:
+                    stale += self._reap_idle_locked(time.monotonic())
+                    if self._idle:
+                        return self._idle.pop()[0]
+                    if self._size < self.max_size:
+                        self._size += 1
+                        return None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise DBPoolTimeout(f"db pool exhausted ({self.max_size} busy)")
+                    if not waited:
+                        waited = True
+                        self.waits += 1
+                    self._cond.wait(remaining)
+        finally:
+            for conn in stale:
+                _close_quietly(conn)
+
+    def acquire(self) -> pymysql.connections.Connection:
+        started = time.monotonic()
+        conn = self._checkout(started)
+        if conn is not None:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                _close_quietly(conn)
+                with self._cond:
+                    self.discarded += 1
+                conn = None
+        if conn is None:
+            try:
+                conn = _connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self.created += 1
+        waited = time.monotonic() - started
+        with self._cond:
+            self.borrowed += 1
+            self.borrows_total += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+        return conn
+
+    def release(self, conn, broken: bool = False) -> None:
+        reuse = not broken and bool(getattr(conn, "open", False))
+        with self._cond:
+            self.borrowed -= 1
+            if reuse:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+                self.discarded += 1
+            self._cond.notify()
+        if not reuse:
+            _close_quietly(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "open": self._size,
+                "idle": len(self._idle),
+                "borrowed": self.borrowed,
+                "borrows_total": self.borrows_total,
+                "created": self.created,
+                "discarded": self.discarded,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(1000 * self.wait_time_total / self.borrows_total, 2) if self.borrows_total else 0.0,
+                "wait_max_ms": round(1000 * self.wait_time_max, 2),
+            }
+
+
+_pool = _ConnectionPool(DB_POOL_SIZE, DB_POOL_IDLE_SEC, DB_POOL_TIMEOUT)
+
+
+@contextmanager
+def db():
+    """
+    Видає з'єднання з пулу; після `with` повертає його назад.
+    Використання як і раніше: `with db() as conn, conn.cursor() as cur: ...`
+    """
+    conn = _pool.acquire()
+    broken = False
+    try:
+        yield conn
+    except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+        broken = True
+        raise
+    finally:
+        _pool.release(conn, broken)
+
+
+def pool_stats() -> dict:
+    return _pool.stats()
+
+
+# ---------------- async API ----------------
+# Окремий обмежений пул потоків тільки під БД: запити не блокують event loop
+# і не конкурують з asyncio.to_thread (завантаження відео тощо).
+# Потоків рівно стільки, скільки з'єднань у пулі.
+_executor = ThreadPoolExecutor(max_workers=_pool.max_size, thread_name_prefix="db")
+
+
+async def run_db(fn, *args, **kwargs):
+    """Виконує синхронну функцію з БД-логікою у DB-потоці."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _fetchone_sync(sql: str, params: tuple):
+    with db() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchone()
+
+
+def _fetchall_sync(sql: str, params: tuple):
+    with db() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+
+def _execute_sync(sql: str, params: tuple) -> int:
+    with db() as conn, conn.cursor() as cur:
+        return cur.execute(sql, params)
+
+
+def _executemany_sync(sql: str, seq_params: list) -> int:
+    with db() as conn, conn.cursor() as cur:
+        return cur.executemany(sql, seq_params)
+
+
+async def fetchone(sql: str, params: tuple = ()):
+    return await run_db(_fetchone_sync, sql, params)
+
+
+async def fetchall(sql: str, params: tuple = ()):
+    return await run_db(_fetchall_sync, sql, params)
+
+
+async def execute(sql: str, params: tuple = ()) -> int:
+    return await run_db(_execute_sync, sql, params)
+
+
+async def executemany(sql: str, seq_params: list) -> int:
+    if not seq_params:
+        return 0
+    return await run_db(_executemany_sync, sql, seq_params)
+
+def _ensure_column(cur, table: str, column: str, alter_sql: str):
+    """Міграція для вже існуючих таблиць: ALTER, якщо колонки ще немає."""
+    cur.execute("""
+      SELECT 1 FROM information_schema.COLUMNS
+      WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s AND COLUMN_NAME=%s
+    """, (table, column))
+    if not cur.fetchone():
+        cur.execute(f"ALTER TABLE {table} {alter_sql}")
+
 def ensure_schema():
     with db() as conn, conn.cursor() as cur:
         cur.execute("""
@@ -55,8 +283,22 @@ def ensure_schema():
           chat_id    BIGINT NOT NULL,
           user_id    BIGINT NOT NULL,
           username   VARCHAR(255) NULL,
+          username_lc VARCHAR(255) GENERATED ALWAYS AS (LOWER(username)) STORED,
           first_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
           last_seen  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
           PRIMARY KEY (chat_id, user_id),
-          KEY ix_chat_username (chat_id, username)
+          KEY ix_chat_username (chat_id, username),
+          KEY ix_chat_username_lc (chat_id, username_lc)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS media_cache (
+          cache_key  CHAR(40) NOT NULL PRIMARY KEY,
+          url        TEXT NOT NULL,
+          mode       VARCHAR(16) NOT NULL,
+          payload    TEXT NOT NULL,
+          created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          KEY ix_created (created_at)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""")
+        _ensure_column(cur, "user_map", "username_lc", """
+          ADD COLUMN username_lc VARCHAR(255) GENERATED ALWAYS AS (LOWER(username)) STORED,
+          ADD KEY ix_chat_username_lc (chat_id, username_lc)""")
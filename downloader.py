@@ -4,17 +4,25 @@
 import os
 import re
 import shlex
-import subprocess
+import signal
 import tempfile
+import threading
+import time
 import pathlib
 import datetime
 import asyncio
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 from urllib.parse import urlparse
-from typing import Optional, List, Tuple, Dict
+from typing import Awaitable, Callable, Optional, List, Tuple, Dict, Union
 
-import requests
-from aiogram.types import FSInputFile, InputMediaPhoto, InputMediaVideo
+import aiohttp
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputFile, InputMediaPhoto, InputMediaVideo
+
+from services import media_cache, download_queue, backend_stats, ytdlp_pool, cobalt_quality, workspace, transcode, links, link_cache
 
 try:
     from instagram_client import (
@@ -36,6 +44,27 @@ try:
         COBALT_TIMEOUT,
         COBALT_MAX_FILE_MB,
         COBALT_AUTH,
+        HTTP_POOL_LIMIT,
+        HTTP_PER_HOST_LIMIT,
+        PICKER_CONCURRENCY,
+        PICKER_TOTAL_MB,
+        DL_MAX_CONCURRENT,
+        DL_STRATEGY,
+        DL_HEDGE_DELAYS,
+        YTDLP_ENGINE,
+        COBALT_HOST_ERROR_TTL_SEC,
+        COBALT_RATE_LIMIT_TTL_SEC,
+        DL_PROGRESS_EDIT,
+        DL_PROGRESS_EVERY_SEC,
+        DL_STREAM_UPLOAD,
+        DL_BATCH_ORDER,
+        DL_PREFLIGHT,
+        DL_MAX_UPLOAD_MB,
+        TRANSCODE_ENABLED,
+        TRANSCODE_MAX_SOURCE_MB,
+        BOT_API_SERVER,
+        BOT_API_LOCAL,
+        BOT_API_MAX_UPLOAD_MB,
     )
 except Exception:
     COBALT_ENABLED = False
@@ -43,6 +72,27 @@ except Exception:
     COBALT_TIMEOUT = 25
     COBALT_MAX_FILE_MB = 49
     COBALT_AUTH = None
+    HTTP_POOL_LIMIT = 32
+    HTTP_PER_HOST_LIMIT = 8
+    PICKER_CONCURRENCY = 5
+    PICKER_TOTAL_MB = 49
+    DL_MAX_CONCURRENT = 4
+    DL_STRATEGY = "sequential"
+    DL_HEDGE_DELAYS = ""
+    YTDLP_ENGINE = "subprocess"
+    COBALT_HOST_ERROR_TTL_SEC = 600
+    COBALT_RATE_LIMIT_TTL_SEC = 60
+    DL_PROGRESS_EDIT = False
+    DL_PROGRESS_EVERY_SEC = 5
+    DL_STREAM_UPLOAD = False
+    DL_BATCH_ORDER = "finish"
+    DL_PREFLIGHT = False
+    DL_MAX_UPLOAD_MB = 49
+    TRANSCODE_ENABLED = False
+    TRANSCODE_MAX_SOURCE_MB = 500
+    BOT_API_SERVER = ""
+    BOT_API_LOCAL = False
+    BOT_API_MAX_UPLOAD_MB = 2000
 
 
 # -------------------- Константи середовища --------------------
@@ -61,21 +111,8 @@ INSTAGRAM_COOKIES = "/var/opt/mieshania/cookies_instagram.txt"
 YOUTUBE_COOKIES   = "/var/opt/mieshania/cookies_youtube.txt"
 TIKTOK_COOKIES    = "/var/opt/mieshania/cookies_tiktok.txt"
 
-# Хости, які вважаємо підтримуваними
-VIDEO_HOSTS = (
-    "youtube.com", "youtu.be",
-    "tiktok.com", "vm.tiktok.com",
-    "instagram.com", "www.instagram.com", "m.instagram.com",
-    "x.com", "twitter.com",
-    "reddit.com",
-    "pinterest.com",
-)
-
-# Regex для звичайних IG постів /reel/p
-IG_CODE_RE = re.compile(
-    r"https?://(?:www\.|m\.)?instagram\.com/(?:p|reel)/([A-Za-z0-9_-]{5,})",
-    re.I,
-)
+# Хости, які вважаємо підтримуваними (див. services/links.py)
+VIDEO_HOSTS = links.HOSTS
 
 SAFE_NAME_RE = re.compile(r"[^a-zA-Z0-9\.\-_ ]+")
 
@@ -101,15 +138,192 @@ def _sanitize_name(name: str, max_len: int = 80) -> str:
     return name[:max_len]
 
 
-def _try_cobalt(
+# ===================== HTTP =====================
+
+_http: Optional[aiohttp.ClientSession] = None
+
+# на сам файл — без загального ліміту, але з таймаутом між шматками
+_DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=COBALT_TIMEOUT, sock_read=COBALT_TIMEOUT)
+
+
+async def _http_session() -> aiohttp.ClientSession:
+    """Спільна довгоживуча сесія: keep-alive до cobalt і CDN, ліміти на хост."""
+    global _http
+    if _http is None or _http.closed:
+        _http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_PER_HOST_LIMIT,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            ),
+            # cookies не повинні перетікати між запитами різних чатів
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+    return _http
+
+
+async def close_http() -> None:
+    global _http
+    if _http is not None and not _http.closed:
+        await _http.close()
+    _http = None
+
+
+# Робоча тека поточної задачі (див. services/workspace.py): кожен бекенд пише у свою підтеку
+_workspace: "ContextVar[Optional[workspace.Workspace]]" = ContextVar("dl_workspace", default=None)
+_workdir: "ContextVar[Optional[str]]" = ContextVar("dl_workdir", default=None)
+# Спільне завантаження, яке зараз качає лідер (для рішення про стрімінг)
+_shared_job: "ContextVar[Optional[_SharedDownload]]" = ContextVar("dl_shared_job", default=None)
+
+
+def _streamable() -> bool:
+    """Потік можна віддати лише одному відправнику: на спільне завантаження — диск."""
+    job = _shared_job.get()
+    return job is None or (not job.staged and job.users <= 1)
+
+
+def _job_dir() -> str:
+    """Тека для файлів поточного бекенду; поза задачею — разова job-тека (її прибере janitor)."""
+    d = _workdir.get()
+    if d is None:
+        os.makedirs(TMP_DIR, exist_ok=True)
+        d = tempfile.mkdtemp(prefix=workspace.PREFIX, dir=TMP_DIR)
+        _workdir.set(d)
+    return d
+
+
+class MediaTooLarge(RuntimeError):
+    """Файл перевищує ліміт; size — відомий розмір (Content-Length) або 0."""
+
+    def __init__(self, msg: str, size: int = 0):
+        super().__init__(msg)
+        self.size = size
+
+
+class _ByteBudget:
+    """Спільний ліміт байтів на кілька паралельних завантажень (напр. елементи picker)."""
+
+    def __init__(self, max_bytes: int, too_large_msg: str):
+        self.left = max_bytes
+        self.too_large_msg = too_large_msg
+
+    def take(self, n: int) -> None:
+        self.left -= n
+        if self.left < 0:
+            raise MediaTooLarge(self.too_large_msg)
+
+
+async def _stream_to_file(
+    resp: aiohttp.ClientResponse,
+    path: str,
+    max_bytes: int,
+    too_large_msg: str,
+    budget: Optional[_ByteBudget] = None,
+) -> int:
+    """Пише тіло відповіді у файл шматками; понад max_bytes — RuntimeError і файл видаляється."""
+    wrote = 0
+    try:
+        with open(path, "wb") as f:
+            async for chunk in resp.content.iter_chunked(1024 * 128):
+                if not chunk:
+                    continue
+                wrote += len(chunk)
+                if wrote > max_bytes:
+                    raise MediaTooLarge(too_large_msg)
+                if budget is not None:
+                    budget.take(len(chunk))
+                f.write(chunk)
+    except BaseException:
+        try:
+            os.remove(path)
+        except Exception:
+            pass
+        raise
+    return wrote
+
+
+class _HttpStreamFile(InputFile):
+    """
+    Тіло HTTP-відповіді, що йде прямо в multipart-аплоад Telegram, без диска.
+    Буфер обмежений: з мережі читається лише тоді, коли аплоад забрав
+    попередній шматок (буфер відповіді aiohttp + один chunk у пам'яті).
+    Відповідь закривається після читання або в close().
+    """
+
+    def __init__(self, resp: aiohttp.ClientResponse, filename: str, size: int):
+        super().__init__(filename=filename, chunk_size=128 * 1024)
+        self.resp = resp
+        self.size = size
+        self.consumed = False
+
+    async def read(self, bot):
+        if self.consumed:
+            raise RuntimeError("stream already consumed")
+        self.consumed = True
+        wrote = 0
+        try:
+            async for chunk in self.resp.content.iter_chunked(self.chunk_size):
+                wrote += len(chunk)
+                if wrote > self.size:
+                    raise MediaTooLarge("stream longer than Content-Length")
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.resp.release()
+
+
+def _item_size(it: Dict) -> int:
+    if it.get("size"):
+        return int(it["size"])
+    try:
+        return os.path.getsize(it["path"])
+    except (OSError, KeyError):
+        return 0
+
+
+def _local_api() -> bool:
+    """Власний Bot API сервер з --local: файли він читає сам з нашого диска."""
+    return bool(BOT_API_SERVER) and BOT_API_LOCAL
+
+
+def _upload_limit() -> int:
+    """Скільки байт бот може відправити в Telegram одним файлом."""
+    return int(BOT_API_MAX_UPLOAD_MB if _local_api() else DL_MAX_UPLOAD_MB) * 1024 * 1024
+
+
+def _media_limit() -> int:
+    """Ліміт на файл для cobalt / прямих посилань; з локальним Bot API — ліміт аплоаду."""
+    return _upload_limit() if _local_api() else int(COBALT_MAX_FILE_MB) * 1024 * 1024
+
+
+def _fit_enabled(mode: str) -> bool:
+    """Чи можна завелике відео докачати і стиснути під ліміт (services/transcode.py)."""
+    return bool(transcode.AVAILABLE and TRANSCODE_ENABLED and mode not in ("file", "audio"))
+
+
+def _input_file(it: Dict) -> Union[InputFile, str]:
+    if "stream" in it:
+        return it["stream"]
+    if _local_api():
+        # сервер відкриває файл за шляхом — без multipart і копії байтів
+        return "file://" + os.path.abspath(it["path"])
+    return FSInputFile(it["path"])
+
+
+async def _try_cobalt(
     url: str,
     *,
     download_mode: str = "auto",
     video_quality: str = "1080",
     audio_format: str = "mp3",
+    errors: Optional[List[str]] = None,
 ) -> Optional[Dict]:
     """
     Пробує cobalt.tools API.
+    Коди невдач (напр. "error.api.link.unsupported", "http 429") дописуються в errors.
 
     Повертає один з варіантів або None:
       - {"url": str, "filename": str, "status": "tunnel"|"redirect"|"success"}  — одиночний файл
@@ -133,35 +347,51 @@ def _try_cobalt(
     if download_mode == "audio":
         payload["audioFormat"] = audio_format
 
+    cache_key = _cobalt_cache_key(url, download_mode, video_quality, audio_format)
+    cached = link_cache.get("cobalt", cache_key)
+    if cached is not None:
+        _log(f"COBALT CACHED: {cached.get('status')}")
+        return cached
+
     try:
-        r = requests.post(COBALT_API_URL, headers=headers, json=payload, timeout=COBALT_TIMEOUT)
+        session = await _http_session()
+        async with session.post(
+            COBALT_API_URL, headers=headers, json=payload,
+            timeout=aiohttp.ClientTimeout(total=COBALT_TIMEOUT),
+        ) as r:
+            status_code = r.status
+            try:
+                data = await r.json(content_type=None)
+            except Exception:
+                data = None
     except Exception as e:
         _log(f"COBALT FAIL: request error: {e}")
+        if errors is not None:
+            errors.append("request_error")
         return None
 
-    if not (200 <= r.status_code < 300):
-        try:
-            data = r.json()
-            if isinstance(data, dict) and str(data.get("status") or "").lower() == "error":
-                err = data.get("error") or {}
-                code = (err.get("code") if isinstance(err, dict) else None) or ""
-                text = str(data.get("text") or "")
-                if text and "v7 api has been shut down" in text.lower():
-                    _log("COBALT FAIL: v7 api shutdown (wrong endpoint)")
-                elif code:
-                    _log(f"COBALT FAIL: {code}")
-                else:
-                    _log(f"COBALT FAIL: http {r.status_code}")
+    if not (200 <= status_code < 300):
+        code = ""
+        if isinstance(data, dict) and str(data.get("status") or "").lower() == "error":
+            err = data.get("error") or {}
+            code = (err.get("code") if isinstance(err, dict) else None) or ""
+            text = str(data.get("text") or "")
+            if text and "v7 api has been shut down" in text.lower():
+                _log("COBALT FAIL: v7 api shutdown (wrong endpoint)")
+            elif code:
+                _log(f"COBALT FAIL: {code}")
             else:
-                _log(f"COBALT FAIL: http {r.status_code}")
-        except Exception:
-            _log(f"COBALT FAIL: http {r.status_code}")
+                _log(f"COBALT FAIL: http {status_code}")
+        else:
+            _log(f"COBALT FAIL: http {status_code}")
+        if errors is not None:
+            errors.append(code or f"http {status_code}")
         return None
 
-    try:
-        data = r.json()
-    except Exception:
+    if not isinstance(data, dict):
         _log("COBALT FAIL: non-json response")
+        if errors is not None:
+            errors.append("non_json")
         return None
 
     status = str(data.get("status") or "").lower()
@@ -171,12 +401,14 @@ def _try_cobalt(
         picker = data.get("picker")
         if isinstance(picker, list) and picker:
             _log(f"COBALT PICKER: {len(picker)} item(s)")
-            return {
+            res = {
                 "status": "picker",
                 "picker": picker,
                 "audio": data.get("audio"),
                 "audioFilename": data.get("audioFilename"),
             }
+            link_cache.put("cobalt", cache_key, res, link_cache.COBALT_TUNNEL_TTL_SEC)
+            return res
         _log("COBALT FAIL: picker empty")
         return None
 
@@ -186,8 +418,12 @@ def _try_cobalt(
             err = data.get("error") or {}
             code = (err.get("code") if isinstance(err, dict) else None) or ""
             _log(f"COBALT FAIL: status={status} code={code}".strip())
+            if errors is not None:
+                errors.append(code or status)
         else:
             _log(f"COBALT FAIL: status={status or 'unknown'}")
+            if errors is not None:
+                errors.append(f"status {status or 'unknown'}")
         return None
 
     direct = data.get("url")
@@ -199,127 +435,161 @@ def _try_cobalt(
     if not isinstance(filename, str) or not filename.strip():
         filename = "file"
 
-    return {"url": direct, "filename": filename, "status": status}
+    res = {"url": direct, "filename": filename, "status": status}
+    # redirect — посилання на CDN, живе довше; tunnel cobalt швидко протухає
+    link_cache.put("cobalt", cache_key, res, None if status == "redirect" else link_cache.COBALT_TUNNEL_TTL_SEC)
+    return res
+
+
+def _cobalt_cache_key(url: str, download_mode: str, video_quality: str, audio_format: str) -> str:
+    return f"{url}|{download_mode}|{video_quality}|{audio_format}"
 
 
-def _download_cobalt_picker(picker_res: Dict, source_url: str) -> Tuple[List[Dict[str, str]], str]:
+async def _download_cobalt_picker(picker_res: Dict, source_url: str) -> Tuple[List[Dict[str, str]], str]:
     """
-    Завантажує slideshow (picker) від cobalt — список фото/відео.
+    Завантажує slideshow (picker) від cobalt — список фото/відео + опційний audio.
+    Елементи качаються паралельно (не більше PICKER_CONCURRENCY одночасно),
+    порядок альбому зберігається. Ліміти: COBALT_MAX_FILE_MB (_media_limit) на елемент,
+    PICKER_TOTAL_MB на весь slideshow.
     Telegram приймає максимум 10 елементів в альбомі.
     """
-    os.makedirs(TMP_DIR, exist_ok=True)
-    items: List[Dict[str, str]] = []
+    job_dir = _job_dir()
     picker = picker_res.get("picker") or []
+    session = await _http_session()
+    max_bytes = _media_limit()
+    budget = _ByteBudget(int(PICKER_TOTAL_MB) * 1024 * 1024, "picker total too large")
+    sem = asyncio.Semaphore(max(1, int(PICKER_CONCURRENCY)))
+    ext_map = {
+        "image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp",
+        "video/mp4": ".mp4", "video/webm": ".webm",
+        "audio/mpeg": ".mp3", "audio/mp4": ".m4a",
+    }
+    default_ext = {"photo": ".jpg", "audio": ".mp3"}
 
+    async def _fetch(name: str, media_url: str, media_type_hint: str) -> Optional[Dict[str, str]]:
+        async with sem:
+            try:
+                async with session.get(media_url, timeout=_DOWNLOAD_TIMEOUT, headers={"Referer": source_url}) as resp:
+                    if not (200 <= resp.status < 300):
+                        _log(f"COBALT PICKER {name}: http {resp.status}")
+                        return None
+
+                    ctype = (resp.headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
+                    ext = ext_map.get(ctype) or default_ext.get(media_type_hint, ".mp4")
+                    final_path = os.path.join(job_dir, f"{name}{ext}")
+                    await _stream_to_file(resp, final_path, max_bytes, "picker item too large", budget)
+            except Exception as e:
+                _log(f"COBALT PICKER {name} FAIL: {e}")
+                return None
+
+        suffix = pathlib.Path(final_path).suffix.lower()
+        if suffix in {".jpg", ".jpeg", ".png", ".webp"}:
+            media_type = "photo"
+        elif suffix in {".mp3", ".m4a"}:
+            media_type = "audio"
+        else:
+            media_type = "video"
+        return {"path": final_path, "type": media_type}
+
+    jobs = []
     # Telegram limit: max 10 items per album
     for i, entry in enumerate(picker[:10]):
         media_url = entry.get("url") if isinstance(entry, dict) else None
         media_type_hint = (entry.get("type") or "photo").lower() if isinstance(entry, dict) else "photo"
-        if not media_url:
-            continue
-        try:
-            resp = requests.get(media_url, stream=True, timeout=COBALT_TIMEOUT, headers={"Referer": source_url})
-            if not (200 <= resp.status_code < 300):
-                _log(f"COBALT PICKER item {i}: http {resp.status_code}")
-                continue
+        if media_url:
+            jobs.append(_fetch(f"picker_{i:03d}", media_url, media_type_hint))
+    audio_url = picker_res.get("audio")
+    if isinstance(audio_url, str) and audio_url.startswith("http"):
+        jobs.append(_fetch("picker_audio", audio_url, "audio"))
 
-            ctype = (resp.headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
-            ext_map = {
-                "image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp",
-                "video/mp4": ".mp4", "video/webm": ".webm",
-            }
-            ext = ext_map.get(ctype) or (".jpg" if media_type_hint == "photo" else ".mp4")
-            final_path = os.path.join(TMP_DIR, f"picker_{i:03d}{ext}")
-
-            max_bytes = int(COBALT_MAX_FILE_MB) * 1024 * 1024
-            wrote = 0
-            with open(final_path, "wb") as f:
-                for chunk in resp.iter_content(chunk_size=1024 * 128):
-                    if not chunk:
-                        continue
-                    wrote += len(chunk)
-                    if wrote > max_bytes:
-                        raise RuntimeError("picker item too large")
-                    f.write(chunk)
-
-            media_type = "photo" if pathlib.Path(final_path).suffix.lower() in {".jpg", ".jpeg", ".png", ".webp"} else "video"
-            items.append({"path": final_path, "type": media_type})
-        except Exception as e:
-            _log(f"COBALT PICKER item {i} FAIL: {e}")
-            continue
+    # gather зберігає порядок — альбом іде в тому ж порядку, що й у picker
+    items = [it for it in await asyncio.gather(*jobs) if it]
 
-    if not items:
+    if not any(it["type"] != "audio" for it in items):
+        for it in items:
+            try:
+                os.remove(it["path"])
+            except Exception:
+                pass
         raise RuntimeError("cobalt picker: не вдалось завантажити жодного елементу")
 
     _log(f"COBALT PICKER SUCCESS: {len(items)} item(s)")
     return items, "tiktok_slideshow"
 
 
-def _download_direct_media(media_url: str, source_url: str, title: str) -> Tuple[List[Dict[str, str]], str]:
-    """
-    Качає пряме посилання (cobalt tunnel) у TMP_DIR.
-    Повертає (items, title) у форматі як після yt-dlp.
-    """
-    os.makedirs(TMP_DIR, exist_ok=True)
-
-    safe_title = _sanitize_name(title or "file")
-    tmp_path = os.path.join(TMP_DIR, f"{safe_title}")
-
-    try:
-        resp = requests.get(media_url, stream=True, timeout=COBALT_TIMEOUT, headers={"Referer": source_url})
-    except Exception as e:
-        raise RuntimeError(f"cobalt download error: {e}")
+_DIRECT_EXT_MAP = {
+    "video/mp4": ".mp4",
+    "video/webm": ".webm",
+    "audio/mpeg": ".mp3",
+    "audio/mp4": ".m4a",
+    "audio/aac": ".aac",
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+}
 
-    if not (200 <= resp.status_code < 300):
-        raise RuntimeError(f"cobalt download http {resp.status_code}")
-
-    # визначаємо розмір якщо є
-    max_bytes = int(COBALT_MAX_FILE_MB) * 1024 * 1024
-    clen = resp.headers.get("Content-Length") or resp.headers.get("Estimated-Content-Length") or ""
-    try:
-        size_hint = int(clen)
-    except Exception:
-        size_hint = 0
-    if size_hint and size_hint > max_bytes:
-        raise RuntimeError("cobalt file too large")
 
-    # підбираємо розширення
-    ctype = (resp.headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
-    ext_map = {
-        "video/mp4": ".mp4",
-        "video/webm": ".webm",
-        "audio/mpeg": ".mp3",
-        "audio/mp4": ".m4a",
-        "audio/aac": ".aac",
-        "image/jpeg": ".jpg",
-        "image/png": ".png",
-        "image/webp": ".webp",
-    }
-    ext = ext_map.get(ctype) or pathlib.Path(urlparse(media_url).path).suffix or ".mp4"
+def _ext_for(ctype: str, media_url: str) -> str:
+    ext = _DIRECT_EXT_MAP.get(ctype) or pathlib.Path(urlparse(media_url).path).suffix or ".mp4"
     if not ext.startswith("."):
         ext = "." + ext
+    return ext
 
-    final_path = tmp_path
-    if not final_path.lower().endswith(ext.lower()):
-        final_path = tmp_path + ext
 
-    # запис у файл
-    wrote = 0
+async def _download_direct_media(
+    media_url: str, source_url: str, title: str, stream: bool = False, max_bytes: Optional[int] = None
+) -> Tuple[List[Dict[str, str]], str]:
+    """
+    Качає пряме посилання (cobalt tunnel) у робочу теку задачі.
+    Повертає (items, title) у форматі як після yt-dlp.
+
+    stream=True (і DL_STREAM_UPLOAD): якщо розмір відомий і влазить у ліміт,
+    файл не пишеться на диск — item містить {"stream": _HttpStreamFile, "size"}
+    замість "path", і тіло відповіді йде прямо в аплоад.
+    max_bytes — ліміт файлу замість _media_limit() (джерело під перекодування).
+    """
+    safe_title = _sanitize_name(title or "file")
+    tmp_path = os.path.join(_job_dir(), f"{safe_title}")
+
+    max_bytes = max_bytes or _media_limit()
+    session = await _http_session()
     try:
-        with open(final_path, "wb") as f:
-            for chunk in resp.iter_content(chunk_size=1024 * 128):
-                if not chunk:
-                    continue
-                wrote += len(chunk)
-                if wrote > max_bytes:
-                    raise RuntimeError("cobalt file too large")
-                f.write(chunk)
-    except Exception:
+        resp = await session.get(media_url, timeout=_DOWNLOAD_TIMEOUT, headers={"Referer": source_url})
+        streaming = False
         try:
-            os.remove(final_path)
-        except Exception:
-            pass
-        raise
+            if not (200 <= resp.status < 300):
+                raise RuntimeError(f"cobalt download http {resp.status}")
+
+            # визначаємо розмір якщо є
+            clen = resp.headers.get("Content-Length") or resp.headers.get("Estimated-Content-Length") or ""
+            try:
+                size_hint = int(clen)
+            except Exception:
+                size_hint = 0
+            if size_hint and size_hint > max_bytes:
+                raise MediaTooLarge("cobalt file too large", size_hint)
+
+            # підбираємо розширення
+            ctype = (resp.headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
+            ext = _ext_for(ctype, media_url)
+
+            final_path = tmp_path
+            if not final_path.lower().endswith(ext.lower()):
+                final_path = tmp_path + ext
+
+            # Estimated-Content-Length — лише оцінка, стрімимо тільки за точним розміром
+            streaming = bool(
+                stream and DL_STREAM_UPLOAD and _streamable()
+                and resp.headers.get("Content-Length") and size_hint
+            )
+            if not streaming:
+                # запис у файл
+                await _stream_to_file(resp, final_path, max_bytes, "cobalt file too large")
+        finally:
+            if not streaming:
+                resp.release()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise RuntimeError(f"cobalt download error: {e}")
 
     # класифікація медіа
     ext_l = pathlib.Path(final_path).suffix.lower()
@@ -330,7 +600,13 @@ def _download_direct_media(media_url: str, source_url: str, title: str) -> Tuple
     else:
         media_type = "video"
 
-    return [{"path": final_path, "type": media_type}], _sanitize_name(pathlib.Path(final_path).stem or safe_title)
+    out_title = _sanitize_name(pathlib.Path(final_path).stem or safe_title)
+    if streaming:
+        _log(f"STREAM UPLOAD: {size_hint} bytes, no disk staging")
+        item = {"type": media_type, "size": size_hint,
+                "stream": _HttpStreamFile(resp, os.path.basename(final_path), size_hint)}
+        return [item], out_title
+    return [{"path": final_path, "type": media_type}], out_title
 
 
 def _parse_netscape_cookies_file(path: str) -> Dict[str, str]:
@@ -375,14 +651,14 @@ def _find_first_media_url(obj) -> Optional[str]:
     return None
 
 
-def _try_instagram_scrape_fallback(url: str) -> Optional[str]:
+async def _try_instagram_scrape_fallback(url: str) -> Optional[str]:
     """
     Best-effort fallback для Instagram, якщо yt-dlp впав.
     НЕ гарантує успіх (Instagram часто блокує).
 
     Повертає прямий media url або None.
     """
-    url_norm = _normalize_instagram_url(url)
+    url_norm = links.normalize_instagram(url)
     if "instagram.com" not in (url_norm or "").lower():
         return None
 
@@ -395,19 +671,20 @@ def _try_instagram_scrape_fallback(url: str) -> Optional[str]:
 
     cookies = _parse_netscape_cookies_file(INSTAGRAM_COOKIES)
     try:
-        r = requests.get(
+        session = await _http_session()
+        async with session.get(
             probe,
-            timeout=COBALT_TIMEOUT,
+            timeout=aiohttp.ClientTimeout(total=COBALT_TIMEOUT),
             headers={"Accept": "application/json", "User-Agent": ua, "Referer": url_norm},
             cookies=cookies or None,
-        )
-        if not (200 <= r.status_code < 300):
-            return None
+        ) as r:
+            if not (200 <= r.status < 300):
+                return None
+            txt = await r.text(errors="ignore")
         try:
-            j = r.json()
+            j = json.loads(txt)
         except Exception:
             # інколи повертає html
-            txt = r.text or ""
             m = re.search(r'"video_url"\s*:\s*"([^"]+)"', txt)
             if m:
                 return m.group(1).encode("utf-8").decode("unicode_escape")
@@ -417,96 +694,209 @@ def _try_instagram_scrape_fallback(url: str) -> Optional[str]:
         return None
 
 
-def _download_with_fallbacks_sync(url: str, mode: str = "auto") -> Tuple[List[Dict[str, str]], str]:
+async def _instagrapi_download(url: str, is_story: bool, dest: str) -> Optional[Tuple[List[Dict[str, str]], str]]:
     """
-    cobalt.tools → instagrapi (IG) → yt-dlp → IG scrape fallback.
-
-    mode: auto|hd|sd|audio|file
+    instagrapi одразу в робочу теку dest. None, якщо нічого не скачалось.
+    Акаунт з пулу чекаємо на циклі подій; у потік _dl_threads іде лише сам запит.
     """
-    mode = (mode or "auto").lower()
+    cancel = threading.Event()
 
-    _is_ig_story = "instagram.com/stories/" in (url or "").lower()
-    _is_ig = "instagram.com" in (url or "").lower()
+    def run_sync(fn, *args):
+        return _in_thread(fn, *args, cancel_event=cancel)
 
-    # ----- COBALT (не для Stories — Cobalt їх не підтримує) -----
-    if COBALT_ENABLED and not _is_ig_story:
-        _log(f"COBALT START: {url} mode={mode}")
+    if is_story and _ig_story_download:
+        items_raw = await _ig_story_download(url, dest, run_sync=run_sync, cancel_event=cancel)
+        label = "story"
+    elif _ig_media_download:
+        items_raw = await _ig_media_download(url, dest, run_sync=run_sync, cancel_event=cancel)
+        label = "instagram"
+    else:
+        items_raw = []
+        label = "instagram"
+
+    if not items_raw:
+        return None
+    return [{"path": it["path"], "type": it["type"]} for it in items_raw], label
+
+
+# Потоки під instagrapi / yt-dlp: обмежено, щоб сплеск посилань не вичерпав потоки
+_dl_threads = ThreadPoolExecutor(max_workers=max(4, int(DL_MAX_CONCURRENT) * 3), thread_name_prefix="dl")
+
+
+def _cleanup_items(items: List[Dict]) -> None:
+    """Видаляє тимчасові файли і закриває невідправлені потоки."""
+    for it in items or []:
         try:
-            if mode == "audio":
-                res = _try_cobalt(url, download_mode="audio", video_quality="1080")
-                if res:
-                    _log("COBALT SUCCESS")
-                    return _download_direct_media(res["url"], url, res.get("filename") or "audio")
+            if "stream" in it:
+                it["stream"].close()
             else:
-                qualities = ["1080"]
-                if mode in ("hd", "file"):
-                    qualities = ["max", "2160", "1440", "1080", "720", "480", "360"]
-                elif mode == "sd":
-                    qualities = ["480", "360"]
-
-                for q in qualities:
-                    res = _try_cobalt(url, download_mode="auto", video_quality=q)
-                    if not res:
-                        continue
-
-                    # Slideshow / фото-карусель (TikTok photo, тощо)
-                    if res.get("status") == "picker":
-                        try:
-                            items, title = _download_cobalt_picker(res, url)
-                            _log("COBALT PICKER SUCCESS")
-                            return items, title
-                        except Exception as e:
-                            _log(f"COBALT PICKER FAIL: {e}")
-                        break  # picker не залежить від якості — не повторюємо
-
-                    try:
-                        items, title = _download_direct_media(res["url"], url, res.get("filename") or "video")
-                        _log("COBALT SUCCESS")
-                        return items, title
-                    except Exception as e:
-                        _log(f"COBALT FAIL: {e}")
-                        continue
-        except Exception as e:
-            _log(f"COBALT FAIL: {e}")
+                os.remove(it["path"])
+        except Exception:
+            pass
 
-        _log("COBALT FAIL")
 
-    # ----- INSTAGRAPI (для будь-якого Instagram URL) -----
-    if _is_ig and INSTAGRAPI_AVAILABLE:
-        _log(f"INSTAGRAPI START: {url}")
-        try:
-            import tempfile as _tmpfile
-            with _tmpfile.TemporaryDirectory() as td:
-                if _is_ig_story and _ig_story_download:
-                    items_raw = _ig_story_download(url, td)
-                    label = "story"
-                elif _ig_media_download:
-                    items_raw = _ig_media_download(url, td)
-                    label = "instagram"
-                else:
-                    items_raw = []
-                    label = "instagram"
-
-                if items_raw:
-                    os.makedirs(TMP_DIR, exist_ok=True)
-                    items = []
-                    for it in items_raw:
-                        src = it["path"]
-                        dst = os.path.join(TMP_DIR, os.path.basename(src))
-                        try:
-                            os.replace(src, dst)
-                        except Exception:
-                            import shutil as _shutil
-                            _shutil.copy2(src, dst)
-                        items.append({"path": dst, "type": it["type"]})
-                    _log(f"INSTAGRAPI SUCCESS: {len(items)} item(s)")
-                    return items, label
-        except IGSessionExpiredError:
-            raise  # пробрасуємо далі — хендлер нотифікує адмінів
-        except Exception as e:
-            _log(f"INSTAGRAPI FAIL: {e}")
+def _discard_thread_result(cf) -> None:
+    """Результат потоку, який уже нікому не потрібен (програв гонку) — прибираємо файли."""
+    if cf.cancelled() or cf.exception() is not None:
+        return
+    res = cf.result()
+    if isinstance(res, tuple):
+        _cleanup_items(res[0])
+    elif isinstance(res, list):
+        _cleanup_items(res)  # instagrapi повертає лише items
+
+
+async def _in_thread(fn, *args, cancel_event: Optional[threading.Event] = None):
+    cf = _dl_threads.submit(fn, *args)
+    try:
+        return await asyncio.wrap_future(cf)
+    except asyncio.CancelledError:
+        if cancel_event is not None:
+            cancel_event.set()
+        cf.add_done_callback(_discard_thread_result)
+        ws = _workspace.get()
+        if ws is not None and not cf.done():
+            # потік ще пише в робочу теку — не даємо прибрати її з-під нього
+            ws.pin()
+            loop = asyncio.get_running_loop()
+            cf.add_done_callback(lambda _cf: _unpin_threadsafe(loop, ws))
+        raise
+
+
+def _unpin_threadsafe(loop: asyncio.AbstractEventLoop, ws: workspace.Workspace) -> None:
+    try:
+        loop.call_soon_threadsafe(ws.unpin)
+    except RuntimeError:
+        pass  # цикл уже закрито (зупинка бота) — решту прибере janitor
 
-    # ----- YT-DLP -----
+
+# ----- бекенди (кожен повертає (items, title) або кидає виняток) -----
+
+class CobaltError(RuntimeError):
+    def __init__(self, code: str):
+        super().__init__(f"cobalt: {code}")
+        self.code = code
+
+
+class CobaltSkipped(CobaltError):
+    """cobalt для хоста тимчасово вимкнено (cobalt_quality.blocked) — запиту не було."""
+
+
+async def _backend_cobalt(url: str, mode: str) -> Tuple[List[Dict[str, str]], str]:
+    """
+    Драбина якостей з services/cobalt_quality.py: старт з якості, що востаннє
+    влізла для цього хоста; інша якість пробується лише після "too large".
+    """
+    _log(f"COBALT START: {url} mode={mode}")
+    host = _host_key(url)
+    code = cobalt_quality.blocked(host)
+    if code:
+        _log(f"COBALT SKIP: {host} recently failed with {code}")
+        raise CobaltSkipped(code)
+
+    errors: List[str] = []
+    limit = _media_limit()
+    if mode == "audio":
+        res = await _try_cobalt(url, download_mode="audio", video_quality="1080", errors=errors)
+        if res:
+            _log("COBALT SUCCESS")
+            return await _download_direct_media(res["url"], url, res.get("filename") or "audio", stream=True)
+    else:
+        steps = cobalt_quality.ladder(host, mode)
+        i = 0
+        while i < len(steps):
+            q = steps[i]
+            res = await _try_cobalt(url, download_mode="auto", video_quality=q, errors=errors)
+            if not res:
+                # помилка не про якість — інша якість не допоможе
+                break
+
+            # Slideshow / фото-карусель (TikTok photo, тощо)
+            if res.get("status") == "picker":
+                try:
+                    items, title = await _download_cobalt_picker(res, url)
+                    _log("COBALT PICKER SUCCESS")
+                    return items, title
+                except Exception as e:
+                    _log(f"COBALT PICKER FAIL: {e}")
+                    errors.append("picker_error")
+                    link_cache.forget("cobalt", _cobalt_cache_key(url, "auto", q, "mp3"))
+                break  # picker не залежить від якості — не повторюємо
+
+            try:
+                items, title = await _download_direct_media(
+                    res["url"], url, res.get("filename") or "video", stream=True
+                )
+            except MediaTooLarge as e:
+                _log(f"COBALT FAIL: {e} at {q}")
+                errors.append("too_large")
+                i = cobalt_quality.next_step(steps, i, e.size, limit)
+                continue
+            except Exception as e:
+                _log(f"COBALT FAIL: {e}")
+                errors.append("download_error")
+                # можливо, протух закешований tunnel — наступного разу питаємо cobalt заново
+                link_cache.forget("cobalt", _cobalt_cache_key(url, "auto", q, "mp3"))
+                break
+            cobalt_quality.remember_ok(host, mode, q, _item_size(items[0]), limit)
+            _log(f"COBALT SUCCESS at {q}")
+            return items, title
+
+        if errors and errors[-1] == "too_large" and _fit_enabled(mode):
+            fitted = await _cobalt_for_transcode(url, steps[-1])
+            if fitted is not None:
+                return fitted
+
+    if errors:
+        cobalt_quality.remember_error(host, errors[-1])
+    _log("COBALT FAIL")
+    raise CobaltError(errors[-1] if errors else "no_result")
+
+
+async def _cobalt_for_transcode(url: str, q: str) -> Optional[Tuple[List[Dict[str, str]], str]]:
+    """
+    Найменша якість cobalt не влазить у ліміт — качаємо її на диск (до
+    TRANSCODE_MAX_SOURCE_MB), щоб _postprocess стиснув. None — якщо за
+    тривалістю не стиснеться або не вийшло.
+    """
+    res = await _try_cobalt(url, download_mode="auto", video_quality=q, errors=[])
+    if not res or res.get("status") == "picker":
+        return None
+    try:
+        items, title = await _download_direct_media(
+            res["url"], url, res.get("filename") or "video", max_bytes=transcode.SOURCE_LIMIT
+        )
+    except Exception as e:
+        _log(f"COBALT FIT FAIL: {e}")
+        return None
+    try:
+        duration = (await transcode.probe(items[0]["path"])).get("duration")
+    except Exception:
+        duration = None
+    if items[0]["type"] != "video" or not transcode.fits(duration, _upload_limit()):
+        _cleanup_items(items)
+        return None
+    _log(f"COBALT SUCCESS at {q}, {_item_size(items[0]) // 1024} KiB to shrink")
+    return items, title
+
+
+async def _backend_instagrapi(url: str, mode: str) -> Tuple[List[Dict[str, str]], str]:
+    _log(f"INSTAGRAPI START: {url}")
+    is_story = "instagram.com/stories/" in url.lower()
+    try:
+        got = await _instagrapi_download(url, is_story, _job_dir())
+    except IGSessionExpiredError:
+        raise  # пробрасуємо далі — хендлер нотифікує адмінів
+    except Exception as e:
+        _log(f"INSTAGRAPI FAIL: {e}")
+        raise
+    if not got:
+        raise RuntimeError("instagrapi: no media")
+    _log(f"INSTAGRAPI SUCCESS: {len(got[0])} item(s)")
+    return got
+
+
+async def _backend_ytdlp(url: str, mode: str) -> Tuple[List[Dict[str, str]], str]:
     _log("FALLBACK YTDLP")
     profile = "auto"
     if mode == "audio":
@@ -515,70 +905,250 @@ def _download_with_fallbacks_sync(url: str, mode: str = "auto") -> Tuple[List[Di
         profile = "sd"
     elif mode in ("hd", "file"):
         profile = "hd"
+    return await _download_ytdlp(url, profile, fit=_fit_enabled(mode))
+
+
+async def _backend_ig_scrape(url: str, mode: str) -> Tuple[List[Dict[str, str]], str]:
+    media = await _try_instagram_scrape_fallback(url)
+    if not media:
+        raise RuntimeError("ig scrape: no media")
+    _log("IG SCRAPE FALLBACK SUCCESS")
+    return await _download_direct_media(media, url, "instagram", stream=True)
+
+
+Backend = Tuple[str, Callable[[str, str], Awaitable[Tuple[List[Dict[str, str]], str]]]]
+
+
+def _backends_for(url: str) -> List[Backend]:
+    """cobalt.tools → instagrapi (IG) → yt-dlp → IG scrape fallback."""
+    is_ig = links.match_host(url) == "instagram.com"
+    is_ig_story = is_ig and "/stories/" in url
+    out: List[Backend] = []
+    # Cobalt не підтримує Stories; хост, заблокований після помилок cobalt, — навіть не плануємо
+    if COBALT_ENABLED and not is_ig_story and not cobalt_quality.blocked(_host_key(url)):
+        out.append(("cobalt", _backend_cobalt))
+    if is_ig and INSTAGRAPI_AVAILABLE:
+        out.append(("instagrapi", _backend_instagrapi))
+    out.append(("ytdlp", _backend_ytdlp))
+    if is_ig:
+        out.append(("ig_scrape", _backend_ig_scrape))
+    return out
+
+
+def _host_key(url: str) -> str:
+    """Хост для статистики: vm.tiktok.com, www.tiktok.com -> tiktok.com."""
+    return links.match_host(url) or (urlparse(url).hostname or "").lower() or "?"
+
+
+def _error_code(exc: BaseException) -> str:
+    if isinstance(exc, IGSessionExpiredError) and IGSessionExpiredError is not RuntimeError:
+        return "ig_session_expired"
+    code = getattr(exc, "code", None)
+    if code:
+        return str(code)
+    text = str(exc).lower()
+    for marker in ("timeout", "cancelled", "too large", "private", "login", "not available", "unsupported"):
+        if marker in text:
+            return marker
+    return type(exc).__name__
+
+
+def _content_error(exc: BaseException) -> bool:
+    """Помилка про сам контент, а не про бекенд: приватне / видалене / завелике / IG-сесія."""
+    if isinstance(exc, (MediaTooLarge, link_cache.KnownFailure)):
+        return True
+    if isinstance(exc, IGSessionExpiredError) and IGSessionExpiredError is not RuntimeError:
+        return True
+    code = str(getattr(exc, "code", "") or "")
+    # content.* від cobalt — відповідь про контент, навіть якщо кешувати її не віримо
+    return code.startswith("error.api.content.") or link_cache.classify(f"{code} {exc}") is not None
+
+
+def _tracked(host: str, name: str, fn):
+    """Обгортка бекенду, що пише успіх/латентність/код помилки в backend_stats."""
+    async def run(url: str, mode: str):
+        backend_stats.begin(host, name)
+        t0 = time.monotonic()
+        try:
+            res = await fn(url, mode)
+        except (asyncio.CancelledError, CobaltSkipped):
+            # не спроба: ні успіху, ні провалу, лише звільняємо half-open пробу
+            backend_stats.release(host, name)
+            raise
+        except Exception as e:
+            if _content_error(e):
+                backend_stats.verdict(host, name, _error_code(e))
+            else:
+                backend_stats.record(host, name, False, time.monotonic() - t0, _error_code(e))
+            raise
+        backend_stats.record(host, name, True, time.monotonic() - t0)
+        return res
+    return run
+
+
+def _in_workspace(name: str, fn):
+    """Обгортка бекенду: файли пишуться у підтеку name робочої теки задачі."""
+    async def run(url: str, mode: str):
+        ws = _workspace.get()
+        token = _workdir.set(ws.sub(name) if ws is not None else None)
+        try:
+            return await fn(url, mode)
+        finally:
+            _workdir.reset(token)
+    return run
+
+
+def _ordered_backends(url: str) -> List[Backend]:
+    """Типовий набір бекендів, переставлений за статистикою хоста (breaker'и відкинуто)."""
+    host = _host_key(url)
+    defaults = dict(_backends_for(url))
+    names = backend_stats.order(host, list(defaults))
+    if names != list(defaults):
+        _log(f"BACKEND ORDER {host}: {' → '.join(names)}")
+    return [(name, _tracked(host, name, _in_workspace(name, defaults[name]))) for name in names]
+
+
+def _parse_hedge_delays(raw: str) -> Dict[str, float]:
+    """"tiktok.com=4,instagram.com=5,*=10" -> {"tiktok.com": 4.0, ...}"""
+    out: Dict[str, float] = {"*": 10.0}
+    for part in (raw or "").split(","):
+        host, _, val = part.partition("=")
+        try:
+            out[host.strip().lower()] = float(val)
+        except ValueError:
+            continue
+    return out
 
-    try:
-        return _download_sync(url, profile=profile)
-    except Exception as e:
-        # ----- IG scrape fallback -----
-        if _is_ig:
-            media = _try_instagram_scrape_fallback(url)
-            if media:
-                _log("IG SCRAPE FALLBACK SUCCESS")
-                return _download_direct_media(media, url, "instagram")
-        raise e
 
+HEDGE_DELAYS = _parse_hedge_delays(DL_HEDGE_DELAYS)
 
-def _normalize_instagram_url(url: str) -> str:
-    """
-    Для звичайних постів/reel нормалізуємо в:
-      https://www.instagram.com/p/<CODE>/
-      або
-      https://www.instagram.com/reel/<CODE>/
 
-    Для stories:
-      https://www.instagram.com/stories/<user>/<story_id>/
+def _hedge_delay(url: str) -> float:
+    host = (urlparse(url).hostname or "").lower()
+    for h, delay in HEDGE_DELAYS.items():
+        if h != "*" and (host == h or host.endswith("." + h)):
+            return delay
+    return HEDGE_DELAYS["*"]
 
-    Параметри типу utm/... прибираємо.
+
+def _known_failure(errors: Dict[str, BaseException]) -> Optional[link_cache.KnownFailure]:
     """
-    try:
-        parsed = urlparse(url)
-    except Exception:
-        return url
+    Невдача, яка стосується самого контенту (кешується в link_cache).
+    Вердикт yt-dlp — найнадійніший; від інших бекендів віримо лише
+    "приватне / гео", а не "видалене" (cobalt каже так і при rate limit),
+    "непідтримуване" чи розміру.
+    """
+    yt = errors.get("ytdlp")
+    if yt is not None:
+        if isinstance(yt, MediaTooLarge):
+            return link_cache.KnownFailure("too_large", str(yt))
+        kind = link_cache.classify(str(yt))
+        if kind:
+            return link_cache.KnownFailure(kind)
+    for e in errors.values():
+        kind = link_cache.classify(str(e))
+        if kind in ("private", "geo"):
+            return link_cache.KnownFailure(kind)
+    return None
 
-    host = parsed.netloc.lower()
-    if "instagram.com" not in host:
-        return url
 
-    path = parsed.path or ""
-    parts = [p for p in path.split("/") if p]
+def _pick_error(errors: Dict[str, BaseException]) -> BaseException:
+    # протухла IG-сесія важливіша за інші помилки — хендлер повідомить адмінів
+    for e in errors.values():
+        if isinstance(e, IGSessionExpiredError):
+            return e
+    known = _known_failure(errors)
+    if known is not None:
+        return known
+    return errors.get("ytdlp") or list(errors.values())[-1]
 
-    # stories/USER/ID[/...]
-    if len(parts) >= 3 and parts[0] == "stories":
-        user = parts[1]
-        story_id = parts[2]
-        return f"https://www.instagram.com/stories/{user}/{story_id}/"
 
-    # Звичайні пости /p/ або /reel/
-    m = IG_CODE_RE.search(url)
-    if not m:
-        return url
+async def _run_sequential(url: str, mode: str, backends: List[Backend]) -> Tuple[List[Dict[str, str]], str]:
+    errors: Dict[str, BaseException] = {}
+    for name, fn in backends:
+        try:
+            return await fn(url, mode)
+        except IGSessionExpiredError:
+            raise
+        except Exception as e:
+            errors[name] = e
+    raise _pick_error(errors)
+
 
-    code = m.group(1)
-    if "/p/" in path:
-        return f"https://www.instagram.com/p/{code}/"
-    return f"https://www.instagram.com/reel/{code}/"
+async def _run_race(url: str, mode: str, backends: List[Backend]) -> Tuple[List[Dict[str, str]], str]:
+    """
+    Hedged-запуск: стартуємо перший бекенд; якщо за hedge-затримку він не
+    впорався (або впав) — паралельно стартуємо наступний. Перший валідний
+    результат виграє, решта скасовуються, їхні файли прибираються.
+    """
+    hedge = _hedge_delay(url)
+    pending: Dict[asyncio.Task, str] = {}
+    errors: Dict[str, BaseException] = {}
+    idx = 0
+
+    def _start_next() -> None:
+        nonlocal idx
+        name, fn = backends[idx]
+        idx += 1
+        _log(f"RACE START: {name}")
+        pending[asyncio.create_task(fn(url, mode))] = name
+
+    _start_next()
+    try:
+        while pending:
+            timeout = hedge if idx < len(backends) else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                _start_next()  # hedge: поточні ще працюють, додаємо наступний
+                continue
+            for t in done:
+                name = pending.pop(t)
+                exc = t.exception()
+                if exc is None:
+                    items, title = t.result()
+                    if items and all("stream" in it or os.path.exists(it["path"]) for it in items):
+                        _log(f"RACE WIN: {name}")
+                        return items, title
+                    _cleanup_items(items)
+                    exc = RuntimeError(f"{name}: empty result")
+                errors[name] = exc
+            if not pending and idx < len(backends):
+                _start_next()  # усі поточні впали — не чекаємо hedge
+        raise _pick_error(errors)
+    finally:
+        for t in pending:
+            t.cancel()
+        if pending:
+            for res in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(res, tuple):
+                    _cleanup_items(res[0])
+
+
+async def _download_with_fallbacks(url: str, mode: str = "auto") -> Tuple[List[Dict[str, str]], str]:
+    """
+    cobalt.tools → instagrapi (IG) → yt-dlp → IG scrape fallback; порядок
+    підлаштовується під статистику хоста, бекенди з відкритим breaker'ом
+    пропускаються (див. services/backend_stats.py).
+
+    DL_STRATEGY=sequential — строго по черзі (як раніше);
+    DL_STRATEGY=race — hedged-гонка з затримкою DL_HEDGE_DELAYS на хост.
+
+    mode: auto|hd|sd|audio|file
+    """
+    mode = (mode or "auto").lower()
+    backends = _ordered_backends(url)
+    if (DL_STRATEGY or "").lower() == "race" and len(backends) > 1:
+        return await _run_race(url, mode, backends)
+    return await _run_sequential(url, mode, backends)
 
 
 def _pick_cookies_for(url: str) -> Optional[str]:
     """Повертає шлях до cookies-файлу за доменом."""
-    u = url.lower()
-    if "instagram.com" in u:
-        return INSTAGRAM_COOKIES
-    if "tiktok.com" in u or "vm.tiktok.com" in u:
-        return TIKTOK_COOKIES
-    if "youtube.com" in u or "youtu.be" in u:
-        return YOUTUBE_COOKIES
-    return None
+    return {
+        "instagram.com": INSTAGRAM_COOKIES,
+        "tiktok.com": TIKTOK_COOKIES,
+        "youtube.com": YOUTUBE_COOKIES,
+    }.get(links.match_host(url))
 
 
 def _base_headers(url: str) -> List[str]:
@@ -586,16 +1156,233 @@ def _base_headers(url: str) -> List[str]:
     return ["--add-header", f"Referer:{url}"]
 
 
-def _run_cmd(cmd: List[str]) -> None:
-    """Запускає одну команду yt-dlp та кидає RuntimeError, якщо вона впала."""
+def _use_pool() -> bool:
+    return (YTDLP_ENGINE or "").lower() != "subprocess" and ytdlp_pool.AVAILABLE
+
+
+# [download]  42.3% of ~ 12.34MiB at  1.23MiB/s ETA 00:10 (frag 3/20)
+_PROGRESS_RE = re.compile(
+    r"^\[download\]\s+(?P<percent>[\d.]+)%\s+of\s+~?\s*(?P<total>[\d.]+\s*[KMGT]?i?B)"
+    r"(?:\s+at\s+(?P<speed>\S+))?(?:\s+ETA\s+(?P<eta>\S+))?"
+)
+
+
+def _parse_progress(line: str) -> Optional[Dict]:
+    """Рядок прогресу yt-dlp -> {"percent", "total", "speed", "eta"} або None."""
+    m = _PROGRESS_RE.match(line.strip())
+    if not m:
+        return None
+    speed, eta = m.group("speed"), m.group("eta")
+    return {
+        "percent": float(m.group("percent")),
+        "total": m.group("total").replace(" ", ""),
+        "speed": speed if speed and "Unknown" not in speed else None,
+        "eta": eta if eta and "Unknown" not in eta else None,
+    }
+
+
+class _ProgressReporter:
+    """
+    Тротлінговані правки повідомлення "Секунду, тягну відео…" прогресом yt-dlp:
+    не частіше ніж раз на DL_PROGRESS_EVERY_SEC і лише якщо текст змінився.
+    """
+
+    def __init__(self, message, every: float):
+        self.message = message
+        self.every = float(every)
+        self.base = getattr(message, "text", None) or "Секунду, тягну відео…"
+        self._last_edit = 0.0
+        self._last_text = self.base
+        self._pending: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def push(self, p: Dict) -> None:
+        """Викликається з event loop; сама правка — окремою задачею."""
+        self._pending = p
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._edit_later())
+
+    async def _edit_later(self) -> None:
+        delay = self.every - (time.monotonic() - self._last_edit)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        p, self._pending = self._pending, None
+        if not p:
+            return
+        text = self._format(p)
+        if text == self._last_text:
+            return
+        self._last_edit = time.monotonic()
+        self._last_text = text
+        try:
+            await self.message.edit_text(text)
+        except Exception as e:
+            _log(f"PROGRESS EDIT FAIL: {e}")
+
+    def _format(self, p: Dict) -> str:
+        line = _format_progress(p)
+        return f"{self.base} {line}" if line else self.base
+
+    def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+
+def _format_progress(p: Dict) -> str:
+    parts = []
+    if p.get("percent") is not None:
+        parts.append(f"{p['percent']:.0f}%")
+    if p.get("total"):
+        parts.append(f"з {p['total']}")
+    if p.get("speed"):
+        parts.append(p["speed"])
+    if p.get("eta"):
+        parts.append(f"ETA {p['eta']}")
+    return " · ".join(parts)
+
+
+class _BatchProgress(_ProgressReporter):
+    """
+    Один статус на кілька посилань з одного повідомлення: рядок на посилання
+    (черга / прогрес / ✅ / ❌), правки тротлінгуються так само.
+    """
+
+    def __init__(self, message, every: float, urls: List[str]):
+        super().__init__(message, every)
+        self.labels = [links.match_host(u) or "?" for u in urls]
+        self.lines = ["⏳"] * len(urls)
+
+    def set(self, i: int, text: str) -> None:
+        self.lines[i] = text
+        self.push({"lines": True})
+
+    def _format(self, p: Dict) -> str:
+        rows = [f"{i + 1}. {label} — {line}" for i, (label, line) in enumerate(zip(self.labels, self.lines))]
+        return "\n".join([self.base] + rows)
+
+    async def finish(self) -> None:
+        """Підсумок без тротлінгу — після того як усі посилання завершились."""
+        self.close()
+        text = self._format({})
+        if text != self._last_text:
+            self._last_text = text
+            try:
+                await self.message.edit_text(text)
+            except Exception as e:
+                _log(f"PROGRESS EDIT FAIL: {e}")
+
+
+class _BatchLine:
+    """Репортер одного посилання в _BatchProgress (той самий інтерфейс, що й _ProgressReporter)."""
+
+    def __init__(self, batch: _BatchProgress, i: int):
+        self.batch = batch
+        self.i = i
+
+    def push(self, p: Dict) -> None:
+        if DL_PROGRESS_EDIT:
+            self.batch.set(self.i, _format_progress(p) or "⏳")
+
+    def queued(self, position: int) -> None:
+        self.batch.set(self.i, f"⏳ черга #{position}")
+
+    def close(self) -> None:
+        pass
+
+
+_progress: "ContextVar[Optional[_ProgressReporter | _BatchLine]]" = ContextVar("dl_progress", default=None)
+
+
+async def _read_lines(stream, on_line) -> None:
+    """Інкрементально читає stdout/stderr процесу (yt-dlp пише прогрес через \\r або \\n)."""
+    buf = b""
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            break
+        buf += chunk.replace(b"\r", b"\n")
+        *lines, buf = buf.split(b"\n")
+        for ln in lines:
+            if ln.strip():
+                on_line(ln.decode("utf-8", "replace"))
+    if buf.strip():
+        on_line(buf.decode("utf-8", "replace"))
+
+
+async def _run_cmd(cmd: List[str], timeout: float = 340, capture: bool = False) -> Optional[Dict]:
+    """
+    Запускає одну команду yt-dlp та кидає RuntimeError, якщо вона впала.
+    Скасування задачі (програш у race, зупинка бота) чи таймаут вбивають процес.
+    Прогрес іде у _ProgressReporter з контексту, якщо він є.
+
+    З пулом воркерів (YTDLP_ENGINE) повертає структурований результат
+    {"title", "id", "files": [{"path", "ext"}]}; у subprocess-режимі — None.
+    capture — лише subprocess-режим: stdout повністю, як {"stdout": текст}
+    (для --dump-json, де JSON — один довгий рядок).
+    """
     _log("RUN: " + " ".join(shlex.quote(x) for x in cmd))
-    res = subprocess.run(cmd, capture_output=True, text=True, timeout=340)
-    if res.stdout:
-        _log("STDOUT: " + res.stdout.strip()[:4000])
-    if res.stderr:
-        _log("STDERR: " + res.stderr.strip()[:4000])
-    if res.returncode != 0:
-        raise RuntimeError(res.stderr.strip() or res.stdout.strip() or "yt-dlp error")
+    reporter = _progress.get()
+
+    if _use_pool():
+        on_progress = None
+        if reporter is not None:
+            loop = asyncio.get_running_loop()
+            on_progress = lambda p: loop.call_soon_threadsafe(reporter.push, p)  # noqa: E731
+        cancel_event = threading.Event()
+        result = await _in_thread(
+            ytdlp_pool.download, cmd[1:], timeout, cancel_event, on_progress, cancel_event=cancel_event
+        )
+        _log(f"POOL RESULT: {len(result.get('files') or [])} file(s)")
+        return result
+
+    # --newline: кожне оновлення прогресу окремим рядком
+    argv = [("--newline" if x == "--no-progress" else x) for x in cmd]
+    # окрема група процесів: при скасуванні вбиваємо і дочірні ffmpeg
+    proc = await asyncio.create_subprocess_exec(
+        *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True
+    )
+    out_tail: "deque[str]" = deque(maxlen=50)
+    err_tail: "deque[str]" = deque(maxlen=50)
+
+    def _on_stdout(line: str) -> None:
+        p = _parse_progress(line)
+        if p is None:
+            out_tail.append(line)
+        elif reporter is not None:
+            reporter.push(p)
+
+    readers = [
+        asyncio.create_task(proc.stdout.read() if capture else _read_lines(proc.stdout, _on_stdout)),
+        asyncio.create_task(_read_lines(proc.stderr, err_tail.append)),
+    ]
+    try:
+        await asyncio.wait_for(proc.wait(), timeout=timeout)
+        await asyncio.gather(*readers)
+    except asyncio.TimeoutError:
+        raise RuntimeError("yt-dlp timeout")
+    finally:
+        if proc.returncode is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await asyncio.shield(proc.wait())
+        for r in readers:
+            r.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+    if capture:
+        out_tail.append(readers[0].result().decode("utf-8", "replace"))
+    stdout, stderr = "\n".join(out_tail), "\n".join(err_tail)
+    if capture and proc.returncode == 0:
+        return {"stdout": stdout}
+    if stdout:
+        _log("STDOUT: " + stdout.strip()[:4000])
+    if stderr:
+        _log("STDERR: " + stderr.strip()[:4000])
+    if proc.returncode != 0:
+        raise RuntimeError(stderr.strip() or stdout.strip() or "yt-dlp error")
+    return None
 
 
 # ===================== Конфіг yt-dlp =====================
@@ -624,7 +1411,7 @@ def _ig_cmds(url: str, outtmpl: str, cookies_file: Optional[str]) -> List[List[s
       - для stories додаємо --no-playlist, щоб качати тільки одну stories по її URL
       - для постів/рилів лишаємо плейлисти (каруселі) як є
     """
-    url_norm = _normalize_instagram_url(url)
+    url_norm = links.normalize_instagram(url)
     is_story = "/stories/" in url_norm
 
     ua = os.getenv("YDL_UA_IG") or (
@@ -661,17 +1448,17 @@ def _audio_cmds(url: str, outtmpl: str, cookies_file: Optional[str]) -> List[Lis
 
 def _build_cmds(url: str, outtmpl: str, profile: str = "auto") -> List[List[str]]:
     """Повертає список команд (різних стратегій) для yt-dlp."""
-    u = url.lower()
+    host = links.match_host(url)
     cookies = _pick_cookies_for(url)
 
     if profile == "audio":
         return _audio_cmds(url, outtmpl, cookies)
 
-    if "instagram.com" in u:
+    if host == "instagram.com":
         cmds = _ig_cmds(url, outtmpl, cookies)
         if profile == "sd":
             # більш легка якість, якщо доступно
-            url_norm = _normalize_instagram_url(url)
+            url_norm = links.normalize_instagram(url)
             base = [YTDLP_BIN, "--no-progress", "-o", outtmpl, url_norm] + _base_headers(url_norm) + [
                 "--no-warnings",
                 "--extractor-args", "instagram:reels_video=1,story=1,high_quality=1,allow_extra=1",
@@ -683,7 +1470,7 @@ def _build_cmds(url: str, outtmpl: str, profile: str = "auto") -> List[List[str]
         if profile == "hd":
             return cmds
         return cmds
-    if "tiktok.com" in u or "vm.tiktok.com" in u:
+    if host == "tiktok.com":
         cmds = _tt_cmds(url, outtmpl, cookies)
         if profile == "sd":
             base = [YTDLP_BIN, "--no-progress", "-o", outtmpl, url, "--merge-output-format", "mp4"] + _base_headers(url)
@@ -710,92 +1497,328 @@ def _build_cmds(url: str, outtmpl: str, profile: str = "auto") -> List[List[str]
     return _yt_cmds(url, outtmpl, cookies)
 
 
+# ===================== Pre-flight: формат під ліміт =====================
+
+# mp3 з --audio-quality 0 (VBR V0) — у середньому ~245 кбіт/с, беремо з запасом
+_MP3_KBPS = 256
+# оцінки filesize_approx / tbr×duration неточні — лишаємо запас
+_PREFLIGHT_MARGIN = 0.95
+
+_preflight_stats = {"checked": 0, "picked": 0, "to_shrink": 0, "rejected": 0, "unknown": 0, "errors": 0}
+
+
+def _format_size(f: Dict, duration) -> Optional[int]:
+    size = f.get("filesize") or f.get("filesize_approx")
+    if size:
+        return int(size)
+    tbr = f.get("tbr") or ((f.get("vbr") or 0) + (f.get("abr") or 0))
+    if tbr and duration:
+        return int(float(tbr) * 1000 / 8 * float(duration))
+    return None
+
+
+def _pick_format(info: Dict, limit: int, max_height: Optional[int] = None) -> Tuple[Optional[str], int]:
+    """
+    Найкращий формат (або пара відео+аудіо), що влазить у limit.
+    Повертає (селектор для -f, оцінка розміру). Якщо не влазить нічого —
+    (None, найменша оцінка); якщо розмірів не знаємо взагалі — (None, 0).
+    """
+    duration = info.get("duration")
+    videos: List[Dict] = []
+    audios: List[Tuple[Dict, int]] = []
+    for f in info.get("formats") or [info]:
+        if not f.get("format_id") or f.get("ext") == "mhtml":
+            continue
+        if f.get("vcodec") == "none":
+            size = _format_size(f, duration)
+            if f.get("acodec") != "none" and size:
+                audios.append((f, size))
+        elif not max_height or (f.get("height") or 0) <= max_height:
+            videos.append(f)
+
+    # аудіо до відео-only: m4a (mp4 склеюється без перекодування), далі — найкраще
+    audio = max(audios, key=lambda a: (a[0].get("ext") == "m4a", a[0].get("abr") or 0), default=None)
+
+    fits: List[Tuple[tuple, str, int]] = []
+    smallest = 0
+    for f in videos:
+        size = _format_size(f, duration)
+        if not size:
+            continue
+        sel = f["format_id"]
+        if f.get("acodec") == "none":
+            if audio is None:
+                continue
+            sel, size = f"{sel}+{audio[0]['format_id']}", size + audio[1]
+        smallest = min(smallest or size, size)
+        if size <= limit:
+            is_avc = str(f.get("vcodec") or "").startswith("avc")
+            fits.append(((f.get("height") or 0, is_avc, f.get("tbr") or 0), sel, size))
+
+    if fits:
+        _, sel, size = max(fits, key=lambda x: x[0])
+        return sel, size
+    return None, smallest
+
+
+def _too_large(size: int) -> MediaTooLarge:
+    _preflight_stats["rejected"] += 1
+    return MediaTooLarge(
+        f"Завелике для Telegram: ~{size // (1024 * 1024)} МБ навіть у найменшій якості "
+        f"(ліміт {_upload_limit() // (1024 * 1024)} МБ)",
+        size,
+    )
+
+
+async def _preflight(url: str, profile: str, td: str, fit: bool = False) -> Optional[Tuple[str, str, int]]:
+    """
+    Розбір форматів до завантаження. Повертає (селектор -f, шлях до info.json
+    для --load-info-json, ліміт файлу) або None, якщо вирішувати нема з чого.
+    fit — якщо не влазить жоден формат, але відео стиснеться ffmpeg'ом,
+    беремо формат до TRANSCODE_MAX_SOURCE_MB (≤720p) під перекодування.
+    Кидає MediaTooLarge, якщо не влазить жоден формат — ще до першого байта.
+    """
+    _preflight_stats["checked"] += 1
+    try:
+        info = await get_media_info(url)
+    except Exception as e:
+        _preflight_stats["errors"] += 1
+        _log(f"PREFLIGHT skip: {e}")
+        return None
+    if info.get("_type") == "playlist" or info.get("entries"):
+        _preflight_stats["unknown"] += 1
+        return None
+
+    limit = _upload_limit()
+    if profile == "audio":
+        duration = info.get("duration")
+        size = int(float(duration) * _MP3_KBPS * 1000 / 8) if duration else 0
+        if size > limit:
+            raise _too_large(size)
+        return None
+
+    max_height = 480 if profile == "sd" else None
+    sel, size = _pick_format(info, int(limit * _PREFLIGHT_MARGIN), max_height)
+    if sel is None and size and fit and transcode.fits(info.get("duration"), limit):
+        limit = transcode.SOURCE_LIMIT
+        sel, size = _pick_format(info, int(limit * _PREFLIGHT_MARGIN), max_height or 720)
+        if sel is not None:
+            _preflight_stats["to_shrink"] += 1
+            _log(f"PREFLIGHT: over {_upload_limit() // (1024 * 1024)} MB, fetching to shrink")
+    if sel is None:
+        if size:
+            raise _too_large(size)
+        _preflight_stats["unknown"] += 1
+        return None
+
+    _preflight_stats["picked"] += 1
+    _log(f"PREFLIGHT: -f {sel} (~{size // 1024} KiB)")
+    path = os.path.join(td, "preflight.info.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    return sel, path, limit
+
+
+def _with_format(cmd: List[str], url: str, fmt: str, info_path: str) -> List[str]:
+    """Команда, що качає вибраний формат з готового info.json замість URL."""
+    out = cmd[:]
+    if "-f" in out:
+        i = out.index("-f")
+        del out[i:i + 2]
+    i = out.index(url)
+    out[i:i + 1] = ["--load-info-json", info_path]
+    return out + ["-f", fmt]
+
+
+def preflight_stats() -> Dict[str, int]:
+    return dict(_preflight_stats)
+
+
 # ===================== Основний sync-даунлоадер =====================
 
-def _download_sync(url: str, profile: str = "auto") -> Tuple[List[Dict[str, str]], str]:
+async def _download_ytdlp(url: str, profile: str = "auto", fit: bool = False) -> Tuple[List[Dict[str, str]], str]:
     """
-    Синхронно качає контент і повертає (items, title):
+    Качає контент через yt-dlp і повертає (items, title):
       items: список {"path": str, "type": "photo"|"video"}
       title: str
     Для IG-каруселей / плейлистів може бути кілька файлів.
+    fit — завелике відео можна взяти під перекодування (див. _preflight).
     """
     _log(f"download START: {url}")
 
-    with tempfile.TemporaryDirectory() as td:
-        # IMPORTANT: у шаблоні є %(id)s — ID трека / сторіс / відео
-        outtmpl = os.path.join(td, "%(id)s-%(title).80s-%(autonumber)03d.%(ext)s")
-        cmds = _build_cmds(url, outtmpl, profile=profile)
+    # робоча тека задачі належить лише цьому бекенду — качаємо прямо в неї
+    td = _job_dir()
+    # IMPORTANT: у шаблоні є %(id)s — ID трека / сторіс / відео
+    outtmpl = os.path.join(td, "%(id)s-%(title).80s-%(autonumber)03d.%(ext)s")
+    cmds = _build_cmds(url, outtmpl, profile=profile)
+
+    # каруселі IG та їхні окремі стратегії — без pre-flight
+    if DL_PREFLIGHT and links.match_host(url) != "instagram.com":
+        picked = await _preflight(url, profile, td, fit)
+        if picked is not None:
+            fmt, info_path, limit = picked
+            # запасні стратегії теж не повинні тягнути більше за ліміт
+            cmds = [_with_format(cmds[0], url, fmt, info_path)] + [
+                c + ["--max-filesize", str(limit)] for c in cmds
+            ]
 
-        last_err: Optional[Exception] = None
+    last_err: Optional[Exception] = None
+    result: Optional[Dict] = None
 
-        for i, cmd in enumerate(cmds, 1):
-            try:
-                _log(f"[try {i}/{len(cmds)}]")
-                _run_cmd(cmd)
-                last_err = None
-                break
-            except Exception as e:
-                last_err = e
-                _log(f"[try {i}] FAIL: {e}")
+    for i, cmd in enumerate(cmds, 1):
+        try:
+            _log(f"[try {i}/{len(cmds)}]")
+            result = await _run_cmd(cmd)
+            last_err = None
+            break
+        except Exception as e:
+            last_err = e
+            _log(f"[try {i}] FAIL: {e}")
 
-        if last_err:
-            _log(f"ALL FAIL for {url}")
-            raise last_err
+    if last_err:
+        _log(f"ALL FAIL for {url}")
+        raise last_err
 
-        # Забираємо ВСІ файли, що викачав yt-dlp
-        paths: List[str] = []
-        for p in sorted(pathlib.Path(td).glob("*")):
-            if p.is_file():
-                paths.append(str(p))
+    return _collect_downloads(td, result)
 
-        if not paths:
-            raise RuntimeError("Файли після завантаження не знайдено")
 
-        # Переносимо у стабільну TMP_DIR
-        os.makedirs(TMP_DIR, exist_ok=True)
+def _collect_downloads(td: str, result: Optional[Dict]) -> Tuple[List[Dict[str, str]], str]:
+    """Будує (items, title) з того, що yt-dlp поклав у робочу теку."""
+    # Воркер пулу повертає точні шляхи; у subprocess-режимі — забираємо ВСІ файли з td
+    if result is not None:
+        paths = [f["path"] for f in result.get("files") or [] if os.path.isfile(f["path"])]
+    else:
+        paths = [
+            str(p) for p in sorted(pathlib.Path(td).glob("*"))
+            if p.is_file() and not p.name.endswith((".part", ".ytdl", ".json"))
+        ]
 
-        items: List[Dict[str, str]] = []
-        for p in paths:
-            ext = pathlib.Path(p).suffix.lower()
-            media_type = "photo" if ext in {".jpg", ".jpeg", ".png", ".webp"} else "video"
-            final_path = os.path.join(TMP_DIR, os.path.basename(p))
-            try:
-                os.replace(p, final_path)
-            except Exception:
-                import shutil
-                shutil.copy2(p, final_path)
-            items.append({"path": final_path, "type": media_type})
+    if not paths:
+        raise RuntimeError("Файли після завантаження не знайдено")
 
-        # Тайтл — з першого файлу (до суфікса -NNN)
-        base_stem = pathlib.Path(paths[0]).stem
-        title_raw = base_stem
+    items: List[Dict[str, str]] = []
+    for p in paths:
+        ext = pathlib.Path(p).suffix.lower()
+        media_type = "photo" if ext in {".jpg", ".jpeg", ".png", ".webp"} else "video"
+        items.append({"path": p, "type": media_type})
+
+    # Тайтл — з метаданих воркера, інакше з першого файлу (до суфікса -NNN)
+    title_raw = (result or {}).get("title") or ""
+    if not title_raw:
+        title_raw = pathlib.Path(paths[0]).stem
         for _ in range(2):
             if "-" in title_raw:
                 title_raw = title_raw.rsplit("-", 1)[0]
-        title = _sanitize_name(title_raw or "file")
+    title = _sanitize_name(title_raw or "file")
 
-        _log(f"SUCCESS: {len(items)} item(s) [{title}]")
-        return items, title
+    _log(f"SUCCESS: {len(items)} item(s) [{title}]")
+    return items, title
+
+
+# ===================== Пост-обробка (ffmpeg) =====================
+
+async def _postprocess(items: List[Dict], mode: str) -> List[Dict]:
+    """
+    Готує файли до відправки (services/transcode.py): завелике відео чи фото
+    стискає під ліміти Telegram, відео отримує width/height/duration і прев'ю.
+    Потоки з HTTP та режими "file" / "audio" не чіпаємо.
+    """
+    if not transcode.AVAILABLE or mode in ("file", "audio"):
+        return items
+    ws = _workspace.get()
+    td = ws.sub("transcode") if ws is not None else _job_dir()
+    out: List[Dict] = []
+    for it in items:
+        path = it.get("path")
+        if not path or it["type"] not in ("photo", "video"):
+            out.append(it)
+            continue
+        stem = pathlib.Path(path).stem
+        size = _item_size(it)
+
+        if it["type"] == "photo":
+            if TRANSCODE_ENABLED and size > transcode.PHOTO_LIMIT:
+                new = await transcode.fit_photo(path, os.path.join(td, f"{stem}.fit.jpg"))
+                if new:
+                    _log(f"PHOTO FIT: {size // 1024} KiB -> {os.path.getsize(new) // 1024} KiB")
+                    it = {**it, "path": new}
+            out.append(it)
+            continue
+
+        try:
+            meta = await transcode.probe(path)
+        except Exception as e:
+            _log(f"PROBE FAIL: {e}")
+            out.append(it)
+            continue
+        if TRANSCODE_ENABLED and size > _upload_limit():
+            new = await transcode.fit_video(
+                path, _upload_limit(), os.path.join(td, f"{stem}.fit.mp4"), meta.get("duration") or 0
+            )
+            if new:
+                _log(f"VIDEO FIT: {size // 1024} KiB -> {os.path.getsize(new) // 1024} KiB")
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                it = {**it, "path": new}
+                try:
+                    meta = await transcode.probe(new)
+                except Exception:
+                    pass
+            else:
+                # джерело качали під стиснення, а воно не вдалось — не шлемо в Telegram на відмову
+                raise MediaTooLarge(f"Завелике для Telegram навіть після стиснення (~{size // (1024 * 1024)} МБ)", size)
+        thumb = await transcode.thumbnail(it["path"], os.path.join(td, f"{stem}.thumb.jpg"), meta.get("duration") or 0)
+        it = {**it, **meta}
+        if thumb:
+            it["thumb"] = thumb
+        out.append(it)
+    return out
+
+
+def _video_extra(it: Dict) -> Dict:
+    """Розміри, тривалість і прев'ю для send_video / InputMediaVideo, якщо відомі."""
+    extra = {k: int(it[k]) for k in ("width", "height", "duration") if it.get(k)}
+    if it.get("thumb"):
+        extra["thumbnail"] = FSInputFile(it["thumb"])
+    if extra:
+        extra["supports_streaming"] = True
+    return extra
 
 
 # ===================== Публічний API для бота =====================
 
 def is_supported(url: str) -> bool:
-    """Чи схожий URL на підтримуваний відео-хост."""
-    u = (url or "").lower()
-    return any(h in u for h in VIDEO_HOSTS)
+    """Чи веде URL на підтримуваний відео-хост (за суфіксом хоста, не підрядком)."""
+    return links.match_host(url) is not None
+
+
+# pre-flight — лише метадані; довше чекати — вже дорожче, ніж одразу качати
+_INFO_TIMEOUT = 30
 
 
-def _ytdlp_info_sync(url: str) -> Dict[str, object]:
+async def _ytdlp_info(url: str) -> Dict[str, object]:
+    """
+    yt-dlp --dump-json. Як і завантаження, скасування задачі звільняє воркер
+    пулу (cancel_event) або вбиває процес (_run_cmd).
+    """
     cookies = _pick_cookies_for(url)
     cmd = [YTDLP_BIN, "--no-warnings", "--no-playlist", "--dump-json", "--no-download", url] + _base_headers(url)
     if cookies:
         cmd += ["--cookies", cookies]
     _log("INFO RUN: " + " ".join(shlex.quote(x) for x in cmd if x != (cookies or "")))
-    res = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-    out = (res.stdout or "").strip()
-    if res.returncode != 0 or not out:
-        raise RuntimeError((res.stderr or out or "yt-dlp info error").strip()[:4000])
+    if _use_pool():
+        cancel_event = threading.Event()
+        return await _in_thread(ytdlp_pool.info, cmd[1:], _INFO_TIMEOUT, cancel_event, cancel_event=cancel_event)
+    token = _progress.set(None)  # у --dump-json прогресу немає
+    try:
+        res = await _run_cmd(cmd, timeout=_INFO_TIMEOUT, capture=True)
+    finally:
+        _progress.reset(token)
+    out = (res or {}).get("stdout", "").strip()
+    if not out:
+        raise RuntimeError("yt-dlp info error")
 
     # yt-dlp може вивести кілька JSON рядків; беремо останній
     lines = [ln for ln in out.splitlines() if ln.strip().startswith("{") and ln.strip().endswith("}")]
@@ -806,115 +1829,393 @@ def _ytdlp_info_sync(url: str) -> Dict[str, object]:
         raise RuntimeError(f"yt-dlp json parse error: {e}")
 
 
+_INFO_HEAVY_KEYS = ("automatic_captions", "subtitles", "thumbnails", "heatmap")
+
+
 async def get_media_info(url: str) -> Dict[str, object]:
-    return await asyncio.to_thread(_ytdlp_info_sync, url)
+    info = link_cache.get("info", url)
+    if info is None:
+        info = await _ytdlp_info(url)
+        # субтитри й прев'ю — левова частка JSON, для вибору формату не потрібні
+        for k in _INFO_HEAVY_KEYS:
+            info.pop(k, None)
+        link_cache.put("info", url, info)
+    return info
+
+
+def _sent_file(msg) -> Optional[Dict[str, str]]:
+    """{"type", "file_id"} з повідомлення, яке повернув Telegram після відправки."""
+    if msg is None:
+        return None
+    if getattr(msg, "video", None):
+        return {"type": "video", "file_id": msg.video.file_id}
+    if getattr(msg, "animation", None):
+        return {"type": "animation", "file_id": msg.animation.file_id}
+    if getattr(msg, "photo", None):
+        return {"type": "photo", "file_id": msg.photo[-1].file_id}
+    if getattr(msg, "audio", None):
+        return {"type": "audio", "file_id": msg.audio.file_id}
+    if getattr(msg, "document", None):
+        return {"type": "document", "file_id": msg.document.file_id}
+    return None
 
 
-async def download_url(chat_id: int, url: str, bot, mode: str = "auto") -> None:
+async def _send_items(chat_id: int, bot, items: List[Dict], title: str, force_document: bool) -> List[Dict]:
     """
-    Завантажує контент і ВІДПРАВЛЯЄ В ЧАТ.
-    Підтримує:
-      - одиночне відео/фото
-      - альбом (карусель) до 10 елементів
-      - Instagram stories (одна сторі за URL)
+    Відправляє файли в чат і повертає список відправок з file_id
+    (для кешу): {"kind": "single", "type", "file_id"} | {"kind": "album", "media": [...]}.
+    Item — файл на диску ({"path"}) або потік з HTTP ({"stream", "size"}).
     """
-    items, title = await asyncio.to_thread(_download_with_fallbacks_sync, url, mode)
-    force_document = (mode or "").lower() == "file"
+    ops: List[Dict] = []
+
+    async def _single(send, it: Dict, **extra) -> None:
+        sent = _sent_file(await send(chat_id, _input_file(it), caption=title, **extra))
+        if sent:
+            ops.append({"kind": "single", **sent})
 
     # Розкладаємо по групах з урахуванням лімітів Telegram
-    photos_group: List[str] = []
-    videos_group: List[str] = []
-    docs: List[str] = []
-    audios: List[str] = []
+    photos_group: List[Dict] = []
+    videos_group: List[Dict] = []
+    docs: List[Dict] = []
+    audios: List[Dict] = []
 
     for it in items:
-        p = it["path"]
         t = it["type"]
-        try:
-            size = os.path.getsize(p)
-        except OSError:
-            size = 0
+        size = _item_size(it)
 
         if force_document:
-            docs.append(p)
+            docs.append(it)
             continue
 
         if t == "audio":
-            audios.append(p)
+            audios.append(it)
         elif t == "photo":
             # Фото до 10 МБ можемо як photo, але одиночні краще як документ (щоб не кропило)
             if size <= 10 * 1024 * 1024:
-                photos_group.append(p)
+                photos_group.append(it)
             else:
-                docs.append(p)
+                docs.append(it)
         else:
-            # Відео до ~50 МБ як video, інакше документ
-            if size <= 49 * 1024 * 1024:
-                videos_group.append(p)
+            # Відео в межах ліміту аплоаду як video, інакше документ
+            if size <= _upload_limit():
+                videos_group.append(it)
             else:
-                docs.append(p)
+                docs.append(it)
 
-    album_paths = photos_group + videos_group
+    album_items = photos_group + videos_group
 
     # Якщо багато елементів — шлемо як альбом (media_group)
-    if len(album_paths) > 1:
+    if len(album_items) > 1:
         media = []
-        for idx, p in enumerate(album_paths[:10]):
-            inp = FSInputFile(p)
-            if p in photos_group:
+        for idx, it in enumerate(album_items[:10]):
+            inp = _input_file(it)
+            if it["type"] == "photo":
                 media.append(InputMediaPhoto(media=inp, caption=title if idx == 0 else None))
             else:
-                media.append(InputMediaVideo(media=inp, caption=title if idx == 0 else None))
-        await bot.send_media_group(chat_id, media)
+                media.append(InputMediaVideo(media=inp, caption=title if idx == 0 else None, **_video_extra(it)))
+        msgs = await bot.send_media_group(chat_id, media)
+        sent = [f for f in (_sent_file(x) for x in (msgs or [])) if f]
+        if sent:
+            ops.append({"kind": "album", "media": sent})
 
         # Якщо ще залишились (більше 10) — шлемо як документи
-        for p in album_paths[10:]:
-            await bot.send_document(chat_id, FSInputFile(p), caption=title)
+        for it in album_items[10:]:
+            await _single(bot.send_document, it)
 
         # Великі файли тільки документами
-        for p in docs:
-            await bot.send_document(chat_id, FSInputFile(p), caption=title)
+        for it in docs:
+            await _single(bot.send_document, it)
 
     else:
         # Один файл → особливий кейс для фото (щоб не кропило)
         it = items[0]
-        p, t = it["path"], it["type"]
-
-        try:
-            size = os.path.getsize(p)
-        except OSError:
-            size = 0
-
-        f = FSInputFile(p)
+        t = it["type"]
+        size = _item_size(it)
 
         if force_document:
-            await bot.send_document(chat_id, f, caption=title)
+            await _single(bot.send_document, it)
         elif t == "audio":
             # аудіо шлемо нижче окремо (щоб не було дубляжу для multi-file)
             pass
         elif t == "photo":
-            await bot.send_photo(chat_id, f, caption=title)
+            await _single(bot.send_photo, it)
         else:
-            if size <= 49 * 1024 * 1024:
-                await bot.send_video(chat_id, f, caption=title)
+            if size <= _upload_limit():
+                await _single(bot.send_video, it, **_video_extra(it))
             else:
-                await bot.send_document(chat_id, f, caption=title)
+                await _single(bot.send_document, it)
 
     # Аудіо — окремо (не входить у media_group)
-    for p in audios:
-        try:
-            size = os.path.getsize(p)
-        except OSError:
-            size = 0
-        f = FSInputFile(p)
-        if size <= 49 * 1024 * 1024 and not force_document:
-            await bot.send_audio(chat_id, f, caption=title)
+    for it in audios:
+        if _item_size(it) <= _upload_limit() and not force_document:
+            await _single(bot.send_audio, it)
         else:
-            await bot.send_document(chat_id, f, caption=title)
+            await _single(bot.send_document, it)
 
-    # Прибираємо тимчасові файли
-    for it in items:
+    return ops
+
+
+async def _send_cached(chat_id: int, bot, entry: Dict, cache_key: str, mode: str) -> bool:
+    """
+    Перевідправка за file_id з кешу. Якщо Telegram відхилив file_id, запис
+    кешу видаляється; False — лише коли не дійшло нічого (тоді качаємо заново).
+    Якщо частина вже в чаті — True: повна перевідправка дала б дублі.
+    """
+    title = entry.get("caption") or None
+    sent = 0
+    try:
+        for op in entry.get("ops") or []:
+            if op.get("kind") == "album":
+                media = []
+                for idx, m in enumerate(op["media"]):
+                    cls = InputMediaPhoto if m["type"] == "photo" else InputMediaVideo
+                    media.append(cls(media=m["file_id"], caption=title if idx == 0 else None))
+                await bot.send_media_group(chat_id, media)
+            else:
+                kind = op.get("type")
+                if kind not in ("video", "animation", "photo", "audio"):
+                    kind = "document"
+                await getattr(bot, f"send_{kind}")(chat_id, op["file_id"], caption=title)
+            sent += 1
+    except TelegramBadRequest as e:
+        _log(f"FILE_ID CACHE STALE: {e} (sent {sent}/{len(entry.get('ops') or [])})")
+        await media_cache.invalidate(cache_key, mode)
+        return sent > 0
+    return True
+
+
+class _SharedDownload:
+    """
+    Одне завантаження (url, mode), на яке чекають усі одночасні запити.
+    Робоча тека (і невідправлені потоки) прибираються, коли останній
+    відправник викличе release(), але не раніше, ніж завершаться потоки
+    бекендів, що в неї пишуть (див. _in_thread).
+    """
+
+    def __init__(self, staged: bool = False):
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.leader_sent = asyncio.Event()
+        self.users = 0
+        self.staged = staged  # лише диск: повтор для тих, кому не дістався потік
+        self.workspace: Optional[workspace.Workspace] = None
+
+    def release(self) -> None:
+        self.users -= 1
+        if self.users > 0 or not self.future.done():
+            return
+        if not self.future.cancelled() and self.future.exception() is None:
+            items, _title = self.future.result()
+            _cleanup_items(items)
+        if self.workspace is not None:
+            self.workspace.release()
+
+
+_inflight: Dict[Tuple[str, str], _SharedDownload] = {}
+_inflight_stats = {"started": 0, "joined": 0}
+
+
+def _download_lane(url: str) -> str:
+    """Смуга планувальника: довгі YouTube-відео окремо від коротких TikTok/IG/Shorts."""
+    if links.match_host(url) == "youtube.com" and "/shorts/" not in url:
+        return "long"
+    return "short"
+
+
+async def _shared_download(
+    url: str, mode: str, key: Tuple[str, str], chat_id: int, bot, staged: bool = False
+) -> Tuple[_SharedDownload, bool]:
+    """
+    Повертає (job, is_leader). Перший запит качає, решта чекають його результат.
+    Викликач зобов'язаний зробити job.release() після відправки.
+    Саме завантаження йде через планувальник (services/download_queue.py).
+    staged — без стрімінгу в аплоад, файли на диску для всіх відправників.
+    """
+    job = _inflight.get(key)
+    if job is not None:
+        job.users += 1
+        _inflight_stats["joined"] += 1
+        _log(f"SINGLE-FLIGHT JOIN: {key[0]} mode={key[1]} users={job.users}")
         try:
-            os.remove(it["path"])
-        except Exception:
-            pass
+            await asyncio.shield(job.future)
+        except BaseException:
+            job.release()
+            raise
+        return job, False
+
+    job = _SharedDownload(staged)
+    job.users += 1
+    _inflight[key] = job
+    _inflight_stats["started"] += 1
+    async def _on_queued(position: int) -> None:
+        reporter = _progress.get()
+        if isinstance(reporter, _BatchLine):
+            reporter.queued(position)  # пакет — позиція в рядку спільного статусу
+            return
+        await bot.send_message(chat_id, f"⏳ Багато завантажень, ти в черзі: #{position}")
+
+    try:
+        async with download_queue.slot(chat_id, _download_lane(url), on_queued=_on_queued):
+            job.workspace = await workspace.acquire(TMP_DIR)
+            token = _workspace.set(job.workspace)
+            job_token = _shared_job.set(job)
+            try:
+                items, title = await _download_with_fallbacks(url, mode)
+                try:
+                    res = (await _postprocess(items, mode), title)
+                except BaseException:
+                    _cleanup_items(items)
+                    raise
+            finally:
+                _shared_job.reset(job_token)
+                _workspace.reset(token)
+        job.future.set_result(res)
+    except BaseException as e:
+        err = e if isinstance(e, Exception) else RuntimeError("download cancelled")
+        if isinstance(err, link_cache.KnownFailure):
+            link_cache.remember_failure(key[0], mode, err)
+        job.future.set_exception(err)
+        job.future.exception()  # позначаємо як прочитане, якщо ніхто не чекав
+        job.release()
+        raise
+    finally:
+        _inflight.pop(key, None)
+    return job, True
+
+
+def failure_reason(exc: BaseException) -> Optional[str]:
+    """Причина невдачі для користувача (приватне, завелике, ...) або None, якщо вона невідома."""
+    if isinstance(exc, link_cache.KnownFailure):
+        return str(exc)
+    if isinstance(exc, MediaTooLarge):
+        size = f" (~{exc.size // (1024 * 1024)} МБ)" if exc.size else ""
+        return link_cache.MESSAGES["too_large"] + size
+    return None
+
+
+def inflight_stats() -> Dict[str, int]:
+    return {**_inflight_stats, "in_flight": len(_inflight)}
+
+
+async def download_url(chat_id: int, url: str, bot, mode: str = "auto", status_msg=None) -> None:
+    """
+    Завантажує контент і ВІДПРАВЛЯЄ В ЧАТ.
+    Підтримує:
+      - одиночне відео/фото
+      - альбом (карусель) до 10 елементів
+      - Instagram stories (одна сторі за URL)
+
+    Якщо це посилання вже відправляли — шлемо за кешованими file_id.
+    status_msg — повідомлення "Секунду, тягну відео…", у яке (DL_PROGRESS_EDIT)
+    пишеться прогрес yt-dlp.
+    """
+    reporter = None
+    if status_msg is not None and DL_PROGRESS_EDIT:
+        reporter = _ProgressReporter(status_msg, DL_PROGRESS_EVERY_SEC)
+    token = _progress.set(reporter)
+    try:
+        await _download_url(chat_id, url, bot, mode)
+    finally:
+        _progress.reset(token)
+        if reporter is not None:
+            reporter.close()
+
+
+async def download_many(chat_id: int, urls: List[str], bot, status_msg=None) -> List[Optional[Exception]]:
+    """
+    Кілька посилань з одного повідомлення. Завантаження стартують одночасно
+    (ліміти тримає планувальник), відправка — щойно готово або, з
+    DL_BATCH_ORDER=ordered, у порядку посилань. Замість статусу на кожне
+    посилання — один status_msg з рядком на посилання.
+    Повертає помилку (або None) для кожного посилання.
+    """
+    ordered = (DL_BATCH_ORDER or "").lower() == "ordered"
+    batch = _BatchProgress(status_msg, DL_PROGRESS_EVERY_SEC, urls) if status_msg is not None else None
+    turns = [asyncio.Event() for _ in urls]
+    results: List[Optional[Exception]] = [None] * len(urls)
+
+    async def _one(i: int, url: str) -> None:
+        before_send = turns[i - 1].wait if ordered and i > 0 else None
+        token = _progress.set(_BatchLine(batch, i) if batch is not None else None)
+        try:
+            await _download_url(chat_id, url, bot, "auto", before_send=before_send)
+            if batch is not None:
+                batch.set(i, "✅")
+        except Exception as e:
+            results[i] = e
+            _log(f"BATCH FAIL: {url}: {e}")
+            if batch is not None:
+                batch.set(i, f"❌ {failure_reason(e) or 'не вийшло'}")
+        finally:
+            _progress.reset(token)
+            turns[i].set()  # наступне посилання може відправлятись
+
+    try:
+        await asyncio.gather(*(_one(i, u) for i, u in enumerate(urls)))
+    finally:
+        if batch is not None:
+            await batch.finish()
+    return results
+
+
+async def _download_url(
+    chat_id: int, url: str, bot, mode: str, before_send: Optional[Callable[[], Awaitable]] = None,
+    staged: bool = False,
+) -> None:
+    """
+    before_send — чекаємо перед відправкою (черговість у download_many). Таке
+    завантаження йде на диск (потік не висить, поки чекаємо черги), а лідер
+    одразу відпускає послідовників з інших чатів — вони шлють свої копії файлів.
+    staged — повтор через диск для послідовника, якому не дістався потік лідера.
+    """
+    mode = (mode or "auto").lower()
+    # короткі посилання розгортаємо, решту зводимо до одного URL на контент
+    url = links.canonical(await links.resolve(url, await _http_session()))
+    cache_key = links.content_key(url)
+
+    cached = await media_cache.get(cache_key, mode)
+    if cached:
+        if before_send is not None:
+            await before_send()
+        if await _send_cached(chat_id, bot, cached, cache_key, mode):
+            _log(f"FILE_ID CACHE HIT: {cache_key} mode={mode}")
+            return
+
+    known = link_cache.failure(cache_key, mode)
+    if known is not None:
+        _log(f"KNOWN FAILURE: {cache_key} mode={mode} {known.kind}")
+        raise known
+
+    key = (cache_key, f"{mode}:staged" if staged else mode)
+    job, is_leader = await _shared_download(
+        url, mode, key, chat_id, bot, staged=staged or before_send is not None
+    )
+    restage = False
+    try:
+        if before_send is not None:
+            if is_leader:
+                job.leader_sent.set()
+            await before_send()
+        if not is_leader:
+            # чекаємо, поки лідер відправить і закешує file_id — тоді без повторного аплоаду
+            await job.leader_sent.wait()
+            cached = await media_cache.get(cache_key, mode)
+            if cached and await _send_cached(chat_id, bot, cached, cache_key, mode):
+                return
+        items, title = job.future.result()
+        if not is_leader and any("stream" in it for it in items):
+            # потік уже спожив лідер, а file_id у кеші немає — одна спільна
+            # повторна задача з файлами на диску, через планувальник
+            restage = True
+        else:
+            try:
+                ops = await _send_items(chat_id, bot, items, title, mode == "file")
+                await media_cache.put(cache_key, mode, title, ops)
+            finally:
+                if is_leader:
+                    job.leader_sent.set()
+    finally:
+        # тимчасові файли прибирає останній відправник
+        job.release()
+    if restage:
+        _log(f"SINGLE-FLIGHT RESTAGE: {cache_key} mode={mode}")
+        await _download_url(chat_id, url, bot, mode, staged=True)
@@ -27,28 +27,28 @@ async def ensure_admin(m: Message) -> bool:
 async def air_on_city(m: Message):
     if not await ensure_admin(m):
         return
-    set_air_city(m.chat.id, True)
+    await set_air_city(m.chat.id, True)
     await m.answer("✅ Увімкнув сповіщення про тривогу для м. Київ.")
 
 @router.message(Command("air_off_kyiv"))
 async def air_off_city(m: Message):
     if not await ensure_admin(m):
         return
-    set_air_city(m.chat.id, False)
+    await set_air_city(m.chat.id, False)
     await m.answer("⛔️ Вимкнув сповіщення для м. Київ.")
 
 @router.message(Command("air_on_region"))
 async def air_on_region(m: Message):
     if not await ensure_admin(m):
         return
-    set_air_region(m.chat.id, True)
+    await set_air_region(m.chat.id, True)
     await m.answer("✅ Увімкнув сповіщення для Київської області (вкл. Бучанський р-н).")
 
 @router.message(Command("air_off_region"))
 async def air_off_region(m: Message):
     if not await ensure_admin(m):
         return
-    set_air_region(m.chat.id, False)
+    await set_air_region(m.chat.id, False)
     await m.answer("⛔️ Вимкнув сповіщення для Київської області.")
 
 @router.message(Command("air_status"))
@@ -1,17 +1,20 @@
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
-from utils import upsert_chat, remember_user
-from downloader import download_url, is_supported
+from utils import upsert_chat, remember_user, is_local_admin
+from downloader import download_url, is_supported, inflight_stats, preflight_stats
+from db import pool_stats
+import instagram_client
+from services import user_map, chat_settings, mutes, media_cache, download_queue, backend_stats, ytdlp_pool, cobalt_quality, workspace, transcode, links, link_cache
 import html
 
 router = Router()
 
 @router.message(Command("start","help"))
 async def help_cmd(m: Message):
-    upsert_chat(m.chat.id)
+    await upsert_chat(m.chat.id)
     if m.from_user:
-        remember_user(m.chat.id, m.from_user.id, m.from_user.username)
+        await remember_user(m.chat.id, m.from_user.id, m.from_user.username)
     txt = (
         "Я — БОТ МЄШАНЯ. Команди:\n"
         "<code>/ping</code> — перевірка\n"
@@ -41,28 +44,91 @@ async def help_cmd(m: Message):
 @router.message(Command("ping"))
 async def ping_cmd(m: Message):
     if m.from_user:
-        remember_user(m.chat.id, m.from_user.id, m.from_user.username)
+        await remember_user(m.chat.id, m.from_user.id, m.from_user.username)
     await m.answer("pong")
 
 @router.message(Command("id"))
 async def id_cmd(m: Message):
     if m.from_user:
-        remember_user(m.chat.id, m.from_user.id, m.from_user.username)
+        await remember_user(m.chat.id, m.from_user.id, m.from_user.username)
     await m.answer(f"chat_id: <code>{m.chat.id}</code>")
 
+# запас під ліміт Telegram 4096 символів на повідомлення
+_STATS_CHUNK = 4000
+_STATS_ROW = 700  # після екранування — не більше ~3500 символів
+
+def _stats_section(name: str, data: dict) -> list:
+    """Секція /stats; задовга (напр. backends по хостах) ріжеться по рядках на кілька блоків."""
+    head = f"<b>{html.escape(name)}</b>\n"
+    blocks, rows = [], []
+    for k, v in data.items():
+        row = html.escape(f"  {k}: {v}"[:_STATS_ROW], quote=False)
+        if rows and len(head) + sum(len(r) + 1 for r in rows) + len(row) + 20 > _STATS_CHUNK:
+            blocks.append(head + "<code>" + "\n".join(rows) + "</code>")
+            rows = []
+        rows.append(row)
+    blocks.append(head + "<code>" + "\n".join(rows) + "</code>")
+    return blocks
+
+def _stats_messages(sections: list) -> list:
+    """Склеює блоки секцій у повідомлення не довші за _STATS_CHUNK."""
+    out = []
+    for block in sections:
+        if out and len(out[-1]) + 2 + len(block) <= _STATS_CHUNK:
+            out[-1] += "\n\n" + block
+        else:
+            out.append(block)
+    return out
+
+@router.message(Command("stats"))
+async def stats_cmd(m: Message):
+    """/stats — усі секції; /stats backends — лише секції, в назві яких є слово."""
+    if not m.from_user or not is_local_admin(m.from_user.id):
+        return
+    parts = (m.text or "").split(maxsplit=1)
+    only = parts[1].strip().lower() if len(parts) > 1 else ""
+    sources = [
+        ("DB pool", pool_stats),
+        ("user_map write-behind", user_map.stats),
+        ("username cache", user_map.username_stats),
+        ("chat settings cache", chat_settings.stats),
+        ("mute index", mutes.stats),
+        ("media file_id cache", media_cache.stats),
+        ("links", links.stats),
+        ("link cache", link_cache.stats),
+        ("downloads in flight", inflight_stats),
+        ("download queue", download_queue.stats),
+        ("download pre-flight", preflight_stats),
+        ("backends", backend_stats.stats),
+        ("cobalt quality", cobalt_quality.stats),
+        ("download workspaces", workspace.stats),
+        ("yt-dlp workers", ytdlp_pool.stats),
+        ("transcode", transcode.stats),
+        ("instagram sessions", instagram_client.stats),
+    ]
+    sections = []
+    for name, fn in sources:
+        if only and only not in name.lower():
+            continue
+        sections.extend(_stats_section(name, fn()))
+    if not sections:
+        return await m.answer("Секції: " + ", ".join(name for name, _ in sources))
+    for text in _stats_messages(sections):
+        await m.answer(text)
+
 @router.message(Command("get"))
 async def get_cmd(m: Message):
     if m.from_user:
-        remember_user(m.chat.id, m.from_user.id, m.from_user.username)
+        await remember_user(m.chat.id, m.from_user.id, m.from_user.username)
     parts = (m.text or "").split(maxsplit=1)
     if len(parts) < 2:
         return await m.answer("Використай: /get <url>")
     url = parts[1].strip()
     if not is_supported(url):
         return await m.answer("Підтримую: YouTube, TikTok, Instagram (публічні).")
-    await m.answer("Секунду, тягну відео…")
+    status = await m.answer("Секунду, тягну відео…")
     try:
-        await download_url(m.chat.id, url, m.bot)
+        await download_url(m.chat.id, url, m.bot, status_msg=status)
     except Exception as e:
         err = html.escape(str(e))[:1500]
         await m.answer(f"Не вийшло завантажити: <code>{err}</code>")
@@ -14,8 +14,8 @@ router = Router()
 @router.message(Command("joke"))
 async def joke_cmd(m: Message):
     if m.from_user:
-        remember_user(m.chat.id, m.from_user.id, m.from_user.username)
-    ch = get_chat(m.chat.id) or {}
+        await remember_user(m.chat.id, m.from_user.id, m.from_user.username)
+    ch = await get_chat(m.chat.id) or {}
     mode = (ch.get("mode") or "pg13").lower()
     line = await pick_joke_maybe_gpt(m.chat.id, mode)
     await m.answer(line)
@@ -23,7 +23,7 @@ async def joke_cmd(m: Message):
 @router.message(Command("roast"))
 async def roast_cmd(m: Message):
     if m.from_user:
-        remember_user(m.chat.id, m.from_user.id, m.from_user.username)
+        await remember_user(m.chat.id, m.from_user.id, m.from_user.username)
 
     uid, uname = extract_mention(m)  # returns (user_id, username|None)
 
@@ -32,7 +32,7 @@ async def roast_cmd(m: Message):
 
 # name to substitute into the pattern
     name_for_template = (uname or "").lstrip("@") or "ти"
-    line = pick_personal_joke(m.chat.id, name_for_template)
+    line = await pick_personal_joke(m.chat.id, name_for_template)
 
 # target for response (HTML is already enabled in the bot in Bot(..., parse_mode=HTML))
     target = f"@{uname}" if uname else f"<a href='tg://user?id={uid}'>ти</a>"
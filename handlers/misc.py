@@ -8,7 +8,7 @@ router = Router()
 @router.message(F.text.regexp(re.compile(r"^(кто|хто)\s+создател[ья]\s*[\?\!]+$", re.I)))
 async def creator_answer(m: Message):
     if m.from_user:
-        remember_user(m.chat.id, m.from_user.id, m.from_user.username)
+        await remember_user(m.chat.id, m.from_user.id, m.from_user.username)
     await m.answer("НАС ВСІХ СТВОРИВ @lambork!!!!!")
 
 @router.my_chat_member()
@@ -24,17 +24,17 @@ async def on_my_chat_member(update: ChatMemberUpdated):
 async def mute_guard_and_autodl(m: Message):
     from utils import is_muted_now
     from aiogram.types import MessageEntity
-    from downloader import is_supported, download_url
+    from downloader import is_supported, download_url, download_many, failure_reason
     try:
         if m.from_user:
-            remember_user(m.chat.id, m.from_user.id, m.from_user.username)
+            await remember_user(m.chat.id, m.from_user.id, m.from_user.username)
         if getattr(m, "reply_to_message", None) and m.reply_to_message.from_user:
             u = m.reply_to_message.from_user
-            remember_user(m.chat.id, u.id, u.username)
+            await remember_user(m.chat.id, u.id, u.username)
     except Exception:
         pass
     try:
-        if m.from_user and is_muted_now(m.chat.id, m.from_user.id):
+        if m.from_user and await is_muted_now(m.chat.id, m.from_user.id):
             try:
                 await m.bot.delete_message(m.chat.id, m.message_id)
             except Exception:
@@ -59,30 +59,46 @@ async def mute_guard_and_autodl(m: Message):
             URLs.append(u)
     _from_text(m.text, m.entities)
     _from_text(m.caption, m.caption_entities)
+    from services import links
     seen, out = set(), []
     for u in [u.strip().strip('.,);]').strip().replace("\u200b","").replace("\u2060","") for u in URLs]:
-        if u not in seen:
-            seen.add(u); out.append(u)
+        key = links.content_key(u)
+        if key not in seen and is_supported(u):
+            seen.add(key); out.append(u)
+    if len(out) > 1:
+        # кілька посилань — паралельно, з одним спільним статусом
+        status = await m.answer(f"Секунду, тягну відео ({len(out)} шт.)…")
+        errors = await download_many(m.chat.id, out, m.bot, status_msg=status)
+        if any(_ig_expired(e) for e in errors):
+            await _notify_ig_expired(m)
+        return
     for url in out:
-        if not is_supported(url):
-            continue
-        await m.answer("Секунду, тягну відео…")
+        status = await m.answer("Секунду, тягну відео…")
         try:
-            await download_url(m.chat.id, url, m.bot)
+            await download_url(m.chat.id, url, m.bot, status_msg=status)
         except Exception as exc:
-            from instagram_client import IGSessionExpiredError
-            if isinstance(exc, IGSessionExpiredError):
-                await m.answer("❌ Не можу скачати з Instagram — сесія протухла. Чекай, адмін вже в курсі 🔧")
-                from config import ADMINS
-                for admin_id in ADMINS:
-                    try:
-                        await m.bot.send_message(
-                            admin_id,
-                            "⚠️ <b>Instagram сесія Мєшані протухла!</b>\n"
-                            "Запусти <code>python refresh_ig_session.py</code> локально і задеплой.",
-                            parse_mode="HTML",
-                        )
-                    except Exception:
-                        pass
+            reason = failure_reason(exc)
+            if _ig_expired(exc):
+                await _notify_ig_expired(m)
+            elif reason:
+                await m.answer(f"❌ {reason}")
             else:
                 await m.answer("Не вийшло витягнути відео. Спробуй інше посилання.")
+
+def _ig_expired(exc) -> bool:
+    from instagram_client import IGSessionExpiredError
+    return isinstance(exc, IGSessionExpiredError)
+
+async def _notify_ig_expired(m: Message):
+    await m.answer("❌ Не можу скачати з Instagram — сесія протухла. Чекай, адмін вже в курсі 🔧")
+    from config import ADMINS
+    for admin_id in ADMINS:
+        try:
+            await m.bot.send_message(
+                admin_id,
+                "⚠️ <b>Instagram сесія Мєшані протухла!</b>\n"
+                "Запусти <code>python refresh_ig_session.py</code> локально і задеплой.",
+                parse_mode="HTML",
+            )
+        except Exception:
+            pass
@@ -3,7 +3,8 @@ from aiogram.filters import Command
 from aiogram.types import Message
 from aiogram.utils.text_decorations import html_decoration as hd
 from utils import remember_user, is_chat_admin, resolve_target_and_reason, restrict_for_minutes
-from db import db
+from db import db, run_db, execute
+from services import mutes
 
 router = Router()
 
@@ -13,7 +14,7 @@ async def ensure_admin(m: Message) -> bool:
         return False
     return True
 
-def get_mod(chat_id: int, user_id: int):
+def _get_mod_sync(chat_id: int, user_id: int):
     with db() as conn, conn.cursor() as cur:
         cur.execute("SELECT * FROM user_moderation WHERE chat_id=%s AND user_id=%s", (chat_id, user_id))
         row = cur.fetchone()
@@ -22,25 +23,27 @@ def get_mod(chat_id: int, user_id: int):
             return {"chat_id": chat_id, "user_id": user_id, "warns": 0, "muted_until": None, "notes": None}
         return row
 
-def set_warns(chat_id: int, user_id: int, warns: int):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE user_moderation SET warns=%s WHERE chat_id=%s AND user_id=%s", (warns, chat_id, user_id))
+async def get_mod(chat_id: int, user_id: int):
+    return await run_db(_get_mod_sync, chat_id, user_id)
+
+async def set_warns(chat_id: int, user_id: int, warns: int):
+    await execute("UPDATE user_moderation SET warns=%s WHERE chat_id=%s AND user_id=%s", (warns, chat_id, user_id))
 
 @router.message(Command("warn"))
 async def warn_cmd(m: Message):
     if not await ensure_admin(m): return
-    if m.from_user: remember_user(m.chat.id, m.from_user.id, m.from_user.username)
+    if m.from_user: await remember_user(m.chat.id, m.from_user.id, m.from_user.username)
     uid, uname, reason = await resolve_target_and_reason(m, m.bot)
     if not uid:
         return await m.answer(("Не знайшов ID для @" + (uname or "") + ". ") + "Зроби реплай або нехай користувач хоч раз напише у чат.")
-    row = get_mod(m.chat.id, uid)
+    row = await get_mod(m.chat.id, uid)
     warns = int(row["warns"]) + 1
-    set_warns(m.chat.id, uid, warns)
+    await set_warns(m.chat.id, uid, warns)
     msg = f"Варн #{warns} для <a href='tg://user?id={uid}'>користувача</a>."
     if reason: msg += f" Причина: {hd.quote(reason)}"
     if warns >= 3:
         await restrict_for_minutes(m.bot, m.chat.id, uid, 30)
-        set_warns(m.chat.id, uid, 0)
+        await set_warns(m.chat.id, uid, 0)
         msg += "\nДосягнуто 3 варни → автомута на 30 хв."
     await m.answer(msg)
 
@@ -73,8 +76,8 @@ async def unmute_cmd(m: Message):
             can_add_web_page_previews=True
         )
     )
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE user_moderation SET muted_until=NULL WHERE chat_id=%s AND user_id=%s", (m.chat.id, uid))
+    await execute("UPDATE user_moderation SET muted_until=NULL WHERE chat_id=%s AND user_id=%s", (m.chat.id, uid))
+    mutes.clear(m.chat.id, uid)
     await m.answer(f"Знято mute з <a href='tg://user?id={uid}'>користувача</a>")
 
 @router.message(Command("ban"))
@@ -13,65 +13,51 @@ from aiogram.filters import Command
 from aiogram.types import Message
 
 from utils import upsert_chat, get_chat, in_quiet
-from db import db
+from services import chat_settings, workspace
 from services.jokes import pick_joke_maybe_gpt
 from services.air_alerts import air_alert_loop  # background alarm monitoring
+from services.user_map import user_map_flush_loop
+from downloader import TMP_DIR
 
 router = Router()
 
 # ---------------- DB setters ----------------
-def set_random(chat_id: int, on: bool):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute(
-            "UPDATE chats SET random_on=%s WHERE chat_id=%s",
-            (1 if on else 0, chat_id),
-        )
-
-def set_random_window(chat_id: int, mn: int, mx: int):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute(
-            "UPDATE chats SET random_min=%s, random_max=%s WHERE chat_id=%s",
-            (mn, mx, chat_id),
-        )
-
-def set_mode(chat_id: int, mode: str):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE chats SET mode=%s WHERE chat_id=%s", (mode, chat_id))
-
-def set_quiet(chat_id: int, start: str | None, end: str | None):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute(
-            "UPDATE chats SET quiet_start=%s, quiet_end=%s WHERE chat_id=%s",
-            (start, end, chat_id),
-        )
-
-def set_morning_on(chat_id: int, on: bool):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute(
-            "UPDATE chats SET morning_on=%s WHERE chat_id=%s",
-            (1 if on else 0, chat_id),
-        )
-
-def set_morning_time(chat_id: int, hhmm: str):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute(
-            "UPDATE chats SET morning_time=%s WHERE chat_id=%s",
-            (hhmm, chat_id),
-        )
-
-def get_all_morning_chats():
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("SELECT chat_id, morning_time FROM chats WHERE morning_on=1")
-        return cur.fetchall()
+async def set_random(chat_id: int, on: bool):
+    await chat_settings.update(chat_id, random_on=1 if on else 0)
+
+async def set_random_window(chat_id: int, mn: int, mx: int):
+    await chat_settings.update(chat_id, random_min=mn, random_max=mx)
+
+async def set_mode(chat_id: int, mode: str):
+    await chat_settings.update(chat_id, mode=mode)
+
+async def set_quiet(chat_id: int, start: str | None, end: str | None):
+    await chat_settings.update(chat_id, quiet_start=start, quiet_end=end)
+
+async def set_morning_on(chat_id: int, on: bool):
+    await chat_settings.update(chat_id, morning_on=1 if on else 0)
+
+async def set_morning_time(chat_id: int, hhmm: str):
+    await chat_settings.update(chat_id, morning_time=hhmm)
+
+async def get_all_morning_chats():
+    return await chat_settings.select(
+        lambda ch: bool(ch.get("morning_on")),
+        "SELECT chat_id, morning_time FROM chats WHERE morning_on=1",
+    )
 
 # ---------------- Background loops ----------------
 async def random_loop(bot):
     last_sent: dict[int, float] = {}
     while True:
         await asyncio.sleep(20)
-        with db() as conn, conn.cursor() as cur:
-            cur.execute("SELECT * FROM chats WHERE random_on=1")
-            chats = cur.fetchall()
+        try:
+            chats = await chat_settings.select(
+                lambda ch: bool(ch.get("random_on")),
+                "SELECT * FROM chats WHERE random_on=1",
+            )
+        except Exception:
+            continue
         for ch in chats:
             cid = ch["chat_id"]
             if in_quiet(ch):
@@ -94,7 +80,7 @@ async def morning_blast_loop(bot):
     while True:
         try:
             now = datetime.now(tz)
-            rows = get_all_morning_chats()
+            rows = await get_all_morning_chats()
             for r in rows:
                 cid = r["chat_id"]
                 hhmm = (r["morning_time"] or "09:00").strip()
@@ -116,14 +102,14 @@ async def morning_blast_loop(bot):
 # ---------------- Commands ----------------
 @router.message(Command("random_on"))
 async def rnd_on(m: Message):
-    upsert_chat(m.chat.id)
-    set_random(m.chat.id, True)
+    await upsert_chat(m.chat.id)
+    await set_random(m.chat.id, True)
     await m.answer("Рандомні вкиди увімкнено ✅")
 
 @router.message(Command("random_off"))
 async def rnd_off(m: Message):
-    upsert_chat(m.chat.id)
-    set_random(m.chat.id, False)
+    await upsert_chat(m.chat.id)
+    await set_random(m.chat.id, False)
     await m.answer("Рандомні вкиди вимкнено ⛔️")
 
 @router.message(Command("random_window"))
@@ -134,8 +120,8 @@ async def rnd_win(m: Message):
     mn, mx = int(parts[1]), int(parts[2])
     if mn < 1 or mx < mn:
         return await m.answer("Невірний інтервал.")
-    upsert_chat(m.chat.id)
-    set_random_window(m.chat.id, mn, mx)
+    await upsert_chat(m.chat.id)
+    await set_random_window(m.chat.id, mn, mx)
     await m.answer(f"Вікно рандому: {mn}-{mx} хв.")
 
 @router.message(Command("mode"))
@@ -143,33 +129,33 @@ async def mode_cmd(m: Message):
     parts = (m.text or "").split()
     if len(parts) < 2 or parts[1] not in ("pg13", "r18"):
         return await m.answer("Використання: <code>/mode pg13</code> або <code>/mode r18</code>")
-    upsert_chat(m.chat.id)
-    set_mode(m.chat.id, parts[1])
+    await upsert_chat(m.chat.id)
+    await set_mode(m.chat.id, parts[1])
     await m.answer(f"Режим: {parts[1].upper()}")
 
 @router.message(Command("quiet"))
 async def quiet_cmd(m: Message):
-    upsert_chat(m.chat.id)
+    await upsert_chat(m.chat.id)
     parts = (m.text or "").split()
     if len(parts) == 2 and parts[1].lower() == "off":
-        set_quiet(m.chat.id, None, None)
+        await set_quiet(m.chat.id, None, None)
         return await m.answer("Quiet hours вимкнено.")
     if len(parts) != 2 or "-" not in parts[1]:
         return await m.answer("Використання: <code>/quiet 23:00-08:00</code> або <code>/quiet off</code>")
     a, b = parts[1].split("-", 1)
-    set_quiet(m.chat.id, a, b)
+    await set_quiet(m.chat.id, a, b)
     await m.answer(f"Quiet hours: {a}-{b}")
 
 @router.message(Command("morning_on"))
 async def morning_on_cmd(m: Message):
-    upsert_chat(m.chat.id)
-    set_morning_on(m.chat.id, True)
+    await upsert_chat(m.chat.id)
+    await set_morning_on(m.chat.id, True)
     await m.answer("Ранковий підйом увімкнено ⏰")
 
 @router.message(Command("morning_off"))
 async def morning_off_cmd(m: Message):
-    upsert_chat(m.chat.id)
-    set_morning_on(m.chat.id, False)
+    await upsert_chat(m.chat.id)
+    await set_morning_on(m.chat.id, False)
     await m.answer("Ранковий підйом вимкнено 😴")
 
 @router.message(Command("morning_time"))
@@ -177,7 +163,7 @@ async def morning_time_cmd(m: Message):
     parts = (m.text or "").split()
     if len(parts) != 2 or not re.match(r"^\d{2}:\d{2}$", parts[1]):
         return await m.answer("Використання: <code>/morning_time 09:00</code>")
-    set_morning_time(m.chat.id, parts[1])
+    await set_morning_time(m.chat.id, parts[1])
     await m.answer(f"Час підйому встановлено: {parts[1]}")
 
 # ---------------- Background starter ----------------
@@ -185,6 +171,8 @@ def start_background_tasks(bot):
     loop = asyncio.get_event_loop()
     loop.create_task(random_loop(bot))
     loop.create_task(morning_blast_loop(bot))
+    loop.create_task(user_map_flush_loop())
+    loop.create_task(workspace.janitor_loop(TMP_DIR))
 
     from config import ALERTS_TOKEN
     if ALERTS_TOKEN:
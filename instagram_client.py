@@ -1,18 +1,32 @@
 # /var/opt/mieshania/instagram_client.py
 # -*- coding: utf-8 -*-
 """
-Singleton-клієнт instagrapi для Instagram Stories.
-
-Сесія зберігається в SESSION_FILE і автоматично відновлюється при протуханні.
-Credentials — з .env: IG_USERNAME, IG_PASSWORD.
+Пул клієнтів instagrapi для Instagram Stories / постів.
+
+Кожен файл сесії з IG_SESSION_FILES (через кому; без нього — IG_SESSION_FILE) —
+окремий акаунт зі своїм Client. Client не потокобезпечний, тож задача бере
+акаунт у виняткове користування (checkout) і повертає, коли потік instagrapi
+завершився. Чекання і пейсинг — на циклі подій, сам instagrapi — у потоці:
+- вибір — найдавніше використаний серед вільних і живих (LRU);
+- між задачами одного акаунта — щонайменше IG_MIN_INTERVAL_SEC замість
+  штучного delay_range на кожен запит;
+- вільних немає — чекаємо до CHECKOUT_TIMEOUT_SEC;
+- протухла сесія (LoginRequired) — акаунт позначається мертвим, задача
+  повторюється на наступному; IGSessionExpiredError — лише коли мертві всі.
+  Мертвий акаунт оживає, коли його файл сесії оновили (інший mtime).
+
+Сесії оновлюються вручну через refresh_ig_session.py (з DC IP не логінимось).
 """
 
 import os
 import json
+import time
+import asyncio
 import pathlib
 import datetime
-import tempfile
-from typing import Optional, List, Dict
+import threading
+from collections import deque
+from typing import Deque, Optional, List, Dict, Tuple
 
 try:
     from instagrapi import Client
@@ -23,7 +37,7 @@ except ImportError:
 
 
 class IGSessionExpiredError(RuntimeError):
-    """Сесія Instagram протухла — треба оновити ig_session.json локально."""
+    """Протухли сесії всіх акаунтів — треба оновити ig_session*.json локально."""
 
 try:
     from dotenv import load_dotenv
@@ -31,9 +45,10 @@ try:
 except Exception:
     pass
 
-IG_USERNAME = os.getenv("IG_USERNAME", "")
-IG_PASSWORD = os.getenv("IG_PASSWORD", "")
 SESSION_FILE = os.getenv("IG_SESSION_FILE", "/var/opt/mieshania/ig_session.json")
+SESSION_FILES = [f.strip() for f in os.getenv("IG_SESSION_FILES", "").split(",") if f.strip()] or [SESSION_FILE]
+MIN_INTERVAL_SEC = float(os.getenv("IG_MIN_INTERVAL_SEC", "3"))
+CHECKOUT_TIMEOUT_SEC = 60
 LOG_FILE = "/var/log/mieshania.downloader.log"
 
 
@@ -47,88 +62,222 @@ def _log(msg: str) -> None:
         pass
 
 
-_client: Optional["Client"] = None
+class _Account:
+    def __init__(self, path: str):
+        self.path = path
+        self.client: Optional["Client"] = None
+        self.busy = False
+        self.healthy = True
+        self.dead_mtime = 0.0  # mtime файлу, з яким сесія протухла
+        self.last_used = 0.0
+        self.jobs = 0
 
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
 
-def _make_client() -> "Client":
-    cl = Client()
-    cl.delay_range = [1, 3]
-    return cl
+    def mtime(self) -> float:
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return 0.0
 
 
-def _login_fresh(cl: "Client") -> None:
-    """Логін з username/password і збереження сесії."""
-    if not IG_USERNAME or not IG_PASSWORD:
-        raise RuntimeError("IG_USERNAME або IG_PASSWORD не задані в .env")
-    _log(f"LOGIN: logging in as {IG_USERNAME}")
-    cl.login(IG_USERNAME, IG_PASSWORD)
-    _save_session(cl)
-    _log("LOGIN: success, session saved")
+_accounts: List[_Account] = [_Account(p) for p in SESSION_FILES]
+# стан пулу міняють і цикл подій (checkout), і потоки instagrapi (release)
+_lock = threading.Lock()
+_waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+_stats = {"jobs": 0, "waits": 0, "busy_timeouts": 0, "expired": 0, "revived": 0, "cancelled": 0}
 
 
-def _save_session(cl: "Client") -> None:
-    try:
-        os.makedirs(os.path.dirname(SESSION_FILE), exist_ok=True)
-        with open(SESSION_FILE, "w", encoding="utf-8") as f:
-            json.dump(cl.get_settings(), f)
-    except Exception as e:
-        _log(f"SESSION SAVE FAIL: {e}")
+class _SessionDead(Exception):
+    """Акаунт щойно позначено мертвим — задачу пробуємо на наступному."""
+
+
+def _make_client() -> "Client":
+    # без delay_range: паузи між запитами дає пейсинг акаунта в _checkout
+    return Client()
 
 
-def _load_session(cl: "Client") -> bool:
-    if not pathlib.Path(SESSION_FILE).exists():
+def _load_session(cl: "Client", path: str) -> bool:
+    if not pathlib.Path(path).exists():
         return False
     try:
-        with open(SESSION_FILE, "r", encoding="utf-8") as f:
+        with open(path, "r", encoding="utf-8") as f:
             settings = json.load(f)
         cl.set_settings(settings)
         # НЕ викликаємо get_timeline_feed() — це тригерить challenge з datacenter IP.
         # Просто завантажуємо сесію. Якщо протухла — перший реальний запит впаде.
-        _log("SESSION: loaded from file (no validation)")
+        _log(f"SESSION: {os.path.basename(path)} loaded from file (no validation)")
         return True
     except Exception as e:
-        _log(f"SESSION LOAD FAIL: {e}")
+        _log(f"SESSION LOAD FAIL: {os.path.basename(path)}: {e}")
         return False
 
 
-def get_client() -> "Client":
-    """Повертає готовий (залогінений) клієнт. Thread-unsafe але для asyncio.to_thread ок."""
-    global _client
+def _mark_dead(acc: _Account, why: str) -> None:
+    with _lock:
+        acc.healthy = False
+        acc.client = None
+        acc.dead_mtime = acc.mtime()
+        _stats["expired"] += 1
+    _log(f"SESSION DEAD: {acc.name}: {why}")
+
+
+def _try_take() -> Optional[_Account]:
+    """Під _lock: вільний живий акаунт, що найдовше не використовувався, або None (усі зайняті)."""
+    present = [a for a in _accounts if pathlib.Path(a.path).exists()]
+    if not present:
+        raise RuntimeError("ig_session.json not found — refresh locally and SCP to server")
+    for a in present:
+        # файл оновили після протухання — пробуємо знову
+        if not a.healthy and a.mtime() != a.dead_mtime:
+            a.healthy = True
+            _stats["revived"] += 1
+            _log(f"SESSION REVIVED: {a.name}")
+    alive = [a for a in present if a.healthy]
+    if not alive:
+        raise IGSessionExpiredError("Instagram sessions expired — run refresh_ig_session.py locally")
+    free = [a for a in alive if not a.busy]
+    if not free:
+        return None
+    acc = min(free, key=lambda a: a.last_used)
+    acc.busy = True
+    return acc
+
+
+async def _checkout() -> _Account:
+    """
+    Бере акаунт у виняткове користування. Чекання вільного і пауза пейсингу —
+    на циклі подій, не в потоці: потоки завантажень не простоюють, а
+    скасована задача акаунт не займе.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CHECKOUT_TIMEOUT_SEC
+    waited = False
+    while True:
+        with _lock:
+            acc = _try_take()
+            if acc is None:
+                fut = loop.create_future()
+                _waiters.append((loop, fut))
+        if acc is not None:
+            break
+        left = deadline - loop.time()
+        if left <= 0:
+            _stats["busy_timeouts"] += 1
+            raise RuntimeError("all Instagram sessions are busy")
+        if not waited:
+            _stats["waits"] += 1
+            waited = True
+        try:
+            await asyncio.wait_for(fut, timeout=left)
+        except asyncio.TimeoutError:
+            pass
+
+    pause = acc.last_used + MIN_INTERVAL_SEC - time.monotonic()
+    if pause > 0:
+        try:
+            await asyncio.sleep(pause)
+        except BaseException:
+            _release(acc, used=False)
+            raise
+    return acc
+
+
+def _wake(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+def _release(acc: _Account, used: bool = True) -> None:
+    """Повертає акаунт у пул; можна з будь-якого потоку."""
+    with _lock:
+        acc.busy = False
+        if used:
+            acc.last_used = time.monotonic()
+        waiters = list(_waiters)
+        _waiters.clear()
+    for loop, fut in waiters:
+        try:
+            loop.call_soon_threadsafe(_wake, fut)
+        except RuntimeError:
+            pass  # цикл уже закрито
+
+
+def _on_account(acc: _Account, fn, cancel_event: Optional[threading.Event], *args):
+    """
+    Потік: fn(client, *args) на взятому акаунті. Акаунт повертається в пул
+    лише тут, коли потік справді закінчив, — навіть якщо задачу скасували.
+    """
+    used = False
+    try:
+        if cancel_event is not None and cancel_event.is_set():
+            _stats["cancelled"] += 1
+            raise RuntimeError("instagrapi: cancelled")
+        if acc.client is None:
+            cl = _make_client()
+            if not _load_session(cl, acc.path):
+                _mark_dead(acc, "failed to load session file")
+                raise _SessionDead()
+            acc.client = cl
+        acc.jobs += 1
+        _stats["jobs"] += 1
+        used = True
+        try:
+            return fn(acc.client, *args)
+        except (LoginRequired, ClientLoginRequired):
+            # не ре-логінимось з DC IP — сесію треба оновити вручну локально
+            _mark_dead(acc, "login required — needs manual refresh via refresh_ig_session.py")
+            raise _SessionDead()
+    finally:
+        _release(acc, used)
+
+
+async def _with_account(fn, *args, run_sync=None, cancel_event: Optional[threading.Event] = None):
+    """
+    Виконує fn(client, *args) у потоці (run_sync(func, *args), типово
+    asyncio.to_thread) на акаунті з пулу. Протухлий акаунт — у мертві,
+    пробуємо наступний; коли живих не лишилось, _checkout кидає
+    IGSessionExpiredError.
+    """
     if not INSTAGRAPI_AVAILABLE:
         raise RuntimeError("instagrapi not installed")
-    if not SESSION_FILE or not pathlib.Path(SESSION_FILE).exists():
-        raise RuntimeError("ig_session.json not found — refresh locally and SCP to server")
+    run_sync = run_sync or asyncio.to_thread
+    while True:
+        acc = await _checkout()
+        try:
+            return await run_sync(_on_account, acc, fn, cancel_event, *args)
+        except _SessionDead:
+            continue
 
-    if _client is None:
-        cl = _make_client()
-        if not _load_session(cl):
-            raise RuntimeError("failed to load ig_session.json")
-        _client = cl
 
-    return _client
+def _cancelled(cancel_event: Optional[threading.Event]) -> bool:
+    return cancel_event is not None and cancel_event.is_set()
 
 
-def _with_relogin(fn):
-    """Виконує fn(client). При LoginRequired — не ре-логінимось з DC IP,
-    кидаємо IGSessionExpiredError (сесію треба оновити вручну локально)."""
-    global _client
-    cl = get_client()
-    try:
-        return fn(cl)
-    except (LoginRequired, ClientLoginRequired):
-        _client = None
-        _log("SESSION EXPIRED: needs manual refresh via refresh_ig_session.py")
-        raise IGSessionExpiredError("Instagram session expired — run refresh_ig_session.py locally")
+def stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            "accounts": len(_accounts),
+            "healthy": sum(1 for a in _accounts if a.healthy),
+            "busy": sum(1 for a in _accounts if a.busy),
+            "waiting": sum(1 for _, f in _waiters if not f.done()),
+        }
 
 
 # =================== Публічний API ===================
 
-def download_story_by_url(story_url: str, dest_dir: str) -> List[Dict[str, str]]:
+async def download_story_by_url(
+    story_url: str, dest_dir: str, run_sync=None, cancel_event: Optional[threading.Event] = None
+) -> List[Dict[str, str]]:
     """
     Качає одну сторіс за URL вигляду:
       https://www.instagram.com/stories/<username>/<story_id>/
 
     Повертає список {"path": str, "type": "video"|"photo"}.
+    run_sync / cancel_event — див. _with_account.
     """
     import re
     m = re.search(
@@ -147,6 +296,8 @@ def download_story_by_url(story_url: str, dest_dir: str) -> List[Dict[str, str]]
         # Отримуємо сторіс по story_id напряму
         story = cl.story_info(story_id)
         items = []
+        if _cancelled(cancel_event):
+            return items
 
         if story.video_url:
             path = cl.video_download_by_url(str(story.video_url), dest_dir)
@@ -157,15 +308,18 @@ def download_story_by_url(story_url: str, dest_dir: str) -> List[Dict[str, str]]
 
         return items
 
-    return _with_relogin(_do)
+    return await _with_account(_do, run_sync=run_sync, cancel_event=cancel_event)
 
 
-def download_media_by_url(url: str, dest_dir: str) -> List[Dict[str, str]]:
+async def download_media_by_url(
+    url: str, dest_dir: str, run_sync=None, cancel_event: Optional[threading.Event] = None
+) -> List[Dict[str, str]]:
     """
     Качає пост / reel / carousel за Instagram URL.
 
     media_type: 1=photo, 2=video/reel, 8=album/carousel
     Повертає список {"path": str, "type": "video"|"photo"}.
+    run_sync / cancel_event — див. _with_account.
     """
     _log(f"POST: {url}")
     os.makedirs(dest_dir, exist_ok=True)
@@ -174,6 +328,8 @@ def download_media_by_url(url: str, dest_dir: str) -> List[Dict[str, str]]:
         pk = cl.media_pk_from_url(url)
         info = cl.media_info(pk)
         items: List[Dict[str, str]] = []
+        if _cancelled(cancel_event):
+            return items
 
         if info.media_type == 8:  # carousel/album
             paths = cl.album_download(pk, dest_dir)
@@ -190,13 +346,18 @@ def download_media_by_url(url: str, dest_dir: str) -> List[Dict[str, str]]:
 
         return items
 
-    return _with_relogin(_do)
+    return await _with_account(_do, run_sync=run_sync, cancel_event=cancel_event)
 
 
 if __name__ == "__main__":
-    print("Testing instagrapi login...")
-    try:
-        cl = get_client()
-        print(f"OK! Logged in as: {cl.username}, user_id: {cl.user_id}")
-    except Exception as e:
-        print(f"FAIL: {e}")
+    print("Testing instagrapi sessions...")
+
+    async def _check():
+        for _ in _accounts:
+            try:
+                name, uid = await _with_account(lambda cl: (cl.username, cl.user_id))
+                print(f"OK! Session loaded for: {name}, user_id: {uid}")
+            except Exception as e:
+                print(f"FAIL: {e}")
+
+    asyncio.run(_check())
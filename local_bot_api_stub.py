@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Заглушка self-hosted Bot API сервера (telegram-bot-api --local) для
+перевірки BOT_API_SERVER без мережі і без справжнього сервера.
+
+Приймає /bot<token>/<method>: send* і sendMediaGroup перевіряють, що
+file://-шляхи існують (як сервер з --local), і рахують байти, що прийшли
+multipart'ом; решта методів відповідає ok. Повертає правдоподібний Message.
+
+Використання:
+    python local_bot_api_stub.py              # сервер на 127.0.0.1:8081
+    python local_bot_api_stub.py --port 9000
+    python local_bot_api_stub.py --selftest   # downloader._send_items проти заглушки
+
+Для бота: BOT_API_SERVER=http://127.0.0.1:8081 BOT_API_LOCAL=1.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from aiohttp import web
+
+MEDIA_FIELDS = ("video", "photo", "document", "audio", "animation", "thumbnail")
+KINDS = {
+    "sendVideo": "video", "sendPhoto": "photo", "sendDocument": "document",
+    "sendAudio": "audio", "sendAnimation": "animation",
+}
+
+calls: List[Dict] = []  # {"method", "paths", "uploaded"} — для selftest
+
+
+def _bad(description: str) -> web.Response:
+    return web.json_response({"ok": False, "error_code": 400, "description": f"Bad Request: {description}"})
+
+
+def _local_path(value: str) -> str:
+    return value[len("file://"):] if value.startswith("file://") else ""
+
+
+def _media(kind: str, file_id: str):
+    media = {"file_id": file_id, "file_unique_id": file_id, "file_size": 1}
+    if kind in ("video", "animation"):
+        media.update(width=1, height=1, duration=1)
+    if kind == "audio":
+        media.update(duration=1)
+    if kind == "photo":
+        return [dict(media, width=1, height=1)]
+    return media
+
+
+def _message(chat_id, kind: str = "", file_id: str = "") -> Dict:
+    msg = {"message_id": len(calls), "date": int(time.time()), "chat": {"id": int(chat_id or 0), "type": "private"}}
+    if kind:
+        msg[kind] = _media(kind, file_id)
+    return msg
+
+
+async def _read_form(request: web.Request):
+    """(поля-рядки, скільки байт прийшло файлами)."""
+    fields: Dict[str, str] = {}
+    uploaded = 0
+    if request.content_type.startswith("multipart/"):
+        reader = await request.multipart()
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+            if part.filename:
+                while True:
+                    chunk = await part.read_chunk(65536)
+                    if not chunk:
+                        break
+                    uploaded += len(chunk)
+            else:
+                fields[part.name] = await part.text()
+    elif request.content_type == "application/json":
+        fields = {k: v if isinstance(v, str) else json.dumps(v) for k, v in (await request.json()).items()}
+    else:
+        fields = dict(await request.post())
+    return fields, uploaded
+
+
+async def handler(request: web.Request) -> web.Response:
+    method = request.match_info["method"]
+    fields, uploaded = await _read_form(request)
+
+    paths: List[str] = []
+    if method == "sendMediaGroup":
+        values = [m.get("media", "") for m in json.loads(fields.get("media") or "[]")]
+    else:
+        values = [fields[f] for f in MEDIA_FIELDS if f in fields]
+    for value in values:
+        path = _local_path(value)
+        if path:
+            if not os.path.isfile(path):
+                return _bad(f"file {path} not found")
+            paths.append(path)
+    calls.append({"method": method, "paths": paths, "uploaded": uploaded})
+
+    chat_id = fields.get("chat_id")
+    if method == "getMe":
+        result = {"id": 1, "is_bot": True, "first_name": "stub", "username": "stub_bot"}
+    elif method == "getUpdates":
+        await asyncio.sleep(min(float(fields.get("timeout") or 0), 5))
+        result = []
+    elif method == "sendMediaGroup":
+        media = json.loads(fields.get("media") or "[]")
+        result = [_message(chat_id, m.get("type", "document"), f"G{len(calls)}_{i}") for i, m in enumerate(media)]
+    elif method in KINDS:
+        result = _message(chat_id, KINDS[method], f"F{len(calls)}")
+    elif method.startswith("send"):
+        result = _message(chat_id)
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+def make_app() -> web.Application:
+    app = web.Application(client_max_size=0)
+    app.router.add_post("/bot{token}/{method}", handler)
+    app.router.add_get("/bot{token}/{method}", handler)
+    return app
+
+
+async def serve(host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(make_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def selftest() -> int:
+    """Шле відео, альбом і документ через downloader._send_items у локальному режимі."""
+    os.environ.setdefault("BOT_TOKEN", "1:stub")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    import downloader
+
+    runner = await serve("127.0.0.1", 0)
+    port = runner.addresses[0][1]
+    downloader.BOT_API_SERVER = f"http://127.0.0.1:{port}"
+    downloader.BOT_API_LOCAL = True
+    api = TelegramAPIServer.from_base(downloader.BOT_API_SERVER, is_local=True)
+    bot = Bot("1:stub", session=AiohttpSession(api=api))
+
+    td = tempfile.mkdtemp(prefix="botapi-stub-")
+    big = os.path.join(td, "big.mp4")
+    with open(big, "wb") as f:
+        f.truncate(120 * 1024 * 1024)  # більше за 49 МБ публічного API, без запису байтів
+    photo = os.path.join(td, "p.jpg")
+    with open(photo, "wb") as f:
+        f.write(b"\xff\xd8\xff\xd9")
+
+    failures = []
+    try:
+        if downloader._input_file({"path": big}) != "file://" + big:
+            failures.append("_input_file: expected file:// path")
+
+        cases = [
+            ("single video", [{"path": big, "type": "video"}], False, "sendVideo"),
+            ("album", [{"path": photo, "type": "photo"}, {"path": big, "type": "video"}], False, "sendMediaGroup"),
+            ("document", [{"path": big, "type": "video"}], True, "sendDocument"),
+        ]
+        for name, items, as_doc, method in cases:
+            calls.clear()
+            ops = await downloader._send_items(1, bot, items, "stub", as_doc)
+            call = calls[-1] if calls else {}
+            ok = (
+                call.get("method") == method
+                and sorted(call.get("paths", [])) == sorted(it["path"] for it in items)
+                and call.get("uploaded") == 0
+                and ops
+            )
+            print(f"{'OK  ' if ok else 'FAIL'} {name}: {call}")
+            if not ok:
+                failures.append(name)
+    finally:
+        await bot.session.close()
+        await downloader.close_http()
+        await runner.cleanup()
+        for name in os.listdir(td):
+            os.remove(os.path.join(td, name))
+        os.rmdir(td)
+
+    print("selftest:", "FAIL " + ", ".join(failures) if failures else "OK")
+    return 1 if failures else 0
+
+
+async def main() -> int:
+    ap = argparse.ArgumentParser(description="Local Bot API server stub")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--selftest", action="store_true")
+    args = ap.parse_args()
+    if args.selftest:
+        return await selftest()
+    await serve(args.host, args.port)
+    print(f"Bot API stub on http://{args.host}:{args.port} (Ctrl+C to stop)")
+    await asyncio.Event().wait()
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(asyncio.run(main()))
+    except KeyboardInterrupt:
+        pass
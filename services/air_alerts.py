@@ -6,7 +6,7 @@ from typing import Tuple, Set, List, Optional
 import aiohttp
 
 from config import ALERTS_TOKEN, log
-from db import db
+from services import chat_settings
 
 KYIV_CITY = "м. Київ"
 KYIV_REGION = "Київська область"
@@ -45,20 +45,21 @@ POLL_SEC = 30
 HTTP_TIMEOUT = aiohttp.ClientTimeout(total=15)
 
 # ----------------------- DB switches -----------------------
-def set_air_city(chat_id: int, on: bool):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE chats SET air_city_on=%s WHERE chat_id=%s", (1 if on else 0, chat_id))
-
-def set_air_region(chat_id: int, on: bool):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE chats SET air_region_on=%s WHERE chat_id=%s", (1 if on else 0, chat_id))
-
-def get_air_chats() -> Tuple[List[int], List[int]]:
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("SELECT chat_id FROM chats WHERE air_city_on=1")
-        city = [r["chat_id"] for r in cur.fetchall()]
-        cur.execute("SELECT chat_id FROM chats WHERE air_region_on=1")
-        region = [r["chat_id"] for r in cur.fetchall()]
+async def set_air_city(chat_id: int, on: bool):
+    await chat_settings.update(chat_id, air_city_on=1 if on else 0)
+
+async def set_air_region(chat_id: int, on: bool):
+    await chat_settings.update(chat_id, air_region_on=1 if on else 0)
+
+async def get_air_chats() -> Tuple[List[int], List[int]]:
+    city = [r["chat_id"] for r in await chat_settings.select(
+        lambda ch: bool(ch.get("air_city_on")),
+        "SELECT chat_id FROM chats WHERE air_city_on=1",
+    )]
+    region = [r["chat_id"] for r in await chat_settings.select(
+        lambda ch: bool(ch.get("air_region_on")),
+        "SELECT chat_id FROM chats WHERE air_region_on=1",
+    )]
     return city, region
 
 # ----------------------- HTTP client -----------------------
@@ -143,7 +144,7 @@ async def air_alert_loop(bot):
             now_city = bool(cities & KYIV_CITY_ALIASES)
             now_region = bool(regions & KYIV_REGION_ALIASES)
 
-            city_chats, region_chats = get_air_chats()
+            city_chats, region_chats = await get_air_chats()
 
             if last_city is not None and now_city != last_city:
                 text = "🔴 Повітряна тривога в Києві!" if now_city else "🟢 Відбій у Києві."
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# services/backend_stats.py
+"""
+Статистика бекендів завантаження (cobalt / instagrapi / ytdlp / ig_scrape)
+у розрізі хоста.
+
+Для кожної пари (host, backend) тримаємо ковзне вікно останніх
+BACKEND_STATS_WINDOW спроб: успіх, латентність, код помилки. З цього:
+- order() переставляє бекенди для хоста: спершу ті, що частіше вдаються,
+  при рівній успішності — швидші (p50);
+- circuit breaker: після BREAKER_FAILS невдач поспіль бекенд "відкривається"
+  і пропускається BREAKER_COOLDOWN_SEC; далі — half-open: пропускаємо одну
+  пробну спробу, успіх закриває breaker, невдача відкриває знову.
+  Вердикти про контент (verdict()) у невдачі не рахуються.
+"""
+
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from config import BACKEND_STATS_WINDOW, BREAKER_FAILS, BREAKER_COOLDOWN_SEC, log
+
+MIN_SAMPLES = 5  # менше спроб — статистиці ще не довіряємо
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(p * (len(s) - 1))))]
+
+
+class BackendStats:
+    def __init__(self, window: int):
+        self.samples: Deque[Tuple[bool, float]] = deque(maxlen=max(1, int(window)))
+        self.errors: Counter = Counter()
+        self.state = CLOSED
+        self.fails_in_row = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def success_rate(self) -> float:
+        if not self.samples:
+            return 1.0
+        return sum(1 for ok, _ in self.samples if ok) / len(self.samples)
+
+    def latencies(self) -> List[float]:
+        return [lat for ok, lat in self.samples if ok]
+
+    def summary(self) -> str:
+        lat = self.latencies()
+        codes = ",".join(f"{c}×{n}" for c, n in self.errors.most_common(3))
+        return (
+            f"ok {sum(1 for ok, _ in self.samples if ok)}/{len(self.samples)}"
+            f" p50 {_percentile(lat, 0.5):.1f}s p95 {_percentile(lat, 0.95):.1f}s"
+            f" {self.state}" + (f" [{codes}]" if codes else "")
+        )
+
+
+_stats: Dict[Tuple[str, str], BackendStats] = {}
+
+
+def _get(host: str, backend: str) -> BackendStats:
+    st = _stats.get((host, backend))
+    if st is None:
+        st = _stats[(host, backend)] = BackendStats(BACKEND_STATS_WINDOW)
+    return st
+
+
+def available(host: str, backend: str) -> bool:
+    """Чи можна зараз пробувати бекенд: breaker закритий, охолов або проба вільна."""
+    st = _stats.get((host, backend))
+    if st is None or st.state == CLOSED:
+        return True
+    if st.state == OPEN:
+        return time.monotonic() - st.opened_at >= BREAKER_COOLDOWN_SEC
+    return not st.probe_in_flight
+
+
+def begin(host: str, backend: str) -> None:
+    """Старт спроби: охололий breaker переходить у half-open і займає пробу."""
+    st = _stats.get((host, backend))
+    if st is None or st.state == CLOSED:
+        return
+    if st.state == OPEN and time.monotonic() - st.opened_at >= BREAKER_COOLDOWN_SEC:
+        st.state = HALF_OPEN
+    if st.state == HALF_OPEN:
+        st.probe_in_flight = True
+
+
+def record(host: str, backend: str, ok: bool, latency: float, error: Optional[str] = None) -> None:
+    st = _get(host, backend)
+    st.samples.append((ok, float(latency)))
+    st.probe_in_flight = False
+    if ok:
+        if st.state != CLOSED:
+            log.info(f"breaker closed: {backend}@{host}")
+        st.state = CLOSED
+        st.fails_in_row = 0
+        return
+    if error:
+        st.errors[error] += 1
+    st.fails_in_row += 1
+    if st.state == HALF_OPEN or st.fails_in_row >= BREAKER_FAILS:
+        if st.state != OPEN:
+            log.warning(f"breaker open: {backend}@{host} ({st.fails_in_row} fails, last={error})")
+        st.state = OPEN
+        st.opened_at = time.monotonic()
+
+
+def verdict(host: str, backend: str, error: str) -> None:
+    """
+    Бекенд відповів, але контент недоступний (приватне, завелике, протухла
+    IG-сесія) — це не збій бекенда: ні у вікно, ні в fails_in_row не йде.
+    """
+    st = _get(host, backend)
+    st.errors[error] += 1
+    st.probe_in_flight = False
+
+
+def release(host: str, backend: str) -> None:
+    """Спроба скасована без результату (програла гонку) — звільняємо half-open пробу."""
+    st = _stats.get((host, backend))
+    if st is not None:
+        st.probe_in_flight = False
+
+
+def order(host: str, backends: List[str]) -> List[str]:
+    """
+    Бекенди для хоста: найуспішніші й найшвидші першими; ті, в кого breaker
+    відкритий, — прибрано, а ті, чий breaker охолов, — першими як проба.
+    Якщо відкриті всі — повертаємо типовий порядок, щоб запит хоч спробували.
+    """
+    def key(item: Tuple[int, str]):
+        idx, name = item
+        st = _stats.get((host, name))
+        if st is None or len(st.samples) < MIN_SAMPLES:
+            # мало даних — вважаємо успішним, але після перевірено швидких
+            return (-1.0, float("inf"), idx)
+        # успішність з кроком 10%, щоб шум не перемішував порядок
+        bucket = -round(st.success_rate(), 1)
+        return (bucket, _percentile(st.latencies(), 0.5), idx)
+
+    ranked = [name for _, name in sorted(enumerate(backends), key=key)]
+    usable = [name for name in ranked if available(host, name)]
+    # охололий breaker іде першим: інакше пробна спроба за поганою статистикою
+    # ніколи б не дійшла до черги і бекенд лишився б відкритим назавжди
+    probes = [name for name in usable if _stats.get((host, name)) and _stats[(host, name)].state != CLOSED]
+    usable = probes + [name for name in usable if name not in probes]
+    return usable or list(backends)
+
+
+def stats() -> dict:
+    return {f"{backend}@{host}": st.summary() for (host, backend), st in sorted(_stats.items())}
@@ -7,7 +7,7 @@ import aiohttp
 from aiogram.types import Message
 
 from config import CHATTER_DEFAULT_INTENSITY, OPENAI_API_KEY, OPENAI_CHAT_MODEL, OPENAI_CHAT_TIMEOUT, log
-from db import db
+from services import chat_settings
 
 DEFAULT_SYSTEM_PROMPT = (
     "Ти — Мєшаня, дерзкий кент у закритому чаті друзів. "
@@ -67,30 +67,19 @@ def get_recent_context(chat_id: int) -> str:
     return "\n".join(lines[-6:])
 
 
-def get_chatter_settings(chat_id: int) -> dict:
-    with db() as conn, conn.cursor() as cur:
-        cur.execute(
-            "SELECT chatter_on, chatter_intensity FROM chats WHERE chat_id=%s",
-            (chat_id,),
-        )
-        row = cur.fetchone()
-    return row or {"chatter_on": 0, "chatter_intensity": CHATTER_DEFAULT_INTENSITY}
+async def get_chatter_settings(chat_id: int) -> dict:
+    row = await chat_settings.get(chat_id)
+    if row and "chatter_on" in row:
+        return {"chatter_on": row["chatter_on"], "chatter_intensity": row.get("chatter_intensity")}
+    return {"chatter_on": 0, "chatter_intensity": CHATTER_DEFAULT_INTENSITY}
 
 
-def set_chatter_on(chat_id: int, on: bool):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute(
-            "UPDATE chats SET chatter_on=%s WHERE chat_id=%s",
-            (1 if on else 0, chat_id),
-        )
+async def set_chatter_on(chat_id: int, on: bool):
+    await chat_settings.update(chat_id, chatter_on=1 if on else 0)
 
 
-def set_chatter_intensity(chat_id: int, intensity: int):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute(
-            "UPDATE chats SET chatter_intensity=%s WHERE chat_id=%s",
-            (max(0, min(100, intensity)), chat_id),
-        )
+async def set_chatter_intensity(chat_id: int, intensity: int):
+    await chat_settings.update(chat_id, chatter_intensity=max(0, min(100, intensity)))
 
 
 async def generate_chat_reply(message: Message, bot_username: str | None = None) -> str | None:
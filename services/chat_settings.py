@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# services/chat_settings.py
+"""
+Кеш рядків таблиці chats у пам'яті процесу.
+
+Рядок chats змінюється тільки командами налаштувань, тому читаємо його з БД
+один раз (прогрів на старті або ліниво при першому зверненні), а всі сетери
+пишуть у БД і одразу оновлюють кеш (write-through).
+Чати, для яких рядок уже точно існує, запам'ятовуємо — upsert_chat для них
+нічого не робить.
+"""
+
+from typing import Callable, Dict, List, Optional, Set
+
+from config import log
+from db import execute, fetchall, fetchone
+
+_rows: Dict[int, dict] = {}
+_known: Set[int] = set()
+_warm = False
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "upserts": 0,
+    "upserts_skipped": 0,
+    "writes": 0,
+}
+
+
+async def warm() -> None:
+    """Завантажує всі чати одним запитом."""
+    global _warm
+    rows = await fetchall("SELECT * FROM chats")
+    for r in rows:
+        cid = int(r["chat_id"])
+        _rows[cid] = r
+        _known.add(cid)
+    _warm = True
+    log.info(f"chat settings cache warmed: {len(rows)} chat(s)")
+
+
+async def get(chat_id: int) -> Optional[dict]:
+    row = _rows.get(chat_id)
+    if row is not None:
+        _stats["hits"] += 1
+        return dict(row)
+    if _warm and chat_id not in _known:
+        # після прогріву відсутність у кеші = рядка в БД немає
+        _stats["hits"] += 1
+        return None
+    _stats["misses"] += 1
+    row = await fetchone("SELECT * FROM chats WHERE chat_id=%s", (chat_id,))
+    if row:
+        _rows[chat_id] = row
+        _known.add(chat_id)
+        return dict(row)
+    return None
+
+
+async def ensure(chat_id: int) -> None:
+    if chat_id in _known:
+        _stats["upserts_skipped"] += 1
+        return
+    await execute("INSERT IGNORE INTO chats (chat_id) VALUES (%s)", (chat_id,))
+    _stats["upserts"] += 1
+    # одразу кешуємо рядок (з дефолтами), щоб select() після прогріву його бачив
+    row = await fetchone("SELECT * FROM chats WHERE chat_id=%s", (chat_id,))
+    if row:
+        _rows[chat_id] = row
+    _known.add(chat_id)
+
+
+async def update(chat_id: int, **fields) -> None:
+    """UPDATE chats SET ... і той самий апдейт у кеші (write-through)."""
+    if not fields:
+        return
+    cols = ", ".join(f"{k}=%s" for k in fields)
+    await execute(f"UPDATE chats SET {cols} WHERE chat_id=%s", (*fields.values(), chat_id))
+    _stats["writes"] += 1
+    row = _rows.get(chat_id)
+    if row is not None:
+        row.update(fields)
+
+
+async def select(pred: Callable[[dict], bool], sql: str) -> List[dict]:
+    """Чати, що задовольняють pred; до прогріву — через sql в БД."""
+    if _warm:
+        return [dict(r) for r in _rows.values() if pred(r)]
+    return await fetchall(sql)
+
+
+def stats() -> dict:
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_rate": round(_stats["hits"] / total, 3) if total else 0.0,
+        "cached": len(_rows),
+        "known": len(_known),
+        "warm": _warm,
+    }
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# services/cobalt_quality.py
+"""
+Що ми знаємо про cobalt для кожного хоста.
+
+- якість: для (host, mode) пам'ятаємо останню якість, файл якої вліз у ліміт,
+  і починаємо драбину з неї, а не з "max" — замість 3–5 запитів виходить 1–2.
+  Якщо файл вийшов дрібним, наступного разу пробуємо на крок вище. Підказка
+  живе COBALT_QUALITY_HINT_TTL_SEC від моменту, коли якість знизили: одне
+  велике відео не тримає весь хост на низькій якості довше за цей час;
+- помилки: якість пробуємо іншу лише після "too large"; решта кодів
+  (непідтримуване посилання, приватний пост, логін, rate limit) повтору не
+  варті. Для хостових кодів (сервіс вимкнено, потрібен логін, авторизація,
+  rate limit) cobalt для хоста на COBALT_HOST_ERROR_TTL_SEC /
+  COBALT_RATE_LIMIT_TTL_SEC взагалі не пробуємо.
+"""
+
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import COBALT_HOST_ERROR_TTL_SEC, COBALT_QUALITY_HINT_TTL_SEC, COBALT_RATE_LIMIT_TTL_SEC
+
+LADDERS = {
+    "auto": ["1080", "720", "480", "360"],
+    "sd": ["480", "360"],
+    "hd": ["max", "2160", "1440", "1080", "720", "480", "360"],
+    "file": ["max", "2160", "1440", "1080", "720", "480", "360"],
+}
+
+# коди, після яких cobalt для цього хоста деякий час не питаємо
+HOST_CODES = (
+    "error.api.service.unsupported",
+    "error.api.service.disabled",
+    "error.api.youtube.login",
+    "error.api.auth.",
+)
+RATE_CODES = ("error.api.rate_exceeded", "http 429")
+
+_ok: Dict[Tuple[str, str], Tuple[str, float]] = {}  # (host, mode) -> (quality, until)
+_blocked: Dict[str, Tuple[str, float]] = {}  # host -> (code, until)
+
+_stats = {"hinted": 0, "promoted": 0, "hints_expired": 0, "skipped_steps": 0, "host_blocks": 0, "blocked_hits": 0}
+
+
+def classify(code: str) -> str:
+    """quality | host | rate | other"""
+    code = (code or "").lower()
+    if code == "too_large":
+        return "quality"
+    if any(code.startswith(c) for c in RATE_CODES):
+        return "rate"
+    if any(code.startswith(c) for c in HOST_CODES):
+        return "host"
+    return "other"
+
+
+def _height(q: str) -> int:
+    return 2160 if q == "max" else int(q)
+
+
+def ladder(host: str, mode: str) -> List[str]:
+    full = LADDERS.get(mode, LADDERS["auto"])
+    hint = _hint(host, mode)
+    if hint in full:
+        _stats["hinted"] += 1
+        return full[full.index(hint):]
+    return list(full)
+
+
+def _hint(host: str, mode: str) -> Optional[str]:
+    entry = _ok.get((host, mode))
+    if entry is None:
+        return None
+    quality, until = entry
+    if time.monotonic() >= until:
+        del _ok[(host, mode)]
+        _stats["hints_expired"] += 1
+        return None
+    return quality
+
+
+def next_step(steps: List[str], current: int, size: int, limit: int) -> int:
+    """
+    Індекс наступної якості після "too large". Якщо відомий розмір — одразу
+    стрибаємо на першу якість, де оцінка (розмір ∝ кількості пікселів) влазить.
+    """
+    i = current + 1
+    if size and size > limit:
+        h0 = _height(steps[current])
+        while i < len(steps) - 1 and size * (_height(steps[i]) / h0) ** 2 > limit * 0.9:
+            i += 1
+            _stats["skipped_steps"] += 1
+    return i
+
+
+def remember_ok(host: str, mode: str, quality: str, size: int, limit: int) -> None:
+    full = LADDERS.get(mode, LADDERS["auto"])
+    if quality not in full:
+        return
+    idx = full.index(quality)
+    if idx > 0 and size and size < limit / 4:
+        # запас великий — наступного разу на крок вище
+        idx -= 1
+        _stats["promoted"] += 1
+    if idx == 0:
+        _ok.pop((host, mode), None)
+        return
+    hint = _hint(host, mode)
+    if hint in full and full.index(hint) >= idx:
+        # та сама або вища якість — строк не продовжуємо, інакше успіхи на
+        # зниженій якості тримали б її вічно
+        _ok[(host, mode)] = (full[idx], _ok[(host, mode)][1])
+    else:
+        _ok[(host, mode)] = (full[idx], time.monotonic() + COBALT_QUALITY_HINT_TTL_SEC)
+
+
+def remember_error(host: str, code: str) -> None:
+    kind = classify(code)
+    if kind == "host":
+        ttl = COBALT_HOST_ERROR_TTL_SEC
+    elif kind == "rate":
+        ttl = COBALT_RATE_LIMIT_TTL_SEC
+    else:
+        return
+    _blocked[host] = (code, time.monotonic() + ttl)
+    _stats["host_blocks"] += 1
+
+
+def blocked(host: str) -> Optional[str]:
+    """Код помилки, через який cobalt для хоста зараз не пробуємо, або None."""
+    entry = _blocked.get(host)
+    if entry is None:
+        return None
+    code, until = entry
+    if time.monotonic() >= until:
+        del _blocked[host]
+        return None
+    _stats["blocked_hits"] += 1
+    return code
+
+
+def stats() -> dict:
+    now = time.monotonic()
+    out = dict(_stats)
+    out["quality_hints"] = ", ".join(
+        f"{h}/{m}={q}({int(u - now)}s)" for (h, m), (q, u) in sorted(_ok.items()) if u > now
+    ) or "-"
+    out["blocked_hosts"] = ", ".join(
+        f"{h}({c}, {int(u - now)}s)" for h, (c, u) in sorted(_blocked.items()) if u > now
+    ) or "-"
+    return out
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# services/download_queue.py
+"""
+Планувальник завантажень.
+
+- глобальний ліміт одночасних завантажень (DL_MAX_CONCURRENT);
+- ліміт на один чат (DL_PER_CHAT) + round-robin між чатами, щоб один чат
+  з 20 посиланнями не блокував усіх інших;
+- дві смуги: "short" (TikTok / Instagram / Shorts) і "long" (YouTube),
+  кожна зі своїм лімітом, щоб довгі відео не забирали всі слоти.
+
+Використання:
+    async with download_queue.slot(chat_id, lane, on_queued=callback):
+        ...  # завантаження
+on_queued(position) викликається, якщо слот не видано одразу; position —
+місце в round-robin своєї смуги (з урахуванням інших чатів).
+"""
+
+import asyncio
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from config import DL_MAX_CONCURRENT, DL_PER_CHAT, DL_SHORT_SLOTS, DL_LONG_SLOTS, log
+
+LANES = ("short", "long")
+
+
+class _Ticket:
+    __slots__ = ("chat_id", "lane", "event", "enqueued", "granted")
+
+    def __init__(self, chat_id: int, lane: str):
+        self.chat_id = chat_id
+        self.lane = lane
+        self.event = asyncio.Event()
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class _Lane:
+    def __init__(self, name: str, cap: int):
+        self.name = name
+        self.cap = max(1, int(cap))
+        self.running = 0
+        self.queues: Dict[int, Deque[_Ticket]] = {}
+        self.rotation: Deque[int] = deque()  # чати з чергою, у порядку round-robin
+
+    def depth(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+
+class DownloadScheduler:
+    def __init__(self, max_concurrent: int, per_chat: int, lane_caps: Dict[str, int]):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.per_chat = max(1, int(per_chat))
+        self.lanes = {name: _Lane(name, cap) for name, cap in lane_caps.items()}
+        self.running = 0
+        self.chat_running: Dict[int, int] = defaultdict(int)
+        self._next_lane = 0
+        # метрики
+        self.granted_total = 0
+        self.queued_total = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.depth_max = 0
+
+    # ----- внутрішнє -----
+    def _enqueue(self, t: _Ticket) -> int:
+        lane = self.lanes[t.lane]
+        q = lane.queues.get(t.chat_id)
+        if q is None:
+            q = lane.queues[t.chat_id] = deque()
+            lane.rotation.append(t.chat_id)
+        q.append(t)
+        self.depth_max = max(self.depth_max, lane.depth())
+        return self._position(t)
+
+    def _position(self, t: _Ticket) -> int:
+        """
+        Місце квитка в round-robin (1 — наступний): за раунд кожен чат смуги
+        віддає по одному квитку, починаючи з голови rotation.
+        """
+        lane = self.lanes[t.lane]
+        k = lane.queues[t.chat_id].index(t)
+        ahead = k
+        before = True
+        for cid in lane.rotation:
+            if cid == t.chat_id:
+                before = False
+                continue
+            ahead += min(len(lane.queues[cid]), k + 1 if before else k)
+        return ahead + 1
+
+    def _remove(self, t: _Ticket) -> None:
+        lane = self.lanes[t.lane]
+        q = lane.queues.get(t.chat_id)
+        if q and t in q:
+            q.remove(t)
+            if not q:
+                del lane.queues[t.chat_id]
+                lane.rotation.remove(t.chat_id)
+
+    def _pick(self, lane: _Lane) -> Optional[_Ticket]:
+        for _ in range(len(lane.rotation)):
+            cid = lane.rotation[0]
+            lane.rotation.rotate(-1)
+            if self.chat_running[cid] >= self.per_chat:
+                continue
+            q = lane.queues[cid]
+            t = q.popleft()
+            if not q:
+                del lane.queues[cid]
+                lane.rotation.remove(cid)
+            return t
+        return None
+
+    def _grant(self, t: _Ticket) -> None:
+        t.granted = True
+        self.running += 1
+        self.lanes[t.lane].running += 1
+        self.chat_running[t.chat_id] += 1
+        waited = time.monotonic() - t.enqueued
+        self.granted_total += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        t.event.set()
+
+    def _dispatch(self) -> None:
+        names = list(self.lanes)
+        progress = True
+        while progress and self.running < self.max_concurrent:
+            progress = False
+            # смуги по черзі, щоб жодна не голодувала
+            for i in range(len(names)):
+                lane = self.lanes[names[(self._next_lane + i) % len(names)]]
+                if lane.running >= lane.cap or not lane.rotation:
+                    continue
+                t = self._pick(lane)
+                if t is None:
+                    continue
+                self._grant(t)
+                self._next_lane = (self._next_lane + i + 1) % len(names)
+                progress = True
+                break
+
+    def _release(self, t: _Ticket) -> None:
+        self.running -= 1
+        self.lanes[t.lane].running -= 1
+        self.chat_running[t.chat_id] -= 1
+        if self.chat_running[t.chat_id] <= 0:
+            del self.chat_running[t.chat_id]
+        self._dispatch()
+
+    # ----- публічне -----
+    @asynccontextmanager
+    async def slot(
+        self,
+        chat_id: int,
+        lane: str = "short",
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+    ):
+        t = _Ticket(chat_id, lane if lane in self.lanes else "short")
+        self._enqueue(t)
+        self._dispatch()
+        try:
+            if not t.granted:
+                self.queued_total += 1
+                position = self._position(t)
+                log.info(f"download queued: chat={chat_id} lane={t.lane} position={position}")
+                if on_queued:
+                    try:
+                        await on_queued(position)
+                    except Exception:
+                        pass
+            await t.event.wait()
+        except BaseException:
+            if t.granted:
+                self._release(t)
+            else:
+                self._remove(t)
+            raise
+        try:
+            yield
+        finally:
+            self._release(t)
+
+    def stats(self) -> dict:
+        out = {
+            "running": self.running,
+            "max_concurrent": self.max_concurrent,
+            "granted_total": self.granted_total,
+            "queued_total": self.queued_total,
+            "wait_avg_ms": round(1000 * self.wait_total / self.granted_total, 1) if self.granted_total else 0.0,
+            "wait_max_ms": round(1000 * self.wait_max, 1),
+            "depth_max": self.depth_max,
+        }
+        for name, lane in self.lanes.items():
+            out[f"{name}_running"] = lane.running
+            out[f"{name}_queued"] = lane.depth()
+        return out
+
+
+_scheduler = DownloadScheduler(
+    DL_MAX_CONCURRENT,
+    DL_PER_CHAT,
+    {"short": DL_SHORT_SLOTS, "long": DL_LONG_SLOTS},
+)
+
+
+def slot(chat_id: int, lane: str = "short", on_queued=None):
+    return _scheduler.slot(chat_id, lane, on_queued)
+
+
+def stats() -> dict:
+    return _scheduler.stats()
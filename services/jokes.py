@@ -10,7 +10,7 @@ from config import (
     GPT_JOKES_ON,
 
 )
-from db import db
+from db import fetchall
 
 # ---- defaults ----
 
@@ -41,11 +41,9 @@ JOKES_R18 = [
 
 
 # ---- utilities ----
-def _weighted_pool_from_db(sql: str, params: tuple = ()) -> List[str]:
+async def _weighted_pool_from_db(sql: str, params: tuple = ()) -> List[str]:
     try:
-        with db() as conn, conn.cursor() as cur:
-            cur.execute(sql, params)
-            rows = cur.fetchall()
+        rows = await fetchall(sql, params)
     except Exception:
         rows = []
     pool: List[str] = []
@@ -60,8 +58,8 @@ def _weighted_pool_from_db(sql: str, params: tuple = ()) -> List[str]:
 
 # ---- just a joke ----
 
-def pick_joke(chat_id: int, mode: str) -> str:
-    pool = _weighted_pool_from_db(
+async def pick_joke(chat_id: int, mode: str) -> str:
+    pool = await _weighted_pool_from_db(
         "SELECT text, weight FROM jokes WHERE chat_id=%s OR chat_id IS NULL",
         (chat_id,),
     )
@@ -105,16 +103,16 @@ async def pick_joke_maybe_gpt(chat_id: int, mode: str) -> str:
         g = await gpt_joke(mode)
         if g:
             return g
-    return pick_joke(chat_id, mode)
+    return await pick_joke(chat_id, mode)
 
 
 # ---- personal “roast” ----
-def pick_personal_joke(chat_id: int, name: str) -> str:
+async def pick_personal_joke(chat_id: int, name: str) -> str:
     """
     Повертає персональний підкол з таблиці jokes_personal (тексти з плейсхолдером {name}).
     Якщо таблиця порожня — використовуємо невеликий дефолтний пул.
     """
-    pool = _weighted_pool_from_db("SELECT text, weight FROM jokes_personal", ())
+    pool = await _weighted_pool_from_db("SELECT text, weight FROM jokes_personal", ())
     if not pool:
         pool = [
             "якщо {name} каже «все під контролем» — готуйся до продакшну в пʼятницю",
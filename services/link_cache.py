@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# services/link_cache.py
+"""
+Короткоживучий кеш результатів по посиланню (ключ — services/links.py).
+
+- невдачі: приватне / видалене / гео-блок / непідтримуване / завелике —
+  на час з DL_FAIL_TTLS; повтор посилання падає одразу, без ланцюжка
+  бекендів. too_large пам'ятаємо окремо для кожного режиму (у sd може влізти);
+- удачі: відповідь cobalt (tunnel / redirect / picker) та info JSON yt-dlp —
+  на DL_RESOLVE_TTL_SEC (tunnel cobalt живе недовго — не більше
+  COBALT_TUNNEL_TTL_SEC), щоб повторне завантаження одразу йшло до передачі байтів.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import DL_FAIL_TTLS, DL_RESOLVE_TTL_SEC
+
+RESOLVE_CACHE_SIZE = 128
+FAIL_CACHE_SIZE = 4096
+COBALT_TUNNEL_TTL_SEC = 60
+
+MESSAGES = {
+    "private": "Контент приватний або потребує входу",
+    "not_found": "Контент видалено або його не існує",
+    "geo": "Контент недоступний у регіоні сервера",
+    "unsupported": "Посилання не підтримується",
+    "too_large": "Завелике для Telegram",
+}
+
+# підрядки помилок yt-dlp / коди cobalt; порядок важливий — гео перевіряємо
+# раніше за "video unavailable", яким YouTube починає і гео-помилку.
+# not_found — лише вердикти екстракторів: "http error 404" / "does not exist"
+# бувають і від фрагментів, відсутніх cookies чи шляхів, а cobalt
+# content.*.unavailable — і від rate limit Instagram; таке не кешуємо.
+_PATTERNS = (
+    ("geo", (
+        "not available in your country", "geo restrict", "geo-restrict",
+        "blocked it in your country", "content.video.region",
+    )),
+    ("private", (
+        "private video", "video is private", "account is private",
+        "sign in if you've been granted access", "content.video.private", "content.post.private",
+    )),
+    ("not_found", (
+        "video unavailable", "has been removed", "no longer available",
+        "this video has been deleted", "post is unavailable",
+    )),
+    ("unsupported", (
+        "unsupported url", "link.unsupported", "link.invalid",
+    )),
+)
+
+
+class KnownFailure(RuntimeError):
+    """Класифікована невдача (приватне, видалене, ...) — кешується як негативний результат."""
+
+    def __init__(self, kind: str, message: Optional[str] = None):
+        super().__init__(message or MESSAGES.get(kind, kind))
+        self.kind = kind
+        self.code = kind
+
+
+def _parse_ttls(raw: str) -> Dict[str, float]:
+    """"private=600,not_found=1800" -> {"private": 600.0, ...}"""
+    out: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        kind, _, val = part.partition("=")
+        try:
+            out[kind.strip()] = float(val)
+        except ValueError:
+            continue
+    return out
+
+
+FAIL_TTLS = _parse_ttls(DL_FAIL_TTLS)
+
+_fails: "OrderedDict[Tuple[str, str], Tuple[KnownFailure, float]]" = OrderedDict()
+_resolved: "OrderedDict[Tuple[str, str], Tuple[Any, float]]" = OrderedDict()
+
+_stats = {"fail_hits": 0, "fail_stored": 0, "resolve_hits": 0, "resolve_misses": 0, "resolve_dropped": 0}
+
+
+def classify(text: str) -> Optional[str]:
+    """Тип невдачі за текстом помилки або None, якщо вона не про сам контент."""
+    text = (text or "").lower()
+    for kind, needles in _PATTERNS:
+        if any(n in text for n in needles):
+            return kind
+    return None
+
+
+def _fail_key(key: str, mode: str, kind: str) -> Tuple[str, str]:
+    # приватне / видалене — незалежно від режиму; розмір залежить від якості
+    return (key, mode if kind == "too_large" else "*")
+
+
+def _put(store: OrderedDict, k, value, ttl: float, limit: int) -> None:
+    store[k] = (value, time.monotonic() + ttl)
+    store.move_to_end(k)
+    while len(store) > limit:
+        store.popitem(last=False)
+
+
+def _get(store: OrderedDict, k):
+    entry = store.get(k)
+    if entry is None:
+        return None
+    if entry[1] <= time.monotonic():
+        del store[k]
+        return None
+    return entry[0]
+
+
+def remember_failure(key: str, mode: str, err: KnownFailure) -> None:
+    ttl = FAIL_TTLS.get(err.kind, 0)
+    if ttl <= 0:
+        return
+    _put(_fails, _fail_key(key, mode, err.kind), err, ttl, FAIL_CACHE_SIZE)
+    _stats["fail_stored"] += 1
+
+
+def failure(key: str, mode: str) -> Optional[KnownFailure]:
+    """Закешована невдача для посилання в цьому режимі або None."""
+    for k in ((key, "*"), (key, mode)):
+        err = _get(_fails, k)
+        if err is not None:
+            _stats["fail_hits"] += 1
+            return KnownFailure(err.kind, str(err))
+    return None
+
+
+def get(ns: str, key: str) -> Any:
+    """Позитивний результат ("cobalt" / "info") або None."""
+    value = _get(_resolved, (ns, key))
+    _stats["resolve_hits" if value is not None else "resolve_misses"] += 1
+    return value
+
+
+def put(ns: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+    ttl = DL_RESOLVE_TTL_SEC if ttl is None else min(ttl, DL_RESOLVE_TTL_SEC)
+    if ttl > 0:
+        _put(_resolved, (ns, key), value, ttl, RESOLVE_CACHE_SIZE)
+
+
+def forget(ns: str, key: str) -> None:
+    if _resolved.pop((ns, key), None) is not None:
+        _stats["resolve_dropped"] += 1
+
+
+def stats() -> dict:
+    now = time.monotonic()
+    return {
+        **_stats,
+        "failures": sum(1 for _, until in _fails.values() if until > now),
+        "resolutions": sum(1 for _, until in _resolved.values() if until > now),
+    }
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# services/links.py
+"""
+Посилання на медіа: чи підтримуємо хост, канонічний URL і ключ контенту.
+
+- match_host(): суфіксне порівняння з HOSTS одним скомпільованим regex —
+  "box.com" не збігається з "x.com", "vm.tiktok.com" -> "tiktok.com",
+  "youtu.be" -> "youtube.com", "twitter.com" -> "x.com";
+- canonical(): один URL на один контент — youtu.be / watch?v= / shorts / embed,
+  TikTok /@user/video/ID, IG /p|reel|stories, X /status/ID; трекінг-параметри,
+  фрагмент і хвостовий "/" прибираються;
+- content_key(): "host:id" — ключ для кешу file_id і single-flight;
+- resolve(): короткі посилання TikTok (vm. / vt. / tiktok.com/t/) розгортаються
+  за редиректами без читання сторінки; результат кешується.
+"""
+
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from urllib.parse import urljoin, urlparse, urlunparse, parse_qsl, urlencode
+
+import aiohttp
+
+from config import log
+
+# Хости, які вважаємо підтримуваними (разом з усіма піддоменами)
+HOSTS = (
+    "youtube.com", "youtu.be",
+    "tiktok.com",
+    "instagram.com",
+    "x.com", "twitter.com",
+    "reddit.com",
+    "pinterest.com",
+)
+ALIASES = {"youtu.be": "youtube.com", "twitter.com": "x.com"}
+
+_HOST_RE = re.compile(
+    r"(?:^|\.)(" + "|".join(re.escape(h) for h in sorted(HOSTS, key=len, reverse=True)) + r")$"
+)
+
+# query-параметри, які не впливають на контент (трекінг/шеринг)
+TRACKING_PARAMS = {
+    "igsh", "igshid", "si", "feature", "fbclid", "gclid", "ref", "ref_src",
+    "_t", "_r", "is_from_webapp", "sender_device", "sender_web_id", "share_app_id",
+}
+
+YT_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+IG_CODE_RE = re.compile(
+    r"https?://(?:www\.|m\.)?instagram\.com/(?:p|reel|reels|tv)/([A-Za-z0-9_-]{5,})",
+    re.I,
+)
+TT_ID_RE = re.compile(r"/(video|photo)/(\d+)")
+X_ID_RE = re.compile(r"/status(?:es)?/(\d+)")
+
+TT_SHORT_HOSTS = ("vm.tiktok.com", "vt.tiktok.com")
+SHORT_LINK_TTL_SEC = 24 * 3600
+SHORT_LINK_CACHE_SIZE = 4096
+_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+_short: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+_stats = {"resolved": 0, "hits": 0, "errors": 0}
+
+
+def _parse(url: str):
+    url = (url or "").strip()
+    if "://" not in url:
+        url = "https://" + url
+    try:
+        p = urlparse(url)
+        p.port  # noqa: B018 — кривий порт кидає ValueError
+    except ValueError:
+        return None
+    return p
+
+
+def match_host(url: str) -> Optional[str]:
+    """Підтримуваний хост посилання (з урахуванням ALIASES) або None."""
+    p = _parse(url)
+    if p is None or p.scheme.lower() not in ("http", "https"):
+        return None
+    m = _HOST_RE.search((p.hostname or "").lower().rstrip("."))
+    if not m:
+        return None
+    return ALIASES.get(m.group(1), m.group(1))
+
+
+def is_short(url: str) -> bool:
+    """Коротке посилання TikTok, яке треба розгорнути редиректом."""
+    p = _parse(url)
+    if p is None:
+        return False
+    host = (p.hostname or "").lower()
+    return host in TT_SHORT_HOSTS or (match_host(url) == "tiktok.com" and p.path.startswith("/t/"))
+
+
+def normalize_instagram(url: str) -> str:
+    """
+    Для звичайних постів/reel нормалізуємо в:
+      https://www.instagram.com/p/<CODE>/
+      або
+      https://www.instagram.com/reel/<CODE>/
+
+    Для stories:
+      https://www.instagram.com/stories/<user>/<story_id>/
+
+    Параметри типу utm/... прибираємо.
+    """
+    return _instagram(url)[0]
+
+
+def _instagram(url: str) -> Tuple[str, Optional[str]]:
+    p = _parse(url)
+    if p is None or match_host(url) != "instagram.com":
+        return url, None
+    parts = [x for x in (p.path or "").split("/") if x]
+
+    # stories/USER/ID[/...]
+    if len(parts) >= 3 and parts[0] == "stories":
+        return f"https://www.instagram.com/stories/{parts[1]}/{parts[2]}/", f"story:{parts[2]}"
+
+    # Звичайні пости /p/ або /reel/
+    m = IG_CODE_RE.search(urlunparse(("https", p.netloc, p.path, "", "", "")))
+    if not m:
+        return url, None
+    code = m.group(1)
+    if parts[0] == "p":
+        return f"https://www.instagram.com/p/{code}/", code
+    return f"https://www.instagram.com/reel/{code}/", code
+
+
+def _youtube_id(p, parts) -> Optional[str]:
+    if (p.hostname or "").lower().endswith("youtu.be"):
+        vid = parts[0] if parts else None
+    elif parts and parts[0] in ("shorts", "embed", "live", "v") and len(parts) > 1:
+        vid = parts[1]
+    else:
+        vid = dict(parse_qsl(p.query)).get("v")
+    return vid if vid and YT_ID_RE.match(vid) else None
+
+
+def _strip(p) -> str:
+    """Загальний випадок: без трекінг-параметрів, фрагмента і хвостового '/'."""
+    query = [
+        (k, v) for k, v in parse_qsl(p.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith("utm_")
+    ]
+    return urlunparse((
+        (p.scheme or "https").lower(),
+        p.netloc.lower(),
+        p.path.rstrip("/") or "/",
+        "",
+        urlencode(query),
+        "",
+    ))
+
+
+def _canon(url: str) -> Tuple[str, Optional[str]]:
+    """(канонічний URL, id контенту або None)."""
+    p = _parse(url)
+    if p is None:
+        return (url or "").strip(), None
+    host = match_host(url)
+    parts = [x for x in p.path.split("/") if x]
+
+    if host == "youtube.com":
+        vid = _youtube_id(p, parts)
+        if vid:
+            # shorts лишаються shorts: від цього залежить смуга планувальника
+            if parts[:1] == ["shorts"]:
+                return f"https://www.youtube.com/shorts/{vid}", vid
+            return f"https://www.youtube.com/watch?v={vid}", vid
+    elif host == "tiktok.com" and not is_short(url):
+        m = TT_ID_RE.search(p.path)
+        if m:
+            user = parts[0] if parts and parts[0].startswith("@") else "@"
+            return f"https://www.tiktok.com/{user}/{m.group(1)}/{m.group(2)}", m.group(2)
+    elif host == "instagram.com":
+        norm, cid = _instagram(url)
+        if cid:
+            return norm, cid
+    elif host == "x.com":
+        m = X_ID_RE.search(p.path)
+        if m:
+            user = parts[0] if parts and parts[0] != "i" else "i"
+            return f"https://x.com/{user}/status/{m.group(1)}", m.group(1)
+    return _strip(p), None
+
+
+def canonical(url: str) -> str:
+    return _canon(url)[0]
+
+
+def content_key(url: str) -> str:
+    """"host:id" для відомого контенту, інакше — канонічний URL."""
+    norm, cid = _canon(url)
+    return f"{match_host(norm)}:{cid}" if cid else norm
+
+
+async def resolve(url: str, session: aiohttp.ClientSession) -> str:
+    """Розгортає коротке посилання TikTok; решту (і при помилці) повертає як є."""
+    if not is_short(url):
+        return url
+    key = url.strip()
+    now = time.monotonic()
+    hit = _short.get(key)
+    if hit is not None and hit[1] > now:
+        _short.move_to_end(key)
+        _stats["hits"] += 1
+        return hit[0]
+
+    cur = key if "://" in key else "https://" + key
+    try:
+        for _ in range(5):
+            async with session.get(
+                cur, allow_redirects=False, headers={"User-Agent": _UA}, timeout=aiohttp.ClientTimeout(total=10)
+            ) as resp:
+                loc = resp.headers.get("Location")
+                if resp.status not in (301, 302, 303, 307, 308) or not loc:
+                    break
+            cur = urljoin(cur, loc)
+            if not is_short(cur):
+                break
+    except Exception as e:
+        _stats["errors"] += 1
+        log.warning(f"links: cannot resolve {key}: {e}")
+        return url
+    if is_short(cur) or match_host(cur) is None:
+        _stats["errors"] += 1
+        return url
+
+    _stats["resolved"] += 1
+    _short[key] = (cur, now + SHORT_LINK_TTL_SEC)
+    while len(_short) > SHORT_LINK_CACHE_SIZE:
+        _short.popitem(last=False)
+    return cur
+
+
+def stats() -> dict:
+    return {**_stats, "short_links_cached": len(_short)}
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# services/media_cache.py
+"""
+Кеш Telegram file_id для вже відправлених посилань.
+
+Ключ — ключ контенту (services/links.py: "host:id") + режим завантаження. Значення — підпис і список
+відправок (одиночні файли / альбоми) з file_id, які повернув Telegram
+при першій відправці. Повторне посилання (у цьому чи іншому чаті)
+шлемо одразу за file_id, без скачування.
+
+Два рівні: LRU у пам'яті (MEDIA_CACHE_SIZE) + таблиця media_cache у БД.
+Записи старші за MEDIA_CACHE_TTL_SEC вважаються простроченими.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import MEDIA_CACHE_SIZE, MEDIA_CACHE_TTL_SEC, log
+from db import execute, fetchone
+
+PURGE_EVERY_SEC = 3600
+
+_lru: "OrderedDict[str, dict]" = OrderedDict()
+_last_purge = 0.0
+
+_stats = {"hits_mem": 0, "hits_db": 0, "misses": 0, "stores": 0, "invalidated": 0, "errors": 0}
+
+
+def _key(url: str, mode: str) -> str:
+    return hashlib.sha1(f"{(mode or 'auto').lower()}|{url}".encode("utf-8")).hexdigest()
+
+
+def _remember(key: str, entry: dict) -> None:
+    _lru[key] = entry
+    _lru.move_to_end(key)
+    while len(_lru) > MEDIA_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+
+async def get(url: str, mode: str) -> Optional[dict]:
+    """{"caption": str, "ops": [...]} або None."""
+    key = _key(url, mode)
+    now = time.time()
+    entry = _lru.get(key)
+    if entry is not None:
+        if now - entry["ts"] < MEDIA_CACHE_TTL_SEC:
+            _lru.move_to_end(key)
+            _stats["hits_mem"] += 1
+            return entry
+        _lru.pop(key, None)
+
+    try:
+        row = await fetchone(
+            "SELECT payload, UNIX_TIMESTAMP(created_at) AS ts FROM media_cache WHERE cache_key=%s",
+            (key,),
+        )
+    except Exception as e:
+        _stats["errors"] += 1
+        log.warning(f"media_cache get failed: {e}")
+        row = None
+
+    if row and now - float(row["ts"] or 0) < MEDIA_CACHE_TTL_SEC:
+        try:
+            entry = json.loads(row["payload"])
+            entry["ts"] = float(row["ts"])
+            _remember(key, entry)
+            _stats["hits_db"] += 1
+            return entry
+        except Exception:
+            pass
+
+    _stats["misses"] += 1
+    return None
+
+
+async def put(url: str, mode: str, caption: str, ops: List[Dict]) -> None:
+    global _last_purge
+    if not ops:
+        return
+    key = _key(url, mode)
+    entry = {"caption": caption, "ops": ops, "ts": time.time()}
+    _remember(key, entry)
+    _stats["stores"] += 1
+    try:
+        await execute("""
+            INSERT INTO media_cache (cache_key, url, mode, payload) VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE payload = VALUES(payload), created_at = CURRENT_TIMESTAMP
+        """, (key, url[:2000], (mode or "auto").lower(), json.dumps({"caption": caption, "ops": ops})))
+        if time.time() - _last_purge > PURGE_EVERY_SEC:
+            _last_purge = time.time()
+            await execute(
+                "DELETE FROM media_cache WHERE created_at < NOW() - INTERVAL %s SECOND",
+                (int(MEDIA_CACHE_TTL_SEC),),
+            )
+    except Exception as e:
+        _stats["errors"] += 1
+        log.warning(f"media_cache put failed: {e}")
+
+
+async def invalidate(url: str, mode: str) -> None:
+    key = _key(url, mode)
+    _lru.pop(key, None)
+    _stats["invalidated"] += 1
+    try:
+        await execute("DELETE FROM media_cache WHERE cache_key=%s", (key,))
+    except Exception as e:
+        _stats["errors"] += 1
+        log.warning(f"media_cache invalidate failed: {e}")
+
+
+def stats() -> dict:
+    return {**_stats, "size_mem": len(_lru)}
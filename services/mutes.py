@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# services/mutes.py
+"""
+Індекс активних мʼютів у пам'яті.
+
+Перевірка is_muted_now відбувається на кожне повідомлення, а замʼючених майже
+немає — тож тримаємо dict (chat_id, user_id) -> muted_until (UTC) і min-heap
+за часом закінчення, з якого прострочені записи вичищаються.
+На старті індекс заповнюється з user_moderation, далі його оновлюють
+restrict_for_minutes та /unmute.
+"""
+
+import heapq
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from config import log
+from db import fetchall
+
+Key = Tuple[int, int]
+
+_until: Dict[Key, datetime] = {}
+_heap: List[Tuple[datetime, int, int]] = []
+
+_stats = {"checks": 0, "muted_hits": 0, "expired": 0}
+
+
+def _expire(now: datetime) -> None:
+    while _heap and _heap[0][0] <= now:
+        until, chat_id, user_id = heapq.heappop(_heap)
+        # у heap можуть лишатись застарілі записи після повторного mute/unmute
+        if _until.get((chat_id, user_id)) == until:
+            del _until[(chat_id, user_id)]
+            _stats["expired"] += 1
+
+
+def set_muted(chat_id: int, user_id: int, until: datetime) -> None:
+    _expire(datetime.utcnow())
+    _until[(chat_id, user_id)] = until
+    heapq.heappush(_heap, (until, chat_id, user_id))
+
+
+def clear(chat_id: int, user_id: int) -> None:
+    _until.pop((chat_id, user_id), None)
+
+
+def is_muted(chat_id: int, user_id: int) -> bool:
+    _stats["checks"] += 1
+    until = _until.get((chat_id, user_id))
+    if until is None:
+        return False
+    now = datetime.utcnow()
+    if now < until:
+        _stats["muted_hits"] += 1
+        return True
+    _expire(now)
+    return False
+
+
+async def load() -> None:
+    rows = await fetchall(
+        "SELECT chat_id, user_id, muted_until FROM user_moderation WHERE muted_until IS NOT NULL"
+    )
+    now = datetime.utcnow()
+    for r in rows:
+        until = r.get("muted_until")
+        if isinstance(until, datetime) and until > now:
+            set_muted(int(r["chat_id"]), int(r["user_id"]), until)
+    log.info(f"mute index loaded: {len(_until)} active mute(s)")
+
+
+def stats() -> dict:
+    return {**_stats, "active": len(_until), "heap": len(_heap)}
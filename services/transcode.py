@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# services/transcode.py
+"""
+Пост-обробка медіа через ffmpeg перед відправкою в Telegram.
+
+- відео більше за ліміт перекодовується (H.264 + AAC, +faststart) з бітрейтом,
+  розрахованим із тривалості, щоб файл вліз у ліміт і лишився відео з
+  інлайн-програванням, а не документом;
+- фото більше 10 МБ стискається в JPEG (довша сторона до PHOTO_MAX_SIDE);
+- для відео — ширина / висота / тривалість і прев'ю (JPEG ≤ 320px) для send_video.
+
+ffmpeg/ffprobe — окремі процеси; перекодувань одночасно не більше за
+TRANSCODE_WORKERS, коротких probe / прев'ю — не більше LIGHT_SLOTS, решта
+чекає. Таймаут або скасування вбивають процес.
+
+fits() — чи влізе відео такої тривалості в ліміт після перекодування;
+джерело для цього качаємо до SOURCE_LIMIT (TRANSCODE_MAX_SOURCE_MB).
+Без ffmpeg у системі (AVAILABLE = False) усе лишається як є.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import signal
+from typing import Dict, List, Optional
+
+from config import TRANSCODE_WORKERS, TRANSCODE_TIMEOUT_SEC, TRANSCODE_MAX_SOURCE_MB, FFMPEG_BIN, FFPROBE_BIN, log
+
+MB = 1024 * 1024
+PHOTO_LIMIT = 10 * MB
+PHOTO_MAX_SIDE = 2560
+AUDIO_KBPS = 96
+MIN_VIDEO_KBPS = 150  # нижче — каша; такі відео не перекодовуємо
+SIZE_MARGIN = 0.92  # контейнер і неточність ABR
+SOURCE_LIMIT = int(TRANSCODE_MAX_SOURCE_MB) * MB
+LIGHT_SLOTS = 4
+
+AVAILABLE = bool(shutil.which(FFMPEG_BIN) and shutil.which(FFPROBE_BIN))
+
+_sem: Optional[asyncio.Semaphore] = None
+_light: Optional[asyncio.Semaphore] = None
+_stats = {"videos": 0, "photos": 0, "thumbs": 0, "failed": 0, "skipped": 0, "saved_mb": 0}
+
+
+def _slots(heavy: bool) -> asyncio.Semaphore:
+    global _sem, _light
+    if _sem is None:
+        _sem = asyncio.Semaphore(max(1, int(TRANSCODE_WORKERS)))
+        _light = asyncio.Semaphore(LIGHT_SLOTS)
+    return _sem if heavy else _light
+
+
+async def _run(args: List[str], timeout: float, heavy: bool = True) -> bytes:
+    """
+    Запускає ffmpeg/ffprobe; повертає stdout або кидає RuntimeError.
+    heavy — перекодування (слоти TRANSCODE_WORKERS); короткі probe / прев'ю
+    мають окремі LIGHT_SLOTS, щоб не стояти за довгим перекодуванням.
+    """
+    async with _slots(heavy):
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True
+        )
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"{os.path.basename(args[0])} timeout")
+        finally:
+            if proc.returncode is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await asyncio.shield(proc.wait())
+    if proc.returncode != 0:
+        raise RuntimeError((err or b"").decode("utf-8", "replace").strip()[-1000:] or "ffmpeg error")
+    return out
+
+
+async def probe(path: str) -> Dict:
+    """{"width", "height", "duration"} першого відеопотоку (чого немає — того немає)."""
+    out = await _run([
+        FFPROBE_BIN, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height:format=duration", "-of", "json", path,
+    ], 30, heavy=False)
+    data = json.loads(out or b"{}")
+    stream = (data.get("streams") or [{}])[0]
+    meta = {}
+    if stream.get("width") and stream.get("height"):
+        meta["width"], meta["height"] = int(stream["width"]), int(stream["height"])
+    try:
+        meta["duration"] = float((data.get("format") or {}).get("duration"))
+    except (TypeError, ValueError):
+        pass
+    return meta
+
+
+async def thumbnail(path: str, dest: str, duration: float = 0) -> Optional[str]:
+    at = min(1.0, duration / 2) if duration else 0
+    try:
+        await _run([
+            FFMPEG_BIN, "-y", "-v", "error", "-ss", f"{at:.2f}", "-i", path, "-frames:v", "1",
+            "-vf", "scale=320:320:force_original_aspect_ratio=decrease", "-q:v", "5", dest,
+        ], 60, heavy=False)
+    except Exception as e:
+        log.warning(f"transcode: thumbnail failed: {e}")
+        return None
+    if not os.path.isfile(dest):
+        return None
+    _stats["thumbs"] += 1
+    return dest
+
+
+def _video_kbps(limit: int, duration: float, factor: float = SIZE_MARGIN) -> float:
+    return limit * 8 * factor / duration / 1000 - AUDIO_KBPS
+
+
+def fits(duration: Optional[float], limit: int) -> bool:
+    """Чи влізе відео такої тривалості в limit байт з мінімально пристойним бітрейтом."""
+    return bool(AVAILABLE and duration and _video_kbps(limit, float(duration)) >= MIN_VIDEO_KBPS)
+
+
+def _target_height(video_kbps: float) -> int:
+    if video_kbps >= 1500:
+        return 720
+    if video_kbps >= 600:
+        return 480
+    return 360
+
+
+async def fit_video(path: str, limit: int, dest: str, duration: float) -> Optional[str]:
+    """Перекодовує відео під limit байт; None — якщо навіть мінімальний бітрейт не влазить."""
+    if not duration:
+        _stats["skipped"] += 1
+        return None
+    factor = SIZE_MARGIN
+    for _ in range(2):
+        video_kbps = _video_kbps(limit, duration, factor)
+        if video_kbps < MIN_VIDEO_KBPS:
+            _stats["skipped"] += 1
+            log.info(f"transcode: {os.path.basename(path)} too long to fit ({duration:.0f}s)")
+            return None
+        h = _target_height(video_kbps)
+        v = int(video_kbps)
+        try:
+            await _run([
+                FFMPEG_BIN, "-y", "-v", "error", "-i", path,
+                "-map", "0:v:0", "-map", "0:a:0?",
+                "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                "-b:v", f"{v}k", "-maxrate", f"{int(v * 1.3)}k", "-bufsize", f"{v * 2}k",
+                "-vf", f"scale=-2:'trunc(min({h},ih)/2)*2'",
+                "-c:a", "aac", "-b:a", f"{AUDIO_KBPS}k",
+                "-movflags", "+faststart", dest,
+            ], TRANSCODE_TIMEOUT_SEC)
+        except Exception as e:
+            _stats["failed"] += 1
+            log.warning(f"transcode: video failed: {e}")
+            return None
+        size = os.path.getsize(dest)
+        if size <= limit:
+            _stats["videos"] += 1
+            _stats["saved_mb"] += max(0, os.path.getsize(path) - size) // MB
+            return dest
+        factor *= 0.85  # ABR промахнувся — ще раз з меншим бітрейтом
+    _stats["failed"] += 1
+    return None
+
+
+async def fit_photo(path: str, dest: str, limit: int = PHOTO_LIMIT) -> Optional[str]:
+    """Стискає фото в JPEG під limit байт; None — якщо не вийшло."""
+    scale = f"scale='min({PHOTO_MAX_SIDE},iw)':'min({PHOTO_MAX_SIDE},ih)':force_original_aspect_ratio=decrease"
+    for q in (3, 8):
+        try:
+            await _run([FFMPEG_BIN, "-y", "-v", "error", "-i", path, "-vf", scale, "-q:v", str(q), dest], 120)
+        except Exception as e:
+            _stats["failed"] += 1
+            log.warning(f"transcode: photo failed: {e}")
+            return None
+        if os.path.getsize(dest) <= limit:
+            _stats["photos"] += 1
+            _stats["saved_mb"] += max(0, os.path.getsize(path) - os.path.getsize(dest)) // MB
+            return dest
+    _stats["failed"] += 1
+    return None
+
+
+def stats() -> dict:
+    return {"available": AVAILABLE, "workers": TRANSCODE_WORKERS, **_stats}
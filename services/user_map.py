@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# services/user_map.py
+"""
+Write-behind буфер для таблиці user_map.
+
+remember_user викликається на кожне повідомлення, але майже завжди лише
+оновлює last_seen. Тому записи копимо в пам'яті за ключем (chat_id, user_id)
+і скидаємо в БД пачками (multi-row upsert) раз на USER_MAP_FLUSH_SEC
+та при зупинці бота. Якщо username не змінився і last_seen оновлювали
+нещодавно (USER_MAP_REFRESH_SEC) — запис взагалі пропускаємо.
+
+Той самий потік живить LRU-кеш (chat_id, lower(username)) -> user_id для
+резолву @mention у модераторських командах (usernames у Telegram
+регістронезалежні).
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import USER_MAP_FLUSH_SEC, USER_MAP_REFRESH_SEC, USERNAME_CACHE_SIZE, log
+from db import executemany, fetchone
+
+UPSERT_SQL = """
+    INSERT INTO user_map (chat_id, user_id, username)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        username = VALUES(username),
+        last_seen = CURRENT_TIMESTAMP
+"""
+BATCH_SIZE = 500
+
+Key = Tuple[int, int]
+
+
+class UsernameIndex:
+    """Обмежений LRU: (chat_id, lower(username)) -> user_id."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, int(max_size))
+        self._data: "OrderedDict[Tuple[int, str], int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, chat_id: int, username: str, user_id: int) -> None:
+        key = (chat_id, username.lower())
+        self._data[key] = user_id
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def drop(self, chat_id: int, username: str, user_id: int) -> None:
+        key = (chat_id, username.lower())
+        if self._data.get(key) == user_id:
+            del self._data[key]
+
+    def get(self, chat_id: int, username: str) -> Optional[int]:
+        key = (chat_id, username.lower())
+        uid = self._data.get(key)
+        if uid is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return uid
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._data),
+        }
+
+
+class UserMapBuffer:
+    def __init__(self, refresh_sec: float):
+        self.refresh_sec = float(refresh_sec)
+        self._pending: Dict[Key, Optional[str]] = {}
+        # що і коли востаннє записали в БД: key -> (username, monotonic ts)
+        self._written: Dict[Key, Tuple[Optional[str], float]] = {}
+        self._lock = asyncio.Lock()
+        self.seen = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def last_username(self, chat_id: int, user_id: int) -> Optional[str]:
+        key = (chat_id, user_id)
+        if key in self._pending:
+            return self._pending[key]
+        written = self._written.get(key)
+        return written[0] if written else None
+
+    def touch(self, chat_id: int, user_id: int, username: Optional[str]) -> None:
+        self.seen += 1
+        key = (chat_id, user_id)
+        if key in self._pending:
+            self._pending[key] = username
+            self.coalesced += 1
+            return
+        written = self._written.get(key)
+        if written and written[0] == username and time.monotonic() - written[1] < self.refresh_sec:
+            self.coalesced += 1
+            return
+        self._pending[key] = username
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            rows = [(cid, uid, uname) for (cid, uid), uname in batch.items()]
+            try:
+                for i in range(0, len(rows), BATCH_SIZE):
+                    await executemany(UPSERT_SQL, rows[i:i + BATCH_SIZE])
+            except Exception as e:
+                # повертаємо в чергу, не перетираючи новіші значення
+                for key, uname in batch.items():
+                    self._pending.setdefault(key, uname)
+                self.flush_errors += 1
+                log.warning(f"user_map flush failed ({len(rows)} rows): {e}")
+                return 0
+
+            now = time.monotonic()
+            self._written = {
+                k: v for k, v in self._written.items() if now - v[1] < self.refresh_sec
+            }
+            for key, uname in batch.items():
+                self._written[key] = (uname, now)
+            self.flushed += len(rows)
+            self.flushes += 1
+            return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "seen": self.seen,
+            "coalesced": self.coalesced,
+            "flushed_rows": self.flushed,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "pending": len(self._pending),
+        }
+
+
+_buffer = UserMapBuffer(USER_MAP_REFRESH_SEC)
+_usernames = UsernameIndex(USERNAME_CACHE_SIZE)
+
+
+def remember(chat_id: int, user_id: int, username: Optional[str]) -> None:
+    old = _buffer.last_username(chat_id, user_id)
+    if old and old != username:
+        _usernames.drop(chat_id, old, user_id)
+    if username:
+        _usernames.put(chat_id, username, user_id)
+    _buffer.touch(chat_id, user_id, username)
+
+
+async def resolve_username(chat_id: int, username: str) -> Optional[int]:
+    uid = _usernames.get(chat_id, username)
+    if uid is not None:
+        return uid
+    row = await fetchone("""
+      SELECT user_id FROM user_map
+      WHERE chat_id=%s AND username_lc=%s
+      ORDER BY last_seen DESC
+      LIMIT 1
+    """, (chat_id, username.lower()))
+    if not row:
+        return None
+    uid = int(row["user_id"])
+    _usernames.put(chat_id, username, uid)
+    return uid
+
+
+async def flush() -> int:
+    return await _buffer.flush()
+
+
+async def user_map_flush_loop():
+    while True:
+        await asyncio.sleep(USER_MAP_FLUSH_SEC)
+        try:
+            await _buffer.flush()
+        except Exception as e:
+            log.warning(f"user_map_flush_loop error: {e}")
+
+
+def stats() -> dict:
+    return _buffer.stats()
+
+
+def username_stats() -> dict:
+    return _usernames.stats()
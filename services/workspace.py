@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# services/workspace.py
+"""
+Робочі теки завантажень.
+
+Кожне завантаження отримує власну теку TMP_DIR/job-<ts>-<id>/ (усередині —
+підтека на кожен бекенд), тож паралельні задачі не перетирають файли одна
+одної, а прибирання після відправки — один rmtree. rmtree і обхід тек для
+заміру йдуть у потоці, не на циклі подій; квота звільняється, коли rmtree
+завершився. Якщо задачу скасували, а потік бекенду ще пише в теку, rmtree
+чекає на нього (pin / unpin).
+
+Квота: активна задача займає з DL_DISK_QUOTA_MB більше з двох — резерв
+DL_JOB_RESERVE_MB або реально записане в її теку (перемірюється не частіше
+USAGE_TTL_SEC); також враховується місце, яке займають знайдені janitor'ом
+сироти. Якщо місця немає — чекаємо (перевіряючи знову, поки файли
+прибираються) до DL_QUOTA_WAIT_SEC (0 — одразу) і кидаємо DiskQuotaExceeded.
+
+janitor_loop раз на DL_JANITOR_EVERY_SEC видаляє теки job-*, що не належать
+активним задачам і старші за DL_WORKSPACE_MAX_AGE_SEC; на старті бота активних
+задач немає, тож прибираються всі, створені до старту.
+"""
+
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, Set, Tuple
+
+from config import (
+    DL_DISK_QUOTA_MB,
+    DL_JOB_RESERVE_MB,
+    DL_QUOTA_WAIT_SEC,
+    DL_WORKSPACE_MAX_AGE_SEC,
+    DL_JANITOR_EVERY_SEC,
+    log,
+)
+
+PREFIX = "job-"
+MB = 1024 * 1024
+USAGE_TTL_SEC = 1.0
+RECHECK_SEC = 1.0
+_BOOT = time.time()
+
+
+class DiskQuotaExceeded(RuntimeError):
+    pass
+
+
+class Workspace:
+    def __init__(self, root: str, reserved: int):
+        self.path = os.path.join(root, f"{PREFIX}{int(time.time())}-{uuid.uuid4().hex[:8]}")
+        self.reserved = reserved
+        self.released = False
+        self._pins = 0
+        self._removing = False
+        self._used = 0
+        self._measured = 0.0
+        os.makedirs(self.path, exist_ok=True)
+
+    def used(self) -> int:
+        """Скільки байт реально лежить у теці — останній замір _refresh_usage()."""
+        return self._used
+
+    def charged(self) -> int:
+        return max(self.reserved, self.used())
+
+    def sub(self, name: str) -> str:
+        path = os.path.join(self.path, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def pin(self) -> None:
+        """Потік бекенду ще пише в теку — release() відкладається до unpin()."""
+        self._pins += 1
+
+    def unpin(self) -> None:
+        self._pins -= 1
+        if self.released and self._pins <= 0:
+            self._remove()
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        if self._pins <= 0:
+            self._remove()
+
+    def _remove(self) -> None:
+        # rmtree багатогігабайтних файлів — не на циклі подій; квота звільняється після нього
+        if self._removing or self.path not in _active:
+            return
+        self._removing = True
+        task = asyncio.get_running_loop().create_task(self._remove_async())
+        _removals.add(task)
+        task.add_done_callback(_removals.discard)
+
+    async def _remove_async(self) -> None:
+        try:
+            await asyncio.to_thread(shutil.rmtree, self.path, True)
+        finally:
+            _active.pop(self.path, None)
+            _free(self.reserved)
+
+
+_active: Dict[str, Workspace] = {}
+_reserved = 0
+_orphan_bytes = 0
+_waiters: Deque[asyncio.Future] = deque()
+_removals: Set[asyncio.Task] = set()
+
+_stats = {"created": 0, "waited": 0, "rejected": 0, "swept": 0, "swept_bytes": 0}
+
+
+def _charged() -> int:
+    """Зайняте активними задачами: резерв або фактичний розмір теки, що більше."""
+    return sum(ws.charged() for ws in list(_active.values()))
+
+
+async def _refresh_usage() -> None:
+    """Перемірює теки, чий замір старший за USAGE_TTL_SEC; обхід дерева — у потоці."""
+    now = time.monotonic()
+    stale = [ws for ws in list(_active.values()) if now - ws._measured >= USAGE_TTL_SEC]
+    if not stale:
+        return
+    sizes = await asyncio.to_thread(lambda: [_tree_size(ws.path) for ws in stale])
+    now = time.monotonic()
+    for ws, size in zip(stale, sizes):
+        ws._used = size
+        ws._measured = now
+
+
+def _fits(n: int) -> bool:
+    # одна задача проходить завжди, інакше квоту менше за резерв не пройти ніколи
+    return not _active or _charged() + _orphan_bytes + n <= DL_DISK_QUOTA_MB * MB
+
+
+def _free(n: int) -> None:
+    global _reserved
+    _reserved = max(0, _reserved - n)
+    while _waiters:
+        fut = _waiters.popleft()
+        if not fut.done():
+            fut.set_result(None)
+
+
+async def acquire(root: str) -> Workspace:
+    """Нова робоча тека під квотою; DiskQuotaExceeded, якщо місце не звільнилось вчасно."""
+    global _reserved
+    need = int(DL_JOB_RESERVE_MB) * MB
+    deadline = time.monotonic() + float(DL_QUOTA_WAIT_SEC)
+    waited = False
+    while True:
+        await _refresh_usage()
+        if _fits(need):
+            break
+        left = deadline - time.monotonic()
+        if left <= 0:
+            _stats["rejected"] += 1
+            raise DiskQuotaExceeded("Диск для завантажень зайнятий, спробуй за хвилину")
+        if not waited:
+            _stats["waited"] += 1
+            waited = True
+            log.info(f"workspace: waiting for disk quota ({_charged() // MB} MB in use)")
+        fut = asyncio.get_running_loop().create_future()
+        _waiters.append(fut)
+        try:
+            # будить release(); файли можуть зникнути і без нього — перевіряємо й самі
+            await asyncio.wait_for(fut, timeout=min(left, RECHECK_SEC))
+        except asyncio.TimeoutError:
+            pass
+    _reserved += need
+    try:
+        ws = Workspace(root, need)
+    except BaseException:
+        _free(need)
+        raise
+    _active[ws.path] = ws
+    _stats["created"] += 1
+    return ws
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, f))
+            except OSError:
+                pass
+    return total
+
+
+def sweep(root: str, max_age: float) -> Tuple[int, int]:
+    """Видаляє неактивні job-* старші за max_age; повертає (скільки, байт)."""
+    global _orphan_bytes
+    if not os.path.isdir(root):
+        return 0, 0
+    now = time.time()
+    removed, freed, orphans = 0, 0, 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not name.startswith(PREFIX) or path in _active:
+            continue
+        try:
+            age = now - os.path.getmtime(path)
+        except OSError:
+            continue
+        size = _tree_size(path) if os.path.isdir(path) else os.path.getsize(path)
+        if age < max_age:
+            orphans += size
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        removed += 1
+        freed += size
+    _orphan_bytes = orphans
+    _stats["swept"] += removed
+    _stats["swept_bytes"] += freed
+    if removed:
+        log.info(f"workspace janitor: removed {removed} orphan(s), {freed // MB} MB")
+    return removed, freed
+
+
+async def janitor_loop(root: str):
+    # усе, що створено до старту процесу, — сироти після падіння/рестарту
+    max_age = time.time() - _BOOT
+    while True:
+        try:
+            removed, _ = await asyncio.to_thread(sweep, root, max_age)
+            if removed:
+                _free(0)  # будимо тих, хто чекає квоту
+        except Exception as e:
+            log.warning(f"workspace janitor error: {e}")
+        await asyncio.sleep(DL_JANITOR_EVERY_SEC)
+        max_age = DL_WORKSPACE_MAX_AGE_SEC
+
+
+def stats() -> dict:
+    return {
+        **_stats,
+        "active": len(_active),
+        "reserved_mb": _reserved // MB,
+        "used_mb": sum(ws.used() for ws in list(_active.values())) // MB,
+        "orphan_mb": _orphan_bytes // MB,
+        "quota_mb": DL_DISK_QUOTA_MB,
+        "waiting": sum(1 for f in _waiters if not f.done()),
+    }
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+# services/ytdlp_pool.py
+"""
+Пул "прогрітих" процесів yt-dlp.
+
+Замість холодного `yt-dlp ...` на кожну спробу (імпорт + ініціалізація
+екстракторів — секунди на VPS) тримаємо YTDLP_WORKERS процесів, які один раз
+імпортують yt_dlp і далі виконують задачі через Python API:
+    - та сама argv, що й для CLI (без шляху до бінарника), розбирається
+      yt_dlp.parse_options, тож стратегії з _build_cmds лишаються спільними;
+    - результат структурований: {"title", "id", "files": [{"path", "ext"}]}
+      (шляхи — з post_hooks, тобто вже після merge / -x);
+    - --load-info-json (після pre-flight) качає з готового info без
+      повторної екстракції.
+
+Воркер — окремий інтерпретатор зі services/ytdlp_worker.py (лише stdlib і
+yt_dlp), з'єднаний з батьком через multiprocessing.Pipe.
+
+Воркер перезапускається після YTDLP_WORKER_MAX_JOBS задач. Таймаут і
+скасування — жорсткі: процес вбивається, на його місце стартує новий.
+
+Прогрес завантаження воркер шле у pipe (не частіше ніж раз на секунду) —
+on_progress отримує {"percent", "total", "speed", "eta"} у форматі,
+як у рядках прогресу CLI.
+
+Викликається з потоків (_run_cmd, _ytdlp_info через _in_thread) — API синхронне.
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from config import YTDLP_WORKERS, YTDLP_WORKER_MAX_JOBS, log
+
+try:
+    import yt_dlp  # noqa: F401
+    AVAILABLE = True
+except Exception:
+    AVAILABLE = False
+
+# дочірній процес — окремий скрипт, а не multiprocessing spawn: spawn
+# перевиконує імпорти __main__ (bot.py: хендлери, пул БД, екзекутори)
+_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ytdlp_worker.py")
+
+
+class YtdlpCancelled(RuntimeError):
+    pass
+
+
+class _Worker:
+    def __init__(self):
+        self.conn, child = mp.Pipe()
+        try:
+            self.proc = subprocess.Popen(
+                [sys.executable, _WORKER_SCRIPT, str(child.fileno())],
+                pass_fds=(child.fileno(),),
+                stdin=subprocess.DEVNULL,
+                start_new_session=True,  # kill забирає і ffmpeg, запущений yt-dlp
+            )
+        finally:
+            child.close()
+        self.jobs = 0
+        self.ready = False
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def crashed(self) -> RuntimeError:
+        try:
+            code = self.proc.wait(2)
+        except subprocess.TimeoutExpired:
+            code = None
+        self.kill()
+        return RuntimeError(f"yt-dlp worker crashed (exit code {code})")
+
+    def wait_ready(self, timeout: float) -> None:
+        if self.ready:
+            return
+        deadline = time.monotonic() + timeout
+        while not self.conn.poll(0.5):
+            if not self.alive():
+                raise self.crashed()
+            if time.monotonic() > deadline:
+                raise RuntimeError("yt-dlp worker warm-up timeout")
+        try:
+            status, _ = self.conn.recv()
+        except (EOFError, OSError):
+            raise self.crashed()
+        self.ready = status == "ready"
+
+    def kill(self) -> None:
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        except Exception:
+            self.proc.kill()
+        try:
+            self.proc.wait(5)
+        except Exception:
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+            self.proc.wait(2)
+        except Exception:
+            pass
+        if self.alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class YtdlpPool:
+    def __init__(self, size: int, max_jobs: int):
+        self.size = max(1, int(size))
+        self.max_jobs = max(1, int(max_jobs))
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self.jobs_total = 0
+        self.failed = 0
+        self.killed = 0
+        self.recycled = 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for _ in range(self.size):
+                self._idle.put(_Worker())
+        log.info(f"yt-dlp worker pool started: {self.size} worker(s)")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._started = False
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+    def run(
+        self,
+        kind: str,
+        argv: List[str],
+        timeout: float,
+        cancel_event: Optional[threading.Event] = None,
+        on_progress: Optional[Callable[[Dict], None]] = None,
+    ) -> Dict:
+        """Виконує задачу у вільному воркері; кидає RuntimeError / YtdlpCancelled."""
+        self.start()
+        deadline = time.monotonic() + timeout
+        worker = self._checkout(deadline, cancel_event)
+        try:
+            worker.wait_ready(max(0.1, deadline - time.monotonic()))
+            worker.conn.send((kind, argv))
+            while True:
+                # смерть процесу перевіряємо до дедлайну: краш — не таймаут
+                if not worker.conn.poll(0.5):
+                    if not worker.alive():
+                        raise EOFError
+                    cancelled = cancel_event is not None and cancel_event.is_set()
+                    if cancelled or time.monotonic() > deadline:
+                        worker.kill()
+                        self.killed += 1
+                        worker = None
+                        if cancelled:
+                            raise YtdlpCancelled("yt-dlp cancelled")
+                        raise RuntimeError("yt-dlp timeout")
+                    continue
+                status, payload = worker.conn.recv()
+                if status != "progress":
+                    break
+                if on_progress is not None:
+                    try:
+                        on_progress(payload)
+                    except Exception:
+                        pass
+        except (EOFError, OSError):
+            crash = worker.crashed() if worker is not None else RuntimeError("yt-dlp worker crashed")
+            worker = None
+            self.failed += 1
+            raise crash
+        finally:
+            self._checkin(worker)
+
+        self.jobs_total += 1
+        if status != "ok":
+            self.failed += 1
+            raise RuntimeError(payload or "yt-dlp error")
+        return payload
+
+    def _checkout(self, deadline: float, cancel_event: Optional[threading.Event]) -> _Worker:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise YtdlpCancelled("yt-dlp cancelled")
+            try:
+                return self._idle.get(timeout=0.5)
+            except queue.Empty:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("yt-dlp pool busy")
+
+    def _checkin(self, worker: Optional[_Worker]) -> None:
+        """
+        Повертає воркер у пул; вбитий або "втомлений" — замінюється свіжим.
+        Після shutdown() воркер, що дороблював задачу, зупиняється, а не повертається.
+        """
+        if worker is not None:
+            worker.jobs += 1
+            with self._lock:
+                if self._started and worker.jobs < self.max_jobs:
+                    self._idle.put(worker)
+                    return
+            worker.stop()
+            if not self._started:
+                return
+            self.recycled += 1
+        with self._lock:
+            if self._started:
+                self._idle.put(_Worker())
+
+    def stats(self) -> dict:
+        return {
+            "available": AVAILABLE,
+            "workers": self.size,
+            "idle": self._idle.qsize(),
+            "jobs_total": self.jobs_total,
+            "failed": self.failed,
+            "killed": self.killed,
+            "recycled": self.recycled,
+        }
+
+
+_pool = YtdlpPool(YTDLP_WORKERS, YTDLP_WORKER_MAX_JOBS)
+
+
+def start() -> None:
+    if AVAILABLE:
+        _pool.start()
+
+
+def shutdown() -> None:
+    _pool.shutdown()
+
+
+def download(
+    argv: List[str],
+    timeout: float,
+    cancel_event: Optional[threading.Event] = None,
+    on_progress: Optional[Callable[[Dict], None]] = None,
+) -> Dict:
+    return _pool.run("download", argv, timeout, cancel_event, on_progress)
+
+
+def info(argv: List[str], timeout: float, cancel_event: Optional[threading.Event] = None) -> Dict:
+    return _pool.run("info", argv, timeout, cancel_event)
+
+
+def stats() -> dict:
+    return _pool.stats()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# services/ytdlp_worker.py
+"""
+Дочірній процес пулу yt-dlp (services/ytdlp_pool.py).
+
+Запускається окремим інтерпретатором як скрипт:
+    python services/ytdlp_worker.py <fd>
+де fd — успадкований кінець socketpair від multiprocessing.Pipe. Імпортує
+лише stdlib і yt_dlp: ні bot.py, ні хендлерів, ні пулу БД, ні config —
+на відміну від multiprocessing spawn, що перевиконує імпорти __main__.
+
+Протокол: ("download" | "info", argv) -> ("progress", {...})* + ("ok", result)
+або ("error", текст); None — завершитись.
+"""
+
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class _Collector:
+    """logger для YoutubeDL: помилки збираємо, щоб віддати як stderr CLI."""
+
+    def __init__(self):
+        self.errors: List[str] = []
+
+    def debug(self, msg):
+        pass
+
+    info = debug
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        self.errors.append(str(msg))
+
+
+def _ydl(argv: List[str]):
+    import yt_dlp
+
+    parsed = yt_dlp.parse_options(argv)
+    collector = _Collector()
+    opts = dict(parsed.ydl_opts)
+    opts["logger"] = collector
+    opts["noprogress"] = True
+    return yt_dlp.YoutubeDL(opts), parsed, collector
+
+
+def _fmt_bytes(n) -> Optional[str]:
+    if not n:
+        return None
+    n = float(n)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if n < 1024 or unit == "GiB":
+            return f"{n:.2f}{unit}"
+        n /= 1024
+
+
+def _progress_hook(conn) -> Callable[[Dict], None]:
+    last = [0.0]
+
+    def hook(d: Dict) -> None:
+        if d.get("status") != "downloading" or time.monotonic() - last[0] < 1.0:
+            return
+        last[0] = time.monotonic()
+        total = d.get("total_bytes") or d.get("total_bytes_estimate")
+        done = d.get("downloaded_bytes") or 0
+        eta = d.get("eta")
+        conn.send(("progress", {
+            "percent": round(100.0 * done / total, 1) if total else None,
+            "total": _fmt_bytes(total),
+            "speed": (_fmt_bytes(d.get("speed")) or "") + "/s" if d.get("speed") else None,
+            "eta": f"{int(eta) // 60:02d}:{int(eta) % 60:02d}" if eta is not None else None,
+        }))
+    return hook
+
+
+def _meta_grabber():
+    """PostProcessor на pre_process: title / id кожного відео до завантаження."""
+    from yt_dlp.postprocessor import PostProcessor
+
+    class _Meta(PostProcessor):
+        def __init__(self):
+            super().__init__()
+            self.seen: List[Dict] = []
+
+        def run(self, info):
+            self.seen.append({"title": str(info.get("title") or ""), "id": str(info.get("id") or "")})
+            return [], info
+
+    return _Meta()
+
+
+def _job_download(argv: List[str], conn) -> Dict:
+    ydl, parsed, collector = _ydl(argv)
+    files: List[str] = []
+    meta = _meta_grabber()
+    ydl.add_post_hook(files.append)
+    ydl.add_progress_hook(_progress_hook(conn))
+    ydl.add_post_processor(meta, when="pre_process")
+    retcode = 0
+    with ydl:
+        info_file = parsed.options.load_info_filename
+        if info_file:
+            # --load-info-json: формати вже розібрані на pre-flight, без повторної екстракції
+            retcode |= ydl.download_with_info_file(info_file)
+        if parsed.urls:
+            retcode |= ydl.download(parsed.urls)
+    # як і CLI: помилки окремих елементів не кидаються, а лише дають ненульовий код
+    if retcode and not files:
+        raise RuntimeError("\n".join(collector.errors) or "yt-dlp error")
+    first = meta.seen[0] if meta.seen else {"title": "", "id": ""}
+    out = []
+    for path in dict.fromkeys(files):  # без дублікатів, порядок збережено
+        out.append({"path": path, "ext": path.rsplit(".", 1)[-1].lower() if "." in path else ""})
+    return {"title": first["title"], "id": first["id"], "files": out}
+
+
+def _job_info(argv: List[str], conn) -> Dict:
+    ydl, parsed, collector = _ydl(argv)
+    ydl.params["forcejson"] = False  # --dump-json: результат повертаємо, а не друкуємо
+    with ydl:
+        info = ydl.extract_info(parsed.urls[0], download=False)
+        if not info:
+            raise RuntimeError("\n".join(collector.errors) or "yt-dlp info error")
+        return ydl.sanitize_info(info)
+
+
+def worker_main(conn) -> None:
+    # прогрів: імпорт та ініціалізація класів екстракторів
+    import yt_dlp
+    from yt_dlp.extractor import gen_extractor_classes
+    list(gen_extractor_classes())
+    del yt_dlp
+    conn.send(("ready", None))
+
+    jobs = {"download": _job_download, "info": _job_info}
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+        kind, argv = msg
+        try:
+            conn.send(("ok", jobs[kind](argv, conn)))
+        except BaseException as e:  # yt_dlp кидає і SystemExit на погані опції
+            conn.send(("error", f"{type(e).__name__}: {e}"[:4000]))
+
+
+if __name__ == "__main__":
+    from multiprocessing.connection import Connection
+
+    worker_main(Connection(int(sys.argv[1])))
@@ -38,6 +38,29 @@ CREATE TABLE IF NOT EXISTS joke_history (
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- chat members seen by the bot; username_lc backs case-insensitive @username lookups
+CREATE TABLE IF NOT EXISTS user_map (
+  chat_id BIGINT NOT NULL,
+  user_id BIGINT NOT NULL,
+  username VARCHAR(255) NULL,
+  username_lc VARCHAR(255) GENERATED ALWAYS AS (LOWER(username)) STORED,
+  first_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (chat_id, user_id),
+  KEY ix_chat_username (chat_id, username),
+  KEY ix_chat_username_lc (chat_id, username_lc)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Telegram file_id already sent media (repeated links are re-sent without downloading)
+CREATE TABLE IF NOT EXISTS media_cache (
+  cache_key CHAR(40) NOT NULL PRIMARY KEY,
+  url TEXT NOT NULL,
+  mode VARCHAR(16) NOT NULL,
+  payload TEXT NOT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  KEY ix_created (created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 CREATE INDEX idx_chat_mode ON chats (mode);
 CREATE INDEX idx_joke_chat ON jokes (chat_id);
 CREATE INDEX idx_joke_hist_chat ON joke_history (chat_id);
@@ -2,39 +2,23 @@ import re
 from datetime import datetime, time as dtime
 from aiogram.types import Message, ChatPermissions
 from config import ADMINS
-from db import db
+from db import execute
+from services import user_map, chat_settings, mutes
 
 MENTION_RE = re.compile(r'@([A-Za-z0-9_]{2,})')
 
-def upsert_chat(chat_id: int):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("INSERT IGNORE INTO chats (chat_id) VALUES (%s)", (chat_id,))
+async def upsert_chat(chat_id: int):
+    await chat_settings.ensure(chat_id)
 
-def get_chat(chat_id: int):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("SELECT * FROM chats WHERE chat_id=%s", (chat_id,))
-        return cur.fetchone()
+async def get_chat(chat_id: int):
+    return await chat_settings.get(chat_id)
 
-def remember_user(chat_id: int, user_id: int, username: str|None):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO user_map (chat_id, user_id, username)
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                username = VALUES(username),
-                last_seen = CURRENT_TIMESTAMP
-        """, (chat_id, user_id, username))
+async def remember_user(chat_id: int, user_id: int, username: str|None):
+    # запис у user_map іде через write-behind буфер (services/user_map.py)
+    user_map.remember(chat_id, user_id, username)
 
-def resolve_username_to_id(chat_id: int, uname: str):
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("""
-          SELECT user_id FROM user_map
-          WHERE chat_id=%s AND username=%s
-          ORDER BY last_seen DESC
-          LIMIT 1
-        """, (chat_id, uname))
-        row = cur.fetchone()
-        return int(row["user_id"]) if row else None
+async def resolve_username_to_id(chat_id: int, uname: str):
+    return await user_map.resolve_username(chat_id, uname)
 
 def extract_mention(m: Message):
     uid = None
@@ -83,7 +67,7 @@ async def resolve_target_and_reason(m: Message, bot) -> tuple[int|None, str|None
         if mu:
             uname = mu.group(1)
             reason = (args[:mu.start()] + args[mu.end():]).strip()
-            uid = resolve_username_to_id(m.chat.id, uname)
+            uid = await resolve_username_to_id(m.chat.id, uname)
             if uid: return uid, uname, reason
             return None, uname, reason
         first = args.split()[0]
@@ -105,16 +89,9 @@ def in_quiet(chat_row) -> bool:
     except Exception:
         return False
 
-def is_muted_now(chat_id: int, user_id: int) -> bool:
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("SELECT muted_until FROM user_moderation WHERE chat_id=%s AND user_id=%s", (chat_id, user_id))
-        row = cur.fetchone()
-        if not row or not row.get("muted_until"): return False
-        try:
-            from datetime import datetime as _dt
-            return _dt.utcnow() < row["muted_until"]
-        except Exception:
-            return False
+async def is_muted_now(chat_id: int, user_id: int) -> bool:
+    # без I/O: індекс активних мʼютів у пам'яті (services/mutes.py)
+    return mutes.is_muted(chat_id, user_id)
 
 async def restrict_for_minutes(bot, chat_id: int, user_id: int, minutes: int):
     from datetime import datetime, timedelta
@@ -124,6 +101,9 @@ async def restrict_for_minutes(bot, chat_id: int, user_id: int, minutes: int):
         permissions=ChatPermissions(can_send_messages=False),
         until_date=until
     )
-    with db() as conn, conn.cursor() as cur:
-        cur.execute("UPDATE user_moderation SET muted_until=%s WHERE chat_id=%s AND user_id=%s",
-                    (until, chat_id, user_id))
+    # upsert, а не UPDATE: /mute без попередніх варнів ще не має рядка в user_moderation
+    await execute("""
+        INSERT INTO user_moderation (chat_id, user_id, muted_until) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE muted_until = VALUES(muted_until)
+    """, (chat_id, user_id, until))
+    mutes.set_muted(chat_id, user_id, until)